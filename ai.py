@@ -1,14 +1,28 @@
 # File: ai.py
 # Author: iBug
 
+import json
+import math
+import os
 import random
+import threading
+import time
+
+import endgame
 
 # import some constants
 from reversi import BS, EMPTY, BLACK, WHITE
+from tables import DIRECTIONS, CLASS_INNER, CLASS_EDGE, CLASS_CORNER
 
 inf = 999999  # Don't use math.inf
 MIN_NODES = 10000
 MIN_TICK = 1000
+MAX_STATES = 1 << 20  # Saved evaluations kept before the table is flushed
+PONDER_WIDTH = 4  # Opponent moves considered when pondering
+MAX_PV = 12  # Longest principal variation reported by analyze()
+SLICE_TIME = 0.01  # Seconds a SlicedSearch runs for at a time in findBestStepAsync
+PROBCUT_STAGES = 4  # Game stages ProbCut is calibrated for, by the share of empty squares
+PROBCUT_THRESHOLD = 1.5  # Standard deviations a shallow search must clear for ProbCut to prune
 
 # flake8 ............
 SCORE = [
@@ -25,6 +39,18 @@ SCORE = [
 BONUS = 30
 LIBERTY = 8
 STABILITY = [2, 4, 6, 10, 15]
+MOBILITY = 1
+POTENTIAL = 1  # Per empty square next to the opponent's discs
+FRONTIER = 1  # Taken off per disc next to an empty square
+
+DEFAULT_WEIGHTS = {'SCORE': SCORE, 'BONUS': BONUS, 'LIBERTY': LIBERTY, 'STABILITY': STABILITY, 'MOBILITY': MOBILITY,
+                   'POTENTIAL': POTENTIAL, 'FRONTIER': FRONTIER}
+
+# Weights fitted by tune.py replace the ones above when this file exists
+WEIGHTS_FILE = os.environ.get("REVERSI_WEIGHTS", os.path.join(os.path.dirname(os.path.abspath(__file__)), "weights.json"))
+
+# ProbCut calibration written by tune.py, selective search is off without it
+PROBCUT_FILE = os.environ.get("REVERSI_PROBCUT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "probcut.json"))
 
 AICONFIG = [
     (1, 22, 0),
@@ -38,18 +64,149 @@ AICONFIG = [
     (8, 18, 4)
 ]
 
-DIRECTIONS = [(x - 1, y - 1) for i in range(3) for y, x in enumerate([i] * 3)]
+# Square weights of heuristicEval_1
+CLASS_SCORES = {CLASS_INNER: 1, CLASS_EDGE: 2, CLASS_CORNER: 5}
+
+
+def loadWeights(path=WEIGHTS_FILE):
+    """
+    Evaluation weights from a file written by tune.py, the built-in ones for what it doesn't have
+    """
+    weights = dict(DEFAULT_WEIGHTS)
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        return weights
+    weights.update((key, saved[key]) for key in weights if key in saved)
+    return weights
+
+
+WEIGHTS = loadWeights()
+
+
+NO_PROBCUT = {'cuts': {}, 'threshold': PROBCUT_THRESHOLD, 'extraDepth': 0}
+
+
+def loadProbCut(path=PROBCUT_FILE):
+    """
+    ProbCut calibration from a file written by tune.py, as a dict of
+        cuts:       {(evaluator, stage, depth): [(shallow depth, a, b, sigma)]}
+        threshold:  Standard deviations a prediction must clear to prune
+        extraDepth: Plies added to the depth of the levels it applies to
+    No cuts if there's no such file.
+    """
+    probCut = dict(NO_PROBCUT, cuts={})
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        return probCut
+    probCut['threshold'] = saved.get('threshold', PROBCUT_THRESHOLD)
+    probCut['extraDepth'] = saved.get('extraDepth', 0)
+    for c in saved['cuts']:
+        key = c['evaluator'], c['stage'], c['depth']
+        probCut['cuts'].setdefault(key, []).append((c['shallow'], c['a'], c['b'], c['sigma']))
+    for pairs in probCut['cuts'].values():
+        pairs.sort()  # Cheapest first
+    return probCut
+
+
+PROBCUT = loadProbCut()
+
+
+def gameStage(game):
+    """
+    The stage of a game ProbCut is calibrated for, from 0 (the end) to PROBCUT_STAGES - 1
+    """
+    n = game.size * game.size
+    _, ccBlack, ccWhite = game.chessCount
+    return (n - ccBlack - ccWhite) * PROBCUT_STAGES // (n + 1)
+
+
+def finish(steps):
+    """
+    Run a search generator (such as ReversiAI.searchSteps) to the end, returns its result
+    """
+    try:
+        while True:
+            next(steps)
+    except StopIteration as e:
+        return e.value
+
+
+class SearchTimeout(Exception):
+    """
+    Raised from inside a search when its time budget is spent or it's cancelled
+    """
+    pass
 
 
 class ReversiAI:
-    def __init__(self):
+    def __init__(self, level=None, saveState=None, weights=None, probCut=None):
+        """
+        level defaults to the strongest one, and engines of the same level
+        may share their table of evaluated positions through saveState.
+        weights defaults to WEIGHTS, see loadWeights(), and probCut to PROBCUT, see loadProbCut()
+        """
+        self.setWeights(WEIGHTS if weights is None else weights)
+        self.probCut = PROBCUT if probCut is None else probCut
+        self.cuts = dict()  # (stage, depth) -> ProbCut pairs of the current evaluator
         self.nodeCount = 0
+        self.nextTick = MIN_TICK
+        self.sliceNodes = None  # Nodes left in the slice of a SlicedSearch
+        self.sliceDeadline = None  # time.monotonic() value at which it ends
+        self.deadline = None  # time.monotonic() value to stop searching at
+        self.cancelled = None  # Callable polled every MIN_TICK nodes
+        self.progress = None  # Callable given the node count every MIN_TICK nodes
+        self.interrupted = False  # Whether the last findBestStep was cut short
+        self.ponderMoves = dict()  # Position key -> reply found while pondering
+        self.bestMoves = dict()  # Position hash -> best move found by heuristicSearch
+        self.pondering = None  # (thread, stop event) of background pondering
         self.depth = 6
         self.maxDepth = None
         self.final = 16
-        self.aiLevel = 8
+        self.aiLevel = 8 if level is None else level
         self.saveState = dict()
+        self.maxStates = MAX_STATES
+        self.endgame = None  # An endgame.EndgameStore of solved positions
+        self.batched = False  # Whether leaves are scored in batches, by a batch.LeafScheduler
         self.setLevel()
+        if saveState is not None:
+            self.saveState = saveState
+
+    def setWeights(self, weights):
+        self.score = weights['SCORE']
+        self.bonus = weights['BONUS']
+        self.liberty = weights['LIBERTY']
+        self.stabilityWeights = weights['STABILITY']
+        self.mobility = weights['MOBILITY']
+        self.potential = weights['POTENTIAL']
+        self.frontier = weights['FRONTIER']
+        self.scoreTables = {BS: self.score}
+        self.classScores = dict()
+
+    def scoreTable(self, size):
+        """
+        The SCORE table of a board size: squares score as the square of the 8x8 table
+        at the same distance from the edges, or as the centre if they're further
+        """
+        try:
+            return self.scoreTables[size]
+        except KeyError:
+            def near(i):
+                return min(i, size - 1 - i, 3)
+            table = [[self.score[near(x)][near(y)] for y in range(size)] for x in range(size)]
+            self.scoreTables[size] = table
+            return table
+
+    def classScore(self, game):
+        try:
+            return self.classScores[game.size]
+        except KeyError:
+            table = [[CLASS_SCORES[c] for c in col] for col in game.tables['SQUARE_CLASS']]
+            self.classScores[game.size] = table
+            return table
 
     # Heuristic Reversi game evaluation methods, chosen at different difficulties
     # Some are more complex than others!
@@ -64,54 +221,51 @@ class ReversiAI:
 
     def heuristicEval_1(self, game, player):
         s = [0, 0, 0]
-        for x in range(BS):
-            for y in range(BS):
-                if (x == 0 or x == BS - 1) and (y == 0 or y == BS - 1):
-                    s[game.board[x][y]] += 5
-                elif (x == 0 or x == BS - 1) or (y == 0 or y == BS - 1):
-                    s[game.board[x][y]] += 2
-                else:
-                    s[game.board[x][y]] += 1
+        for col, scores in zip(game.board, self.classScore(game)):
+            for chess, score in zip(col, scores):
+                s[chess] += score
         return s[1] - s[2]
 
     def heuristicEval_2(self, game, player):
-        return self.heuristicEval_1(game, player) * 2 + len(game.getAvailables(BLACK)) - len(game.getAvailables(WHITE))
+        movesB, _, _, movesW, _, _ = game.mobility()
+        return self.heuristicEval_1(game, player) * 2 + movesB - movesW
 
     def heuristicEval_3(self, game, player):
         s = [0, 0, 0]
-        for x in range(BS):
-            for y in range(BS):
-                s[game.board[x][y]] += STABILITY[self.stability(game, (x, y))]
-        s[1] += len(game.getAvailables(BLACK))
-        s[2] += len(game.getAvailables(WHITE))
+        weights = self.stabilityWeights
+        for x, y in game.squares:
+            s[game.board[x][y]] += weights[self.stability(game, (x, y))]
+        movesB, potentialB, frontierB, movesW, potentialW, frontierW = game.mobility()
+        s[1] += movesB * self.mobility + potentialB * self.potential - frontierB * self.frontier
+        s[2] += movesW * self.mobility + potentialW * self.potential - frontierW * self.frontier
         return s[1] - s[2]
 
     def heuristicEval_4(self, game, player):
-        self.nodeCount += 1
         c1, c2, s1, s2 = 0, 0, 0, 0
         board = game.board
-        for x in range(BS):
-            for y in range(BS):
-                chess = board[x][y]
-                if chess == EMPTY:
-                    continue
-                liberty = 0
-                for dx, dy in DIRECTIONS:
-                        tx, ty = x + dx, y + dy
-                        if 0 <= tx < BS and 0 <= ty < BS and board[tx][ty] == EMPTY:
-                            liberty += 1
-                if chess == BLACK:
-                    c1 += 1
-                    s1 += SCORE[x][y] - liberty * LIBERTY
-                else:
-                    c2 += 1
-                    s2 += SCORE[x][y] - liberty * LIBERTY
+        n = game.size
+        score, libertyWeight, bonus = self.scoreTable(n), self.liberty, self.bonus
+        neighbours = game.tables['NEIGHBOURS']
+        for x, y in game.squares:
+            chess = board[x][y]
+            if chess == EMPTY:
+                continue
+            liberty = 0
+            for tx, ty in neighbours[x][y]:
+                if board[tx][ty] == EMPTY:
+                    liberty += 1
+            if chess == BLACK:
+                c1 += 1
+                s1 += score[x][y] - liberty * libertyWeight
+            else:
+                c2 += 1
+                s2 += score[x][y] - liberty * libertyWeight
 
         if c1 == 0:
             return -inf
         if c2 == 0:
             return inf
-        if c1 + c2 == BS ** 2:
+        if c1 + c2 == n * n:
             if c1 > c2:
                 return inf
             if c2 > c1:
@@ -125,70 +279,69 @@ class ReversiAI:
             chess = board[x][y]
             if chess != EMPTY:
                 for cx, cy in adjacents:
-                    chess = board[cx][cy]
-                    if chess == EMPTY:
+                    adjacent = board[cx][cy]
+                    if adjacent == EMPTY:
                         continue
-                    if chess == BLACK:
-                        s1 -= SCORE[cx][cy]
+                    if adjacent == BLACK:
+                        s1 -= score[cx][cy]
                     else:
-                        s2 -= SCORE[cx][cy]
+                        s2 -= score[cx][cy]
 
                 tx, ty = x, y
-                for i in range(0, BS - 2):
+                for i in range(0, n - 2):
                     tx += dx
                     if board[tx][ty] != chess:
                         break
                     if chess == BLACK:
-                        s1 += BONUS
+                        s1 += bonus
                     else:
-                        s2 += BONUS
+                        s2 += bonus
 
                 tx, ty = x, y
-                for i in range(0, BS - 2):
+                for i in range(0, n - 2):
                     ty += dy
                     if board[tx][ty] != chess:
                         break
                     if chess == BLACK:
-                        s1 += BONUS
+                        s1 += bonus
                     else:
-                        s2 += BONUS
+                        s2 += bonus
 
         checkCorner((0, 0), [(0, 1), (1, 0), (1, 1)], (1, 1))
-        checkCorner((BS - 1, 0), [(BS - 2, 0), (BS - 2, 1), (BS - 1, 1)], (-1, 1))
-        checkCorner((0, BS - 1), [(0, BS - 2), (1, BS - 2), (1, BS - 1)], (1, -1))
-        checkCorner((BS - 1, BS - 1), [(BS - 2, BS - 2), (BS - 2, BS - 1), (BS - 1, BS - 2)], (-1, -1))
+        checkCorner((n - 1, 0), [(n - 2, 0), (n - 2, 1), (n - 1, 1)], (-1, 1))
+        checkCorner((0, n - 1), [(0, n - 2), (1, n - 2), (1, n - 1)], (1, -1))
+        checkCorner((n - 1, n - 1), [(n - 2, n - 2), (n - 2, n - 1), (n - 1, n - 2)], (-1, -1))
 
         return s1 - s2
 
     def stability(self, game, pos):
+        """
+        In how many of the 4 lines through a disc it's closed at both ends,
+        by the edge of the board or by the opponent
+        """
         board = game.board
         x, y = pos
         chess = board[x][y]
         if chess == EMPTY:
             return 0
-        other = [None, WHITE, BLACK]
-        dx = [(0, 0), (-1, 1), (-1, 1), (1, -1)]
-        dy = [(-1, 1), (0, 0), (-1, 1), (-1, 1)]
+        other = BLACK + WHITE - chess
 
         degree = 0
-        for k in range(4):
-            tx = [x, x]
-            ty = [y, y]
-            for i in range(2):
-                while 0 <= tx[i] + dx[k][i] < 8 and 0 <= ty[i] + dy[k][i] < 8 and \
-                        board[tx[i] + dx[k][i]][ty[i] + dy[k][i]] == chess:
-                    tx[i] += dx[k][i]
-                    ty[i] += dy[k][i]
-            if not (0 <= tx[0] + dx[k][0] < 8 and 0 <= ty[0] + dy[k][0] < 8) or \
-                    not (0 <= tx[1] + dx[k][1] < 8 and 0 <= ty[1] + dy[k][1] < 8):
-                degree += 1
-            elif board[tx[0] + dx[k][0]][ty[0] + dy[k][0]] == other[chess] and \
-                    board[tx[1] + dx[k][1]][ty[1] + dy[k][1]] == other[chess]:
+        for ray1, ray2 in game.tables['LINES'][x][y]:
+            end1 = end2 = None  # None if the run goes to the edge
+            for tx, ty in ray1:
+                if board[tx][ty] != chess:
+                    end1 = board[tx][ty]
+                    break
+            for tx, ty in ray2:
+                if board[tx][ty] != chess:
+                    end2 = board[tx][ty]
+                    break
+            if end1 is None or end2 is None or (end1 == other and end2 == other):
                 degree += 1
         return degree
 
     def exactScore(self, game, player):
-        self.nodeCount += 1
         _, ccBlack, ccWhite = game.chessCount
         score = 0
         if ccBlack > ccWhite:
@@ -197,43 +350,113 @@ class ReversiAI:
             score = -inf
         return score
 
-    def getHeuristicScore(self, game, player, step):
-        game.put(step)
+    def tick(self):
+        """
+        Count a search node or a move evaluation,
+        and every MIN_TICK of them check if the search should stop
+
+        Returns True once the current slice of a SlicedSearch is used up
+        """
+        self.nodeCount += 1
+        if self.nodeCount >= self.nextTick:
+            self.nextTick = self.nodeCount + MIN_TICK
+            if self.progress is not None:
+                self.progress(self.nodeCount)
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                raise SearchTimeout()
+            if self.cancelled is not None and self.cancelled():
+                raise SearchTimeout()
+        if self.sliceNodes is None:
+            return False
+        # Counted down rather than compared with nodeCount, which the search resets when it starts
+        self.sliceNodes -= 1
+        return self.sliceNodes <= 0 or time.monotonic() >= self.sliceDeadline
+
+    def savedScore(self, game, player):
+        """
+        Heuristic score of a position, looked up in saveState first
+        """
+        # Keyed by the exact position, so positions are found from any Reversi object
+        key = game.key()
         try:
-            score = self.saveState[game]
+            return self.saveState[key]
         except KeyError:
             score = self.heuristicScore(game, player)
-            self.saveState[game] = score
+            if len(self.saveState) >= self.maxStates:
+                self.saveState.clear()
+            self.saveState[key] = score
+            return score
+
+    def getHeuristicScore(self, game, player, step):
+        self.tick()
+        game.put(step)
+        score = self.savedScore(game, player)
         game.undo()
         return score
 
+    def scoreStepsSteps(self, game, player, steps):
+        """
+        Heuristic scores of the positions after each of steps, as a generator that returns them
+
+        When batched, it yields the boards of the positions not in saveState instead of scoring
+        them, and expects their scores to be sent back (see batch.LeafScheduler).
+        """
+        if not self.batched or game.size != BS:
+            return [self.getHeuristicScore(game, player, step) for step in steps]
+        scores = []
+        missing = []  # (index, key) of the positions to score
+        boards = []
+        for step in steps:
+            self.tick()
+            game.put(step)
+            key = game.key()
+            score = self.saveState.get(key)
+            if score is None:
+                missing.append((len(scores), key))
+                boards.append([list(col) for col in game.board])
+            scores.append(score)
+            game.undo()
+        if boards:
+            values = yield boards
+            if len(self.saveState) + len(values) > self.maxStates:
+                self.saveState.clear()
+            for (i, key), score in zip(missing, values):
+                scores[i] = self.saveState[key] = score
+        return scores
+
     def heuristicSearch(self, game, player, depth, alpha, beta):
+        return finish(self.heuristicSearchSteps(game, player, depth, alpha, beta))
+
+    def heuristicSearchSteps(self, game, player, depth, alpha, beta):
+        """
+        heuristicSearch as a generator, which yields when a slice of a SlicedSearch is over
+        and returns (score, step)
+        """
+        if self.tick():
+            yield
         if depth <= 0:
-            try:
-                return self.saveState[game]
-            except KeyError:
-                score = self.heuristicScore(game, player)
-                self.saveState[game] = score
-                return score
+            return self.savedScore(game, player)
+        if self.cuts and (alpha > -inf or beta < inf):
+            cut = yield from self.probCutSteps(game, player, depth, alpha, beta)
+            if cut is not None:
+                return cut, ()
 
         maxMode = (game.current == BLACK)
         score = -inf - 1 if maxMode else inf + 1
-        steps = game.getAvailables()
         bestStep = ()
 
-        if len(steps) > 0:
-            hValue = {}
-            for step in steps:
-                hValue[step] = self.getHeuristicScore(game, player, step)
-            steps = sorted(steps, key=lambda s: hValue[s], reverse=maxMode)
-
-            if depth == 1:
-                step = steps[0]
+        if depth == 1:
+            steps = game.getAvailables()
+            if len(steps) > 0:
+                scores = yield from self.scoreStepsSteps(game, player, steps)
+                hValue = dict(zip(steps, scores))
+                step = sorted(steps, key=lambda s: hValue[s], reverse=maxMode)[0]
                 return hValue[step], step
-
-            for step in steps:
+        else:
+            key = hash(game)
+            for step in self.orderedMoves(game, player, self.bestMoves.get(key)):
                 game.put(step)
-                rscore, rstep = self.heuristicSearch(game, player, depth - 1, alpha, beta)
+                rscore, rstep = yield from self.heuristicSearchSteps(game, player, depth - 1, alpha, beta)
                 game.undo()
                 if maxMode:
                     if rscore > score:
@@ -249,89 +472,437 @@ class ReversiAI:
                     if alpha >= beta:
                         # print("%d beta cut: %d, %d" % (depth, alpha, beta))
                         break
-        else:
-            if not game.over:
-                game.skipPut()
-                rscore, rstep = self.heuristicSearch(game, player, depth, alpha, beta)
-                game.undo()
-                return rscore, ()
-            else:
-                return self.exactScore(game, player), ()
-        return score, bestStep
+            if bestStep:
+                if len(self.bestMoves) >= self.maxStates:
+                    self.bestMoves.clear()
+                self.bestMoves[key] = bestStep
+                return score, bestStep
+
+        # No moves
+        if not game.over:
+            game.skipPut()
+            rscore, rstep = yield from self.heuristicSearchSteps(game, player, depth, alpha, beta)
+            game.undo()
+            return rscore, ()
+        return self.exactScore(game, player), ()
+
+    def orderedMoves(self, game, player, hashMove=None):
+        """
+        The moves of heuristicSearch, generated in stages as the search asks for them: the hash move
+        (the best one last time), the corners, then the rest best first by the heuristic.
+        A node that cuts off on an early move never generates or scores the rest.
+        """
+        if hashMove and game.canPut(*hashMove):
+            yield hashMove
+        for step in game.iterMoves(squares=game.tables['CORNERS']):
+            if step != hashMove:
+                yield step
+        steps = [step for step in game.iterMoves(squares=game.tables['MOVE_ORDER']) if step != hashMove]
+        hValue = {}
+        for step in steps:
+            hValue[step] = self.getHeuristicScore(game, player, step)
+        steps.sort(key=lambda s: hValue[s], reverse=(game.current == BLACK))
+        yield from steps
+
+    def stagedMoves(self, game, hashMove=None):
+        """
+        The moves of exactSearch, generated as the search asks for them: the hash move,
+        the corners, then the other squares in the order of MOVE_ORDER
+        """
+        if hashMove and game.canPut(*hashMove):
+            yield hashMove
+        for squares in (game.tables['CORNERS'], game.tables['MOVE_ORDER']):
+            for step in game.iterMoves(squares=squares):
+                if step != hashMove:
+                    yield step
+
+    def probCutSteps(self, game, player, depth, alpha, beta):
+        """
+        Multi-ProbCut: predict the score of a depth search from shallower ones, by the
+        calibrated regressions deep = a * shallow + b with an error of sigma.
+        Returns alpha or beta if the score is likely enough outside (alpha, beta), otherwise None.
+        """
+        t = self.probCut['threshold']
+        for shallow, a, b, sigma in self.cuts.get((gameStage(game), depth), ()):
+            # The shallow scores past which the deep one is t sigmas outside the window
+            if beta < inf:
+                high = math.ceil((beta - b + t * sigma) / a)
+                rscore, _ = yield from self.heuristicSearchSteps(game, player, shallow, high - 1, high)
+                if rscore >= high:
+                    return beta
+            if alpha > -inf:
+                low = math.floor((alpha - b - t * sigma) / a)
+                rscore, _ = yield from self.heuristicSearchSteps(game, player, shallow, low, low + 1)
+                if rscore <= low:
+                    return alpha
+        return None
 
     def exactSearch(self, game, player, depth, alpha, beta):
+        return finish(self.exactSearchSteps(game, player, depth, alpha, beta))
+
+    def exactSearchSteps(self, game, player, depth, alpha, beta):
+        """
+        exactSearch as a generator, see heuristicSearchSteps
+        """
+        if self.tick():
+            yield
         if depth <= 0:
             return self.exactScore(game, player), ()
 
+        store = self.endgame
+        if game.size != BS:
+            store = None  # Its keys only fit 8x8 boards
+        hashMove = None
+        if store is not None and depth >= store.minEmpties:
+            key, symmetry = store.key(game)
+            entry = store.get(key, symmetry)
+            if entry is not None:
+                result, bound, hashMove = entry
+                if bound == endgame.EXACT or (bound == endgame.LOWER and result * inf >= beta) or \
+                        (bound == endgame.UPPER and result * inf <= alpha):
+                    return result * inf, hashMove
+        alphaOrig, betaOrig = alpha, beta
+
         maxMode = (game.current == BLACK)
         score = -inf - 1 if maxMode else inf + 1
-        steps = game.getAvailables()
         bestStep = ()
 
-        if len(steps) > 0:
-            for step in steps:
-                game.put(step)
-                rscore, rstep = self.exactSearch(game, player, depth - 1, alpha, beta)
-                game.undo()
-
-                if maxMode:
-                    if rscore > score:
-                        score, bestStep = rscore, step
-                    alpha = max(alpha, score)
-                    if alpha >= beta:
-                        break
-                else:
-                    if rscore < score:
-                        score, bestStep = rscore, step
-                    beta = min(beta, score)
-                    if alpha >= beta:
-                        break
-        else:
+        for step in self.stagedMoves(game, hashMove):
+            game.put(step)
+            rscore, rstep = yield from self.exactSearchSteps(game, player, depth - 1, alpha, beta)
+            game.undo()
+
+            if maxMode:
+                if rscore > score:
+                    score, bestStep = rscore, step
+                alpha = max(alpha, score)
+                if alpha >= beta:
+                    break
+            else:
+                if rscore < score:
+                    score, bestStep = rscore, step
+                beta = min(beta, score)
+                if alpha >= beta:
+                    break
+        if not bestStep:
             if not game.over:
                 game.skipPut()
-                rscore, rstep = self.exactSearch(game, player, depth, alpha, beta)
+                rscore, rstep = yield from self.exactSearchSteps(game, player, depth, alpha, beta)
                 game.undo()
                 return rscore, ()
             else:
                 return self.exactScore(game, player), ()
+        if store is not None and depth >= store.minEmpties:
+            # Scores outside the window are only bounds
+            bound = endgame.UPPER if score <= alphaOrig else endgame.LOWER if score >= betaOrig else endgame.EXACT
+            store.put(key, symmetry, depth, (score > 0) - (score < 0), bound, bestStep)
         return score, bestStep
 
     def setLevel(self, level=None):
+        self.stopPondering()
+        self.ponderMoves.clear()
+        self.bestMoves.clear()
         if level is None:
             level = self.aiLevel
 
         self.aiLevel = level
         self.depth, self.final, evalLevel = AICONFIG[level]
-        self.heuristicScore = getattr(self, "heuristicEval_" + str(evalLevel))
+        self.evalLevel = evalLevel
+        self.cuts = {key[1:]: pairs for key, pairs in self.probCut['cuts'].items() if key[0] == evalLevel}
+        if self.cuts:
+            # What ProbCut saves goes into searching deeper
+            self.depth += self.probCut['extraDepth']
+        heuristicScore = getattr(self, "heuristicEval_" + str(evalLevel))
+
+        # Clear saved states, as they're only valid for one evaluation function
+        if heuristicScore != getattr(self, "heuristicScore", None):
+            self.saveState.clear()
+        self.heuristicScore = heuristicScore
+
+    def findBestStep(self, game, budget=None, cancelled=None, progress=None, deepen=False):
+        """
+        Find the best move for the current player
+
+        Stops pondering first, and answers at once if the position has been pondered.
+        See searchSteps() for the parameters.
+        """
+        step = self.ponderedStep(game)
+        if step is not None:
+            return step
+        return self.search(game, budget, cancelled, progress, deepen)
+
+    def ponderedStep(self, game):
+        """
+        Stop pondering, and return the reply found for the position if it's been pondered, otherwise None
+        """
+        self.stopPondering()
+        step = self.ponderMoves.get(game.key())
+        if step is not None and game.canPut(*step):
+            self.interrupted = False
+            self.nodeCount = 0
+            return step
+        return None
+
+    def search(self, game, budget=None, cancelled=None, progress=None, deepen=False):
+        return finish(self.searchSteps(game, budget, cancelled, progress, deepen))
+
+    def searchSteps(self, game, budget=None, cancelled=None, progress=None, deepen=False):
+        """
+        Search for the best move for the current player
 
-        # Clear saved states
-        self.saveState.clear()
+        Parameters:
+            budget:    Time limit in seconds, None for no limit
+            cancelled: A callable that returns True when the result is no longer wanted
+            progress:  A callable that receives the node count as the search goes
 
-    def findBestStep(self, game):
+        With a budget or deepen the heuristic search deepens iteratively, and if it's stopped
+        the best move of the deepest finished iteration is returned. Otherwise it searches to
+        the level's fixed depth, and if it's cancelled returns the first legal move.
+        self.interrupted tells if the search was stopped.
+
+        This is a generator that returns the move, see SlicedSearch for running it in slices.
+        """
         player = game.current
         steps = game.getAvailables()
         _, ccBlack, ccWhite = game.chessCount
         cc = ccBlack + ccWhite
+        self.interrupted = False
         if len(steps) <= 0:
             return ()
 
         # Random mode
-        if cc <= (BS - 4) ** 2:
+        n = game.size
+        if cc <= (n - 4) ** 2:
             randSteps = [(x, y) for x, y in steps
-                         if 2 <= x < BS - 2 and 2 <= y < BS - 2]
+                         if 2 <= x < n - 2 and 2 <= y < n - 2]
             if len(randSteps) > 0:
                 return random.choice(randSteps)
 
-        # Final mode: exact search
-        if cc >= BS ** 2 - self.final:
-            self.maxDepth = BS ** 2 - cc
-            self.nodeCount = 0
-            rscore, rstep = self.exactSearch(game, player, self.maxDepth, -inf, inf)
-            if rscore != -inf:
-                return rstep
+        # An interrupted search leaves moves on the board, so work on a copy
+        game = game.copy()
+        self.deadline = None if budget is None else time.monotonic() + budget
+        self.cancelled = cancelled
+        self.progress = progress
+        self.nodeCount = 0
+        self.nextTick = MIN_TICK
+        limited = budget is not None or deepen
+        bestStep = steps[0]
 
-        # Heuristic search
+        try:
+            if limited:
+                # A depth-1 search is only move ordering, and a fallback if time runs out
+                self.maxDepth = 1
+                rscore, bestStep = yield from self.heuristicSearchSteps(game, player, 1, -inf, inf)
+
+            # Final mode: exact search
+            if cc >= n * n - self.final:
+                self.maxDepth = n * n - cc
+                if self.endgame is not None:
+                    self.endgame.refresh()
+                rscore, rstep = yield from self.exactSearchSteps(game, player, self.maxDepth, -inf, inf)
+                if rscore != -inf:
+                    return rstep
+
+            # Heuristic search
+            for depth in range(2 if limited else self.depth, self.depth + 1):
+                self.maxDepth = depth
+                rscore, rstep = yield from self.heuristicSearchSteps(game, player, depth, -inf, inf)
+                bestStep = rstep
+        except SearchTimeout:
+            self.interrupted = True
+        finally:
+            self.deadline = self.cancelled = self.progress = None
+            if self.endgame is not None:
+                self.endgame.flush()
+        return bestStep
+
+    def ponder(self, game, budget=None, cancelled=None, width=PONDER_WIDTH):
+        """
+        Search on the opponent's time
+
+        game is a position with the opponent to move. Our replies to its likeliest moves
+        are searched, likeliest first, and kept so that findBestStep can answer at once.
+        Takes the same budget and cancelled as search().
+
+        Returns a list of (position, reply) pairs
+        """
+        deadline = None if budget is None else time.monotonic() + budget
+        self.ponderMoves.clear()
+        pondered = []
+        opponent = game.current
+        steps = game.getAvailables()
+        hValue = {}
+        for step in steps:
+            hValue[step] = self.getHeuristicScore(game, opponent, step)
+        steps = sorted(steps, key=lambda s: hValue[s], reverse=(opponent == BLACK))
+
+        for step in steps[:width]:
+            if cancelled is not None and cancelled():
+                break
+            after = game.copy()
+            after.put(step)
+            if after.current == opponent or after.over:
+                continue  # We'd have to pass, nothing to think about
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+            reply = self.search(after, remaining, cancelled)
+            if self.interrupted:
+                break
+            if reply:
+                self.ponderMoves[after.key()] = reply
+                pondered.append((after, reply))
+        return pondered
+
+    def startPondering(self, game, budget=None):
+        """
+        Ponder in a background thread until findBestStep (or stopPondering) is called
+        """
+        self.stopPondering()
+        stop = threading.Event()
+        thread = threading.Thread(target=self.ponder, args=(game.copy(), budget, stop.is_set), daemon=True)
+        self.pondering = thread, stop
+        thread.start()
+
+    def stopPondering(self):
+        if self.pondering is not None:
+            thread, stop = self.pondering
+            stop.set()
+            thread.join()
+            self.pondering = None
+
+    def principalVariation(self, game, length=MAX_PV):
+        """
+        Follow the best moves remembered by heuristicSearch from a position
+        """
+        game = game.copy()
+        pv = []
+        while len(pv) < length:
+            step = self.bestMoves.get(hash(game))
+            if step is None or not game.canPut(*step):
+                break
+            pv.append(step)
+            game.put(step)
+        return pv
+
+    def analyze(self, game, report, cancelled=None, maxDepth=None):
+        """
+        Anytime analysis of all moves of the current player
+
+        Deepens iteratively, searching every move with a full window so that each gets
+        its own score. After each depth, calls report(depth, scores, pv), where scores
+        maps each move to its score (positive is good for BLACK, as everywhere here)
+        and pv is the principal variation. Runs to maxDepth, by default the end of the game,
+        unless cancelled.
+        """
+        self.stopPondering()
+        game = game.copy()
+        player = game.current
+        steps = game.getAvailables()
+        if len(steps) <= 0:
+            return
+        if maxDepth is None:
+            maxDepth = game.chessCount[EMPTY]
+        self.deadline = None
+        self.cancelled = cancelled
         self.nodeCount = 0
-        self.maxDepth = self.depth
-        rscore, rstep = self.heuristicSearch(game, player, self.maxDepth, -inf, inf)
-        return rstep
+        self.nextTick = MIN_TICK
+
+        try:
+            for depth in range(1, maxDepth + 1):
+                scores = {}
+                for step in steps:
+                    game.put(step)
+                    if depth == 1:
+                        scores[step] = self.savedScore(game, player)
+                    else:
+                        scores[step], _ = self.heuristicSearch(game, player, depth - 1, -inf, inf)
+                    game.undo()
+                # Best first, which is also the best order for the next depth
+                steps.sort(key=lambda s: scores[s], reverse=(player == BLACK))
+                game.put(steps[0])
+                pv = [steps[0]] + self.principalVariation(game, min(depth, MAX_PV) - 1)
+                game.undo()
+                report(depth, scores, pv)
+        except SearchTimeout:
+            pass
+        finally:
+            self.cancelled = None
+
+
+class SlicedSearch:
+    """
+    A search for the best move that runs a slice at a time, so a host that can't
+    block (an event loop) can run it, or many of them, in between its other work.
+    Deepens iteratively, so cancel() still leaves the best move found so far.
+
+        search = SlicedSearch(engine, game)
+        while not search.run(seconds=0.01):
+            ...  # Do other things
+        step = search.result
+
+    The engine belongs to the search until it's done or cancelled.
+    """
+
+    def __init__(self, engine, game, budget=None):
+        self.engine = engine
+        self.stopped = False
+        self.steps = engine.searchSteps(game, budget, lambda: self.stopped, deepen=True)
+        self.started = False
+        self.done = False
+        self.result = None
+
+    def run(self, nodes=None, seconds=None):
+        """
+        Search for at most about `nodes` nodes or `seconds` seconds, returns whether it's done
+        """
+        if self.done:
+            return True
+        engine = self.engine
+        engine.sliceNodes = inf if nodes is None else nodes
+        engine.sliceDeadline = time.monotonic() + (inf if seconds is None else seconds)
+        self.started = True
+        try:
+            next(self.steps)
+        except StopIteration as e:
+            self.done = True
+            self.result = e.value
+        finally:
+            engine.sliceNodes = engine.sliceDeadline = None
+        return self.done
+
+    def cancel(self):
+        """
+        Stop searching, result is the best move found so far
+        """
+        if self.done:
+            return
+        if not self.started:
+            self.steps.close()
+            self.done = True
+            return
+        self.stopped = True
+        self.engine.nextTick = 0  # Check self.stopped at the next node
+        self.run()
+
+
+async def findBestStepAsync(engine, game, budget=None, sliceTime=SLICE_TIME):
+    """
+    findBestStep for asyncio, in slices of sliceTime seconds. Other tasks run in between,
+    so one event loop can run many searches, each with its own engine.
+    """
+    import asyncio
+
+    search = SlicedSearch(engine, game, budget)
+    try:
+        while not search.run(seconds=sliceTime):
+            await asyncio.sleep(0)
+    finally:
+        search.cancel()
+    return search.result
+
+
+if os.environ.get("REVERSI_PROFILE"):
+    import profiling  # noqa: F401, E402 (instruments the hot paths for the whole run)
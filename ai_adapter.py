@@ -6,38 +6,75 @@ import requests
 SERVER = "http://127.0.0.1:5000"
 
 
-def setLevel(level):
+level = 0  # Sent with every request, the server keeps an engine per level
+
+
+def available(timeout=0.5):
+    """
+    Check if the server is up
+    """
+    try:
+        requests.post(SERVER, json={'action': "get_stats", 'data': {}}, timeout=timeout).raise_for_status()
+        return True
+    except requests.RequestException:
+        return False
+
+
+def setLevel(newLevel):
     """
     Set difficulty level of AI algorithm
     """
+    global level
+    level = newLevel
+    return True
+
+
+def findBestStep(game, budget=None, cancelled=None, progress=None):
+    """
+    Send current board to the server and retrieve the "best move"
+
+    budget is an optional time limit in seconds for the server's search.
+    cancelled and progress are there to match ReversiAI.findBestStep,
+    but the server reports no progress and a sent request can't be called back
+    """
+    if cancelled is not None and cancelled():
+        return ()
     # Construct POST data
     payload = {
-        'action': "set_difficulty",
+        'action': "get_move",
         'data': {
+            'board': game.board,
+            'current': game.current,
             'level': level
         }
     }
-    response = requests.post(SERVER, json=payload).json()
+    timeout = None
+    if budget is not None:
+        payload['data']['budget'] = int(budget * 1000)
+        # Give up (and so disconnect, which cancels the search) if the server doesn't keep to it
+        timeout = budget + 1.0
+    response = requests.post(SERVER, json=payload, timeout=timeout).json()
     try:
-        return response['message'] == "success"
-    except Exception:
-        print(response)
+        return response["move"]["x"], response["move"]["y"]
+    except KeyError:
+        return ()  # Something bad?
 
 
-def findBestStep(game):
+def ponder(game):
     """
-    Send current board to the server and retrieve the "best move"
+    Ask the server to think about the replies to the current player's likely moves,
+    so it can answer at once when our next request arrives
     """
-    # Construct POST data
     payload = {
-        'action': "get_move",
+        'action': "ponder",
         'data': {
             'board': game.board,
-            'current': game.current
+            'current': game.current,
+            'level': level
         }
     }
-    response = requests.post(SERVER, json=payload).json()
     try:
-        return response["move"]["x"], response["move"]["y"]
-    except KeyError:
-        return ()  # Something bad?
+        response = requests.post(SERVER, json=payload, timeout=1.0).json()
+    except (requests.RequestException, ValueError):
+        return False  # Pondering is only a head start, it can do without
+    return response.get('message') == "pondering"
@@ -0,0 +1,275 @@
+"""
+Engine backends for the game client
+
+All backends have the same interface as ai_adapter:
+    setLevel(level)
+    findBestStep(game, budget=None, cancelled=None, progress=None)
+    ponder(game)  # Think on the opponent's time, until the next findBestStep
+    analyze(game, report, cancelled=None)  # See ReversiAI.analyze, if canAnalyze
+    close()
+"""
+
+import multiprocessing
+import threading
+
+from reversi import Reversi
+from ai import ReversiAI
+
+
+POLL_INTERVAL = 0.05  # Seconds between checks for cancellation while waiting for a worker
+
+
+def serveEngine(conn, stop):
+    """
+    Main loop of a LocalBackend worker process
+    """
+    ai = ReversiAI(0)
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message[0] == "level":
+            ai.setLevel(message[1])
+        elif message[0] == "move":
+            _, board, current, budget = message
+            game = Reversi()
+            game.board = board
+            game.current = current
+            # Deepening, so a stopped search still answers with the deepest iteration it finished
+            step = ai.findBestStep(game, budget, stop.is_set, lambda nodes: conn.send(("progress", nodes)),
+                                   deepen=True)
+            conn.send(("move", step))
+        elif message[0] == "ponder":
+            _, board, current = message
+            game = Reversi()
+            game.board = board
+            game.current = current
+            # Any new message means there's something better to do
+            ai.ponder(game, cancelled=conn.poll)
+        elif message[0] == "analyze":
+            _, board, current = message
+            game = Reversi()
+            game.board = board
+            game.current = current
+            ai.analyze(game, lambda *analysis: conn.send(("analysis",) + analysis), stop.is_set)
+            conn.send(("done",))
+        elif message[0] == "quit":
+            return
+
+
+class LocalBackend:
+    """
+    Runs ReversiAI in this machine, by default in a worker process so it doesn't hold the GIL
+    of the UI. The process lives as long as the backend, keeping its tables warm between moves.
+    """
+    canAnalyze = True
+
+    def __init__(self, useProcess=True):
+        self.lock = threading.Lock()  # One search at a time
+        self.level = None  # Set by setLevel, applied before the next search
+        self.levelLock = threading.Lock()
+        self.process = None
+        if useProcess:
+            # Forking a process that runs Qt isn't safe
+            context = multiprocessing.get_context("spawn")
+            self.conn, child = context.Pipe()
+            self.stop = context.Event()
+            self.process = context.Process(target=serveEngine, args=(child, self.stop), daemon=True)
+            self.process.start()
+        else:
+            self.ai = ReversiAI(0)
+
+    def setLevel(self, level):
+        """
+        Set the level of the next search. Doesn't wait for the search in progress, if any.
+        """
+        with self.levelLock:
+            self.level = level
+        return True
+
+    def applyLevel(self):
+        """
+        Pass on a level set since the last search, with self.lock held
+        """
+        with self.levelLock:
+            level, self.level = self.level, None
+        if level is None:
+            return
+        if self.process is None:
+            self.ai.setLevel(level)
+        else:
+            self.conn.send(("level", level))
+
+    def findBestStep(self, game, budget=None, cancelled=None, progress=None):
+        with self.lock:
+            self.applyLevel()
+            if self.process is None:
+                return self.ai.findBestStep(game, budget, cancelled, progress, deepen=True)
+
+            self.stop.clear()
+            self.conn.send(("move", game.board, game.current, budget))
+            for message in self.messages(cancelled):
+                if message[0] == "progress":
+                    if progress is not None:
+                        progress(message[1])
+                elif message[0] == "move":
+                    return message[1]  # The deepest finished iteration's move if it was stopped
+
+    def analyze(self, game, report, cancelled=None):
+        with self.lock:
+            self.applyLevel()
+            if self.process is None:
+                return self.ai.analyze(game, report, cancelled)
+
+            self.stop.clear()
+            self.conn.send(("analyze", game.board, game.current))
+            for message in self.messages(cancelled):
+                if message[0] == "analysis":
+                    if not self.stop.is_set():
+                        report(*message[1:])
+                elif message[0] == "done":
+                    return
+
+    def messages(self, cancelled):
+        """
+        Yield messages from the worker, and tell it to stop once cancelled() is true
+
+        The worker still finishes the request with its usual last message
+        """
+        while True:
+            if cancelled is not None and cancelled():
+                self.stop.set()
+            if not self.conn.poll(POLL_INTERVAL):
+                if not self.process.is_alive():
+                    raise RuntimeError("Engine process exited")
+                continue
+            yield self.conn.recv()
+
+    def ponder(self, game):
+        """
+        Start pondering, unless a search is still winding down (pondering can wait for the next move,
+        the GUI thread can't wait for the search)
+        """
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            self.applyLevel()
+            if self.process is None:
+                self.ai.startPondering(game)
+            else:
+                self.conn.send(("ponder", game.board, game.current))
+        finally:
+            self.lock.release()
+
+    def close(self):
+        if self.process is None:
+            self.ai.stopPondering()
+            return
+        with self.lock:
+            self.conn.send(("quit",))
+        self.process.join(1)
+
+
+class RemoteBackend:
+    """
+    Asks a move server (server.py) through ai_adapter. The server doesn't do analysis.
+    """
+    canAnalyze = False
+
+    def __init__(self, server=None):
+        import ai_adapter
+        self.adapter = ai_adapter
+        if server is not None:
+            ai_adapter.SERVER = server
+
+    def available(self):
+        return self.adapter.available()
+
+    def setLevel(self, level):
+        return self.adapter.setLevel(level)
+
+    def findBestStep(self, game, budget=None, cancelled=None, progress=None):
+        return self.adapter.findBestStep(game, budget, cancelled, progress)
+
+    def ponder(self, game):
+        """
+        Ask the server to ponder, from a thread of its own so a slow server doesn't hold up the caller
+        """
+        threading.Thread(target=self.adapter.ponder, args=(game.copy(),), daemon=True).start()
+
+    def close(self):
+        pass
+
+
+class AutoBackend:
+    """
+    Uses a move server if one answers, otherwise (or once it stops answering) a LocalBackend
+    """
+    canAnalyze = True  # On a LocalBackend
+
+    def __init__(self, server=None):
+        self.level = 0
+        self.remote = None
+        try:
+            remote = RemoteBackend(server)
+            if remote.available():
+                self.remote = remote
+        except ImportError:
+            pass  # No requests module, no server
+        self.local = LocalBackend() if self.remote is None else None
+
+    def localBackend(self):
+        if self.local is None:
+            self.local = LocalBackend()
+            self.local.setLevel(self.level)
+        return self.local
+
+    def fallback(self):
+        self.remote = None
+        self.localBackend()
+
+    def setLevel(self, level):
+        self.level = level
+        if self.local is not None:
+            self.local.setLevel(level)
+        if self.remote is not None:
+            return self.remote.setLevel(level)
+        return True
+
+    def findBestStep(self, game, budget=None, cancelled=None, progress=None):
+        if self.remote is not None:
+            try:
+                step = self.remote.findBestStep(game, budget, cancelled, progress)
+                if step or (cancelled is not None and cancelled()) or not game.any():
+                    return step
+            except Exception as e:
+                print("Move server failed ({}: {}), switching to the local engine".format(type(e).__name__, e))
+            self.fallback()
+        return self.local.findBestStep(game, budget, cancelled, progress)
+
+    def ponder(self, game):
+        if self.remote is not None:
+            return self.remote.ponder(game)  # If the server's gone findBestStep will find out and fall back
+        return self.local.ponder(game)
+
+    def analyze(self, game, report, cancelled=None):
+        # Analysis always runs here, the server can't do it
+        return self.localBackend().analyze(game, report, cancelled)
+
+    def close(self):
+        if self.local is not None:
+            self.local.close()
+
+
+def makeBackend(name="auto", server=None):
+    """
+    Create a backend by name: "local", "remote" or "auto"
+    """
+    if name == "local":
+        return LocalBackend()
+    elif name == "remote":
+        return RemoteBackend(server)
+    elif name == "auto":
+        return AutoBackend(server)
+    raise ValueError("Unknown engine backend: {}".format(name))
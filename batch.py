@@ -0,0 +1,408 @@
+"""
+Batched leaf evaluation
+
+Searches score the leaves of the tree one position at a time, in Python. A LeafScheduler
+runs many searches in one thread instead, as resumable generators, and scores the leaves
+they're waiting for together, in one NumPy evaluator call per evaluator. Each search stops
+at its next batch of leaves (the moves of a depth-1 node, see ReversiAI.scoreStepsSteps),
+the scheduler moves on to the next search, and once maxBatch positions are waiting (or
+every search is, and maxWait has passed) they're all scored and the searches resume.
+
+The vectorised evaluators give the same scores as the heuristicEval_* methods, so the
+searches find the same moves. Only 8x8 boards are batched.
+
+Usage:
+    python3 batch.py --clients 16 --level 5 --positions 32
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+
+import ai
+import tune
+from reversi import Reversi, BS, BLACK, WHITE, TABLES
+
+
+MAX_BATCH = 512  # Positions scored in one evaluator call
+MAX_WAIT = 0.002  # Seconds to wait for more searches once all of them are waiting for leaves
+MAX_SEARCHES = 64  # Engines a server that batches runs at a time
+RESULT_GRACE = 1.0  # Seconds past its budget search() waits for a move before giving up on the search
+
+
+class VectorEvaluator:
+    """
+    heuristicEval_<level> of an engine, with its weights, for a batch of 8x8 boards
+    """
+
+    def __init__(self, engine):
+        self.level = engine.evalLevel
+        self.classScores = np.array([[ai.CLASS_SCORES[c] for c in col] for col in TABLES['SQUARE_CLASS']])
+        self.score = np.array(engine.scoreTable(BS))
+        self.bonus, self.liberty = engine.bonus, engine.liberty
+        self.weights3 = np.array(list(engine.stabilityWeights) + [engine.mobility, engine.potential, engine.frontier])
+        self.evaluate = getattr(self, "eval" + str(self.level))
+
+    @staticmethod
+    def key(engine):
+        """
+        Engines with the same key are scored by the same evaluator
+        """
+        return (engine.evalLevel, tuple(map(tuple, engine.scoreTable(BS))), engine.bonus, engine.liberty,
+                tuple(engine.stabilityWeights), engine.mobility, engine.potential, engine.frontier)
+
+    def __call__(self, boards):
+        """
+        Scores of an (n, 8, 8) array of boards, as a list of ints
+        """
+        return self.evaluate(boards).tolist()
+
+    def eval0(self, boards):
+        return (boards == BLACK).sum(axis=(1, 2)) - (boards == WHITE).sum(axis=(1, 2))
+
+    def eval1(self, boards):
+        disc = (boards == BLACK).astype(np.int64) - (boards == WHITE)
+        return (disc * self.classScores).sum(axis=(1, 2))
+
+    def eval2(self, boards):
+        legal = tune.legalMoves(boards)
+        return self.eval1(boards) * 2 + legal[BLACK].sum(axis=(1, 2)) - legal[WHITE].sum(axis=(1, 2))
+
+    def eval3(self, boards):
+        return tune.eval3Features(boards) @ self.weights3
+
+    def eval4(self, boards):
+        counted, liberties, runs = tune.eval4Terms(boards)
+        scores = (counted * self.score).sum(axis=(1, 2)) + self.liberty * liberties + self.bonus * runs
+
+        # Won and lost positions, checked in the same order as heuristicEval_4
+        black, white = (boards == BLACK).sum(axis=(1, 2)), (boards == WHITE).sum(axis=(1, 2))
+        full = black + white == BS * BS
+        scores = np.where(full & (white > black), -ai.inf, scores)
+        scores = np.where(full & (black > white), ai.inf, scores)
+        scores = np.where(white == 0, ai.inf, scores)
+        return np.where(black == 0, -ai.inf, scores)
+
+
+class BatchedSearch:
+    """
+    A search the scheduler runs
+    """
+    __slots__ = ("engine", "steps", "future", "evaluator", "value", "boards", "abandoned")
+
+    def __init__(self, engine, evaluator):
+        self.engine = engine
+        self.steps = None
+        self.future = concurrent.futures.Future()
+        self.evaluator = evaluator
+        self.value = None  # What to send the search when it runs next
+        self.boards = None  # The leaves it's waiting for
+        self.abandoned = False  # Nobody waits for the move any more, see LeafScheduler.search
+
+    def start(self, game, budget, cancelled, progress):
+        def stopped():
+            return self.abandoned or (cancelled is not None and cancelled())
+        self.engine.batched = True
+        self.steps = self.engine.searchSteps(game, budget, stopped, progress)
+
+    def fail(self, exception):
+        """
+        End the search with an exception, for whoever waits for its move
+        """
+        self.engine.batched = False
+        try:
+            self.steps.close()
+        except Exception:
+            pass
+        if not self.future.done():
+            self.future.set_exception(exception)
+
+
+class LeafScheduler:
+    """
+    Runs searches in a thread of its own, scoring their leaves in batches
+
+        scheduler = LeafScheduler()
+        step = scheduler.search(engine, game, budget)  # From any thread
+
+    An engine belongs to the scheduler until its search is done.
+    """
+
+    def __init__(self, maxBatch=MAX_BATCH, maxWait=MAX_WAIT):
+        self.maxBatch = maxBatch
+        self.maxWait = maxWait
+        self.lock = threading.Condition()
+        self.submitted = []
+        self.thread = None
+        self.stopped = False
+        self.evaluators = dict()  # VectorEvaluator.key -> VectorEvaluator
+        self.searches = 0
+        self.batches = 0
+        self.positions = 0
+        self.evalSeconds = 0.0
+
+    def submit(self, engine, game, budget=None, cancelled=None, progress=None):
+        """
+        Start a search (see ReversiAI.findBestStep), returns a concurrent.futures.Future of its move
+        """
+        step = engine.ponderedStep(game)
+        if step is not None:
+            future = concurrent.futures.Future()
+            future.set_result(step)
+            return future
+        with self.lock:
+            key = VectorEvaluator.key(engine)
+            if key not in self.evaluators:
+                self.evaluators[key] = VectorEvaluator(engine)
+            search = BatchedSearch(engine, self.evaluators[key])
+            search.start(game, budget, cancelled, progress)
+            self.submitted.append(search)
+            if self.thread is None:
+                self.stopped = False
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.lock.notify()
+        future = search.future
+        future.search = search  # For search() to abandon it
+        return future
+
+    def search(self, engine, game, budget=None, cancelled=None, progress=None, timeout=None):
+        """
+        Search for the best move, returns it when it's found
+
+        Raises concurrent.futures.TimeoutError if there's no move within timeout seconds (by default
+        RESULT_GRACE past the budget). The search is abandoned then, but the engine may still be in
+        the scheduler's hands, so it mustn't be used again.
+        """
+        future = self.submit(engine, game, budget, cancelled, progress)
+        if timeout is None and budget is not None:
+            timeout = budget + RESULT_GRACE
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            search = getattr(future, "search", None)
+            if search is not None:
+                search.abandoned = True
+            raise
+
+    def stop(self):
+        """
+        Stop the thread once the searches in progress are done
+        """
+        with self.lock:
+            self.stopped = True
+            self.lock.notify()
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            thread.join()
+
+    def run(self):
+        running = []  # Searches that can run
+        waiting = []  # Searches waiting for their leaves to be scored
+        try:
+            self.runSearches(running, waiting)
+        except BaseException as e:
+            # Fail what's left rather than leave its callers waiting forever, a new thread takes over
+            with self.lock:
+                self.thread = None
+                running += self.submitted
+                self.submitted.clear()
+            for search in running + waiting:
+                search.fail(e)
+            raise
+
+    def runSearches(self, running, waiting):
+        pending = 0  # Leaves the waiting searches are waiting for
+        since = None  # When the first of them started waiting
+        while True:
+            with self.lock:
+                if not running and not waiting:
+                    while not self.submitted and not self.stopped:
+                        self.lock.wait()
+                    if not self.submitted:
+                        return
+                elif not running and pending < self.maxBatch:
+                    # Everything is waiting for leaves, give new searches a moment to join the batch
+                    timeout = since + self.maxWait - time.monotonic()
+                    if timeout > 0 and not self.submitted:
+                        self.lock.wait(timeout)
+                running.extend(self.submitted)
+                self.searches += len(self.submitted)
+                self.submitted.clear()
+
+            stillRunning = []
+            while running:
+                search = running.pop(0)
+                if pending >= self.maxBatch:
+                    stillRunning.append(search)  # Runs after this batch
+                    continue
+                if self.advance(search):
+                    waiting.append(search)
+                    pending += len(search.boards)
+                    if since is None:
+                        since = time.monotonic()
+            running.extend(stillRunning)
+
+            if waiting and (pending >= self.maxBatch or (not running and time.monotonic() >= since + self.maxWait)):
+                running.extend(self.score(waiting))
+                waiting.clear()
+                pending = 0
+                since = None
+
+    def advance(self, search):
+        """
+        Run a search up to the next leaves it needs scored. Returns whether it's waiting for them,
+        or False if it's done.
+        """
+        if search.abandoned:
+            search.fail(concurrent.futures.TimeoutError())
+            return False
+        try:
+            while True:
+                value, search.value = search.value, None
+                boards = search.steps.send(value)
+                if boards is not None:
+                    search.boards = boards
+                    return True
+                # None is the end of a slice of a SlicedSearch, there are none here
+        except StopIteration as e:
+            search.engine.batched = False
+            search.future.set_result(e.value)
+        except Exception as e:
+            search.engine.batched = False
+            search.future.set_exception(e)
+        return False
+
+    def score(self, searches):
+        """
+        Score the leaves the searches are waiting for, one evaluator call per evaluator.
+        Returns the searches that got their scores, the others fail with the evaluator's exception.
+        """
+        start = time.monotonic()
+        groups = collections.defaultdict(list)
+        for search in searches:
+            groups[search.evaluator].append(search)
+        scored = []
+        for evaluator, group in groups.items():
+            try:
+                boards = np.array([board for search in group for board in search.boards], dtype=np.int8)
+                scores = evaluator(boards)
+            except Exception as e:
+                for search in group:
+                    search.fail(e)
+                continue
+            i = 0
+            for search in group:
+                n = len(search.boards)
+                search.value, search.boards = scores[i:i + n], None
+                i += n
+            scored.extend(group)
+            self.positions += len(boards)
+            self.batches += 1
+        self.evalSeconds += time.monotonic() - start
+        return scored
+
+    def stats(self):
+        return {
+            'searches': self.searches,
+            'batches': self.batches,
+            'positions': self.positions,
+            'mean_batch': self.positions / self.batches if self.batches else 0.0,
+            'eval_seconds': self.evalSeconds,
+            'positions_per_second': self.positions / self.evalSeconds if self.evalSeconds else 0.0,
+        }
+
+
+def countEvaluations(engine):
+    """
+    Count the positions an engine scores one at a time, in engine.evaluations
+    """
+    engine.evaluations = 0
+    heuristicScore = engine.heuristicScore
+
+    def counted(game, player):
+        engine.evaluations += 1
+        return heuristicScore(game, player)
+    engine.heuristicScore = counted
+
+
+def benchPositions(count, moves, seed=0):
+    rng = random.Random(seed)
+    games = []
+    while len(games) < count:
+        game = Reversi()
+        for _ in range(moves):
+            if game.over:
+                break
+            game.put(rng.choice(game.getAvailables()))
+        if not game.over:
+            games.append(game)
+    return games
+
+
+def bench(args):
+    games = benchPositions(args.positions, args.moves, args.seed)
+    print("{} positions of move {}, level {}, heuristicEval_{}".format(
+        len(games), args.moves, args.level, ai.AICONFIG[args.level][2]))
+
+    # One search at a time, each scoring its own leaves
+    start = time.monotonic()
+    evaluations = 0
+    expected = []
+    for game in games:
+        engine = ai.ReversiAI(args.level)
+        countEvaluations(engine)
+        expected.append(engine.findBestStep(game))
+        evaluations += engine.evaluations
+    elapsed = time.monotonic() - start
+    print("per-search: {:8d} positions in {:6.2f}s, {:8.0f} positions/sec".format(
+        evaluations, elapsed, evaluations / elapsed))
+
+    # args.clients searches at a time, leaves scored in batches
+    scheduler = LeafScheduler(args.max_batch, args.max_wait)
+    engines = [ai.ReversiAI(args.level) for _ in games]
+    for engine in engines:
+        countEvaluations(engine)
+    start = time.monotonic()
+    limit = threading.Semaphore(args.clients)
+    futures = []
+    for engine, game in zip(engines, games):
+        limit.acquire()
+        future = scheduler.submit(engine, game)
+        future.add_done_callback(lambda f: limit.release())
+        futures.append(future)
+    found = [future.result() for future in futures]
+    elapsed = time.monotonic() - start
+    scheduler.stop()
+    stats = scheduler.stats()
+    evaluations = stats['positions'] + sum(engine.evaluations for engine in engines)
+    print("batched:    {:8d} positions in {:6.2f}s, {:8.0f} positions/sec".format(
+        evaluations, elapsed, evaluations / elapsed))
+    print("            {} batches of {:.0f} positions, {:.0f} positions/sec in the evaluator, "
+          "{} scored one at a time".format(stats['batches'], stats['mean_batch'], stats['positions_per_second'],
+                                           evaluations - stats['positions']))
+    print("Same moves in {}/{}".format(sum(a == b for a, b in zip(found, expected)), len(games)))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare batched leaf evaluation with per-search evaluation")
+    parser.add_argument("--level", type=int, default=5)
+    parser.add_argument("--clients", type=int, default=16, help="Searches running at a time")
+    parser.add_argument("--positions", type=int, default=32)
+    parser.add_argument("--moves", type=int, default=20, help="Moves played into each position")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--max-wait", type=float, default=MAX_WAIT)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    return bench(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import sys
+import threading
+from collections import OrderedDict
+from multiprocessing.managers import BaseManager
+
+
+CACHE_SIZE = 1 << 16  # Number of positions kept before LRU eviction kicks in
+CACHE_ADDRESS = ("127.0.0.1", 5001)
+CACHE_AUTHKEY = b"pyreversi"
+
+
+def makeKey(board, current, level):
+    """
+    Build a hashable (and picklable) cache key for a position
+
+    Works with both a Reversi board and the list-of-lists that arrives as JSON
+    """
+    return tuple(tuple(col) for col in board), current, level
+
+
+class ResultCache:
+    """
+    A size-bounded position -> move cache with LRU eviction
+
+    All methods are thread-safe, so one instance can be shared by the threads of
+    a server process or served to other processes by a CacheServer
+    """
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Returns the cached value, None on a miss
+        """
+        with self.lock:
+            try:
+                value = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        """
+        Returns a dict of counters, including the hit rate since startup
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.data),
+                'capacity': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+class CacheServer(BaseManager):
+    """
+    Serves a single ResultCache to the worker processes of the move server
+    """
+    pass
+
+
+class CacheClient(BaseManager):
+    pass
+
+
+CacheClient.register("getCache")
+
+
+def serveCache(address=CACHE_ADDRESS, authkey=CACHE_AUTHKEY, size=CACHE_SIZE):
+    """
+    Run a local cache process until interrupted
+    """
+    cache = ResultCache(size)
+    CacheServer.register("getCache", callable=lambda: cache)
+    manager = CacheServer(address=address, authkey=authkey)
+    print("Serving result cache of {} positions on {}:{}".format(size, *address))
+    manager.get_server().serve_forever()
+
+
+def connectCache(address=CACHE_ADDRESS, authkey=CACHE_AUTHKEY):
+    """
+    Connect to a running cache process, returns a proxy with the ResultCache methods
+    """
+    manager = CacheClient(address=address, authkey=authkey)
+    manager.connect()
+    return manager.getCache()
+
+
+def parseAddress(s):
+    """
+    Parse "host:port" into an address tuple
+    """
+    host, _, port = s.rpartition(":")
+    return host or CACHE_ADDRESS[0], int(port)
+
+
+if __name__ == "__main__":
+    # Usage: python3 cache.py [host:port] [size]
+    address = parseAddress(sys.argv[1]) if len(sys.argv) > 1 else CACHE_ADDRESS
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else CACHE_SIZE
+    serveCache(address, size=size)
@@ -0,0 +1,199 @@
+"""
+Endgame store
+
+Keeps the results of exact endgame searches on disk, so a position solved once is
+never solved again, by any engine, process or server run. Positions are keyed by their
+canonical form (see posdb.canonical) and the side to move, and each entry has the
+result from black's side (-1, 0 or 1), whether it's exact or a bound, the number of
+empty squares and the best move.
+
+The file is a log of fixed-size entries, only ever appended to, each process reading
+it into memory as it grows. When it passes its size limit, the entries with the fewest
+empty squares (the cheapest to solve again) are dropped and the rest are written to a
+new file that replaces the old one, which readers notice and reload.
+"""
+
+import os
+import struct
+import threading
+
+from reversi import BS, BLACK, WHITE
+from posdb import canonical, SYMMETRIES, MOVED
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # No locking between processes on Windows
+
+ENTRY = struct.Struct("<QQBBbBBBxx")  # Black bits, white bits, side, empties, result, bound, move, tag
+TAG = 0xA5  # Tells a written entry from garbage past the end of a torn write
+NO_MOVE = 255
+EXACT, LOWER, UPPER = 0, 1, 2
+MIN_EMPTIES = 10  # Smaller endgames are quicker to solve than to look up
+MAX_BYTES = 8 << 20  # 350k entries
+
+
+class EndgameStore:
+    """
+    An endgame store file, shared by the engines of this process
+    """
+
+    def __init__(self, path, maxBytes=MAX_BYTES, minEmpties=MIN_EMPTIES):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.minEmpties = minEmpties
+        self.lock = threading.Lock()
+        self.entries = dict()  # (black, white, side) -> (empties, result, bound, move)
+        self.pending = []  # Entries found by searches, not yet written
+        self.file = None
+        self.offset = 0
+        self.hits = self.misses = 0
+        self.refresh()
+
+    def key(self, game):
+        """
+        Returns the key of a position and the symmetry it was turned by
+        """
+        black, white, s = canonical(game.board)
+        return (black, white, game.current), s
+
+    def get(self, key, s):
+        """
+        Returns (result, bound, move) of a position, move in the game's orientation,
+        None if the store doesn't have it
+        """
+        try:
+            _, result, bound, move = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if move != NO_MOVE:
+            i = SYMMETRIES[s][move]
+            move = i // BS, i % BS
+        else:
+            move = ()
+        return result, bound, move
+
+    def put(self, key, s, empties, result, bound, step):
+        """
+        Record a solved position, written to the file at the next flush()
+        """
+        move = MOVED[s][step[0] * BS + step[1]] if step else NO_MOVE
+        entry = (empties, result, bound, move)
+        with self.lock:
+            old = self.entries.get(key)
+            if old is not None and (old[2] == EXACT or bound != EXACT):
+                return  # Don't replace exact results by bounds
+            self.entries[key] = entry
+            self.pending.append(key + entry)
+
+    def flush(self):
+        """
+        Append the pending entries to the file, compacting it if it's grown too large
+        """
+        with self.lock:
+            if not self.pending:
+                return
+            data = b"".join(ENTRY.pack(*entry, TAG) for entry in self.pending)
+            self.pending = []
+            with self.fileLock():
+                with open(self.path, "ab") as f:
+                    f.write(data)
+                    size = f.tell()
+                if size > self.maxBytes:
+                    self.compact()
+
+    def refresh(self):
+        """
+        Read what other processes have appended since the last refresh
+        """
+        with self.lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return
+            if self.file is not None and os.fstat(self.file.fileno()).st_ino != stat.st_ino:
+                # Compacted into a new file
+                self.file.close()
+                self.file = None
+            if self.file is None:
+                self.file = open(self.path, "rb")
+                self.offset = 0
+                self.entries.clear()
+            if stat.st_size - self.offset < ENTRY.size:
+                return
+            self.file.seek(self.offset)
+            data = self.file.read((stat.st_size - self.offset) // ENTRY.size * ENTRY.size)
+            self.offset += len(data)
+            self.load(data)
+
+    def load(self, data):
+        for black, white, side, empties, result, bound, move, tag in ENTRY.iter_unpack(data):
+            if tag != TAG or side not in (BLACK, WHITE):
+                continue
+            key = black, white, side
+            old = self.entries.get(key)
+            if old is None or old[2] != EXACT or bound == EXACT:
+                self.entries[key] = empties, result, bound, move
+
+    def compact(self):
+        """
+        Rewrite the file with the most valuable entries, half the size limit of them
+        """
+        with open(self.path, "rb") as f:
+            data = f.read()
+        self.entries.clear()
+        self.load(data[:len(data) // ENTRY.size * ENTRY.size])
+        keep = sorted(self.entries.items(), key=lambda item: item[1][0], reverse=True)
+        keep = keep[:self.maxBytes // 2 // ENTRY.size]
+        self.entries = dict(keep)
+        tmp = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp, "wb") as f:
+            f.write(b"".join(ENTRY.pack(*key, *entry, TAG) for key, entry in keep))
+            size = f.tell()
+        os.replace(tmp, self.path)
+        if self.file is not None:
+            self.file.close()
+        self.file = open(self.path, "rb")
+        self.offset = size
+
+    def fileLock(self):
+        return FileLock(self.path + ".lock")
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0,
+            }
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class FileLock:
+    """
+    Exclusive lock of a file between processes, for writers
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+
+    def __enter__(self):
+        self.f = open(self.path, "a")
+        if fcntl is not None:
+            fcntl.flock(self.f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
@@ -0,0 +1,309 @@
+"""
+Load generator for the move server
+
+Sends game positions to server.py at a fixed concurrency (closed loop) or a fixed
+request rate (open loop) and reports throughput, latency and the server's result
+cache hit rate per level. Levels are run one after another, or interleaved in one
+run with --mixed.
+
+Each request gets a fresh position from a seeded random game, so the server's result
+cache doesn't answer for the search (--count or --positions replay a fixed set instead).
+
+Usage:
+    python3 loadtest.py --levels 0 3 5 --concurrency 8 --duration 20 --output before.json
+    python3 loadtest.py --server http://127.0.0.1:5000 --rate 50 --requests 1000
+    python3 loadtest.py --levels 0 3 5 --mixed --duration 30
+"""
+
+import argparse
+import json
+import math
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+from reversi import Reversi
+
+
+OPENING_MOVES = 13  # Moves played before a fresh position, past the AI's random opening mode
+MAX_MOVES = 56
+
+
+def freshPosition(seed, i):
+    """
+    Position i of a run, from a random game of its own. The side to move can move.
+    """
+    rng = random.Random(seed * 1000003 + i)
+    while True:
+        game = Reversi()
+        for _ in range(rng.randrange(OPENING_MOVES, MAX_MOVES)):
+            if game.over:
+                break
+            game.put(rng.choice(game.getAvailables()))
+        if not game.over:
+            return {'board': [list(col) for col in game.board], 'current': game.current}
+
+
+def makePositions(count, seed=None):
+    """
+    Collect positions from randomly played games, each one with the side to move able to move
+    """
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        game = Reversi()
+        while not game.over and len(positions) < count:
+            positions.append({'board': [list(col) for col in game.board], 'current': game.current})
+            game.put(rng.choice(game.getAvailables()))
+    return positions
+
+
+def cacheStats(url):
+    """
+    (hits, misses) of the server's result cache so far
+    """
+    stats = requests.post(url, json={'action': "get_stats", 'data': {}}, timeout=5).json()['cache']
+    return stats['hits'], stats['misses']
+
+
+def loadPositions(path):
+    """
+    Read positions from a file with one JSON object {"board": ..., "current": ...} per line
+    """
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def startServer(port):
+    """
+    Start a local server without the debug reloader, returns the process and its URL
+    """
+    code = "import server; server.app.run(host='127.0.0.1', port={}, threaded=True)".format(port)
+    proc = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = "http://127.0.0.1:{}".format(port)
+    for _ in range(100):
+        try:
+            requests.get(url + "/metrics", timeout=1)
+            return proc, url
+        except requests.ConnectionError:
+            if proc.poll() is not None:
+                break
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("Server did not start")
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of a sorted list
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))]
+
+
+class LoadRun:
+    """
+    Sends get_move requests and collects their latencies per level
+
+    With several levels, consecutive requests take turns between them.
+    positions are replayed in turn, or each request gets a fresh one if it's None.
+    """
+
+    def __init__(self, url, positions, levels, budget=None, seed=0):
+        self.url = url
+        self.positions = positions
+        self.seed = seed
+        self.levels = levels
+        self.budget = budget
+        self.latencies = {level: [] for level in levels}
+        self.errors = {level: 0 for level in levels}
+        self.lock = threading.Lock()
+        self.next = 0
+        self.issued = 0
+        self.local = threading.local()
+
+    def payload(self):
+        with self.lock:
+            i = self.next
+            self.next += 1
+        level = self.levels[i % len(self.levels)]
+        if self.positions is None:
+            position = freshPosition(self.seed, i)
+        else:
+            position = self.positions[i % len(self.positions)]
+        data = dict(position, level=level)
+        if self.budget is not None:
+            data['budget'] = self.budget
+        return level, {'action': "get_move", 'data': data}
+
+    def request(self, sent=None):
+        """
+        Send one request; for an open loop, latency counts from when it was due to be sent
+        """
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        level, payload = self.payload()
+        start = time.monotonic() if sent is None else sent
+        try:
+            ok = session.post(self.url, json=payload).status_code == 200
+        except requests.RequestException:
+            ok = False
+        elapsed = time.monotonic() - start
+        with self.lock:
+            if ok:
+                self.latencies[level].append(elapsed)
+            else:
+                self.errors[level] += 1
+
+    def closedLoop(self, concurrency, duration=None, count=None):
+        end = None if duration is None else time.monotonic() + duration
+
+        def worker():
+            while True:
+                if end is not None and time.monotonic() >= end:
+                    return
+                with self.lock:
+                    if count is not None and self.issued >= count:
+                        return
+                    self.issued += 1
+                self.request()
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def openLoop(self, rate, concurrency, duration=None, count=None):
+        if count is None:
+            count = int(rate * duration)
+        due = []
+        cond = threading.Condition()
+        done = [False]
+
+        def worker():
+            while True:
+                with cond:
+                    while not due and not done[0]:
+                        cond.wait()
+                    if not due:
+                        return
+                    sent = due.pop(0)
+                self.request(sent)
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        start = time.monotonic()
+        for i in range(count):
+            sent = start + i / rate
+            time.sleep(max(0, sent - time.monotonic()))
+            with cond:
+                due.append(sent)
+                cond.notify()
+        with cond:
+            done[0] = True
+            cond.notify_all()
+        for t in threads:
+            t.join()
+
+    def report(self, level, elapsed, hitRate=None):
+        latencies = sorted(self.latencies[level])
+        ms = lambda v: None if v is None else round(v * 1000, 3)  # noqa: E731
+        return {
+            'level': level,
+            'requests': len(latencies) + self.errors[level],
+            'errors': self.errors[level],
+            'seconds': round(elapsed, 3),
+            'throughput': round(len(latencies) / elapsed, 3) if elapsed > 0 else None,
+            'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+            'p50_ms': ms(percentile(latencies, 50)),
+            'p95_ms': ms(percentile(latencies, 95)),
+            'p99_ms': ms(percentile(latencies, 99)),
+            'max_ms': ms(latencies[-1] if latencies else None),
+            'cache_hit_rate': None if hitRate is None else round(hitRate, 4),
+        }
+
+
+def runLevels(url, positions, levels, args):
+    """
+    Run one load test over the given levels, returns a report per level. The cache hit rate
+    is of the whole run, with --mixed that's of all its levels together.
+    """
+    # Positions of different levels (and runs) are kept apart, so they can't hit each other's results
+    run = LoadRun(url, positions, levels, args.budget, args.seed * 100 + levels[0])
+    hits, misses = cacheStats(url)
+    start = time.monotonic()
+    if args.rate:
+        run.openLoop(args.rate, args.concurrency, args.duration, args.requests)
+    else:
+        run.closedLoop(args.concurrency, args.duration, args.requests)
+    elapsed = time.monotonic() - start
+    hits2, misses2 = cacheStats(url)
+    lookups = hits2 - hits + misses2 - misses
+    hitRate = (hits2 - hits) / lookups if lookups else None
+    return [run.report(level, elapsed, hitRate) for level in levels]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the PyReversi move server")
+    parser.add_argument("--server", help="URL of a running server, default is to start one locally")
+    parser.add_argument("--port", type=int, default=5050, help="Port for the locally started server")
+    parser.add_argument("--levels", type=int, nargs="+", default=[0, 2, 4])
+    parser.add_argument("--mixed", action="store_true", help="Interleave the levels in a single run")
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of client threads")
+    parser.add_argument("--rate", type=float, help="Requests per second (open loop) instead of a closed loop")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per level")
+    parser.add_argument("--requests", type=int, help="Requests per level, instead of --duration")
+    parser.add_argument("--budget", type=int, help="Latency budget (ms) sent with each request")
+    parser.add_argument("--positions", help="File of JSON positions to replay, default is a fresh random one "
+                                            "per request")
+    parser.add_argument("--count", type=int, help="Replay this many random positions instead")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Save the results as JSON")
+    args = parser.parse_args()
+    if args.requests is not None:
+        args.duration = None
+
+    positions = None
+    if args.positions:
+        positions = loadPositions(args.positions)
+    elif args.count:
+        positions = makePositions(args.count, args.seed)
+    proc = None
+    url = args.server
+    if url is None:
+        proc, url = startServer(args.port)
+
+    try:
+        results = []
+        print("{:>5} {:>8} {:>6} {:>10} {:>9} {:>9} {:>9} {:>9}".format(
+            "level", "requests", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms", "hit rate"))
+        for levels in [args.levels] if args.mixed else [[level] for level in args.levels]:
+            for r in runLevels(url, positions, levels, args):
+                results.append(r)
+                print("{level:>5} {requests:>8} {errors:>6} {throughput!s:>10} "
+                      "{p50_ms!s:>9} {p95_ms!s:>9} {p99_ms!s:>9} {cache_hit_rate!s:>9}".format(**r))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                'args': vars(args),
+                'positions': None if positions is None else len(positions),
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
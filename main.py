@@ -1,9 +1,18 @@
-import qt
+import argparse
 import sys
+
+import backend
+import qt
 from PyQt5.QtWidgets import QApplication
 
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    ui = qt.ReversiUI()
+    parser = argparse.ArgumentParser(description="iBug Reversi")
+    parser.add_argument("--engine", choices=["auto", "local", "remote"], default="auto",
+                        help="Where the AI runs: a move server, this machine, or the server if one answers")
+    parser.add_argument("--server", help="URL of the move server")
+    args, qtArgs = parser.parse_known_args()
+
+    app = QApplication(sys.argv[:1] + qtArgs)
+    ui = qt.ReversiUI(backend.makeBackend(args.engine, args.server))
     sys.exit(app.exec_())
@@ -0,0 +1,128 @@
+import bisect
+import threading
+
+
+# Buckets (seconds) for latency histograms
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def formatLabels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(n, v) for n, v in zip(names, values)) + "}"
+
+
+class Metric:
+    """
+    Base of all metric types, holds one value per combination of label values
+
+    An update is a dict operation under an uncontended lock, well under a microsecond
+    """
+    kind = None
+
+    def __init__(self, name, help, labels=(), func=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        self.func = func  # Read the value at render time instead, for an unlabelled metric
+
+    def render(self):
+        if self.func is not None:
+            with self.lock:
+                self.values[()] = self.func()
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} {}".format(self.name, self.kind)]
+        with self.lock:
+            # Histograms keep a list that would otherwise keep changing under us
+            values = [(k, list(v) if isinstance(v, list) else v) for k, v in self.values.items()]
+        for key, value in sorted(values, key=lambda kv: tuple(map(str, kv[0]))):
+            lines.extend(self.renderOne(key, value))
+        return lines
+
+    def renderOne(self, key, value):
+        return ["{}{} {}".format(self.name, formatLabels(self.labels, key), value)]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            try:
+                counts = self.values[labels]
+            except KeyError:
+                # Per-bucket counts (not cumulative), then +Inf, then the sum
+                counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+            counts[i] += 1
+            counts[-1] += value
+
+    def renderOne(self, key, counts):
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            total += count
+            lines.append("{}_bucket{} {}".format(
+                self.name, formatLabels(self.labels + ("le",), key + (bound,)), total))
+        labels = formatLabels(self.labels, key)
+        lines.append("{}_sum{} {}".format(self.name, labels, counts[-1]))
+        lines.append("{}_count{} {}".format(self.name, labels, total))
+        return lines
+
+
+class Registry:
+    """
+    A collection of metrics, rendered together in Prometheus text format
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.add(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.add(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.add(Histogram(*args, **kwargs))
+
+    def render(self):
+        with self.lock:
+            lines = []
+            for metric in self.metrics:
+                lines.extend(metric.render())
+            return "\n".join(lines) + "\n"
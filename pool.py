@@ -0,0 +1,76 @@
+import os
+import threading
+
+from ai import ReversiAI, AICONFIG
+
+
+# Searches allowed to run at the same time in one server process
+MAX_ENGINES = os.cpu_count() or 4
+
+
+class EnginePool:
+    """
+    ReversiAI engines keyed by level, for a server that takes the level per request
+
+    Each engine keeps its level for life, so nothing ever calls setLevel and flushes a cache.
+    Engines of the same level share one bounded table of evaluated positions.
+    """
+
+    def __init__(self, size=MAX_ENGINES, endgame=None):
+        self.size = size
+        self.endgame = endgame  # An endgame.EndgameStore for all the engines
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = {level: [] for level in range(len(AICONFIG))}
+        self.states = {level: dict() for level in range(len(AICONFIG))}
+        self.busy = 0
+        self.waiting = 0  # Callers blocked in acquire()
+
+    def acquire(self, level, timeout=None):
+        """
+        Take an engine of the given level, None if no search slot frees up within timeout
+        """
+        acquired = self.slots.acquire(blocking=False)
+        if not acquired and timeout != 0:
+            with self.lock:
+                self.waiting += 1
+            try:
+                acquired = self.slots.acquire(timeout=timeout)
+            finally:
+                with self.lock:
+                    self.waiting -= 1
+        if not acquired:
+            return None
+        with self.lock:
+            self.busy += 1
+            try:
+                return self.idle[level].pop()
+            except IndexError:
+                pass
+        engine = ReversiAI(level, self.states[level])
+        engine.endgame = self.endgame
+        return engine
+
+    def release(self, engine):
+        with self.lock:
+            self.idle[engine.aiLevel].append(engine)
+            self.busy -= 1
+        self.slots.release()
+
+    def discard(self, engine):
+        """
+        Give back the search slot of an engine that's not to be used again
+        """
+        with self.lock:
+            self.busy -= 1
+        self.slots.release()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': self.size,
+                'busy': self.busy,
+                'waiting': self.waiting,
+                'engines': {level: len(idle) for level, idle in self.idle.items()},
+                'states': {level: len(states) for level, states in self.states.items()},
+            }
@@ -0,0 +1,266 @@
+"""
+Position database
+
+Counts, for every position reached in a collection of game records, how often it was
+reached and how the games ended, and the same for every move played from it.
+
+Positions are stored in canonical form (the least of the 8 symmetric boards), in a
+memory-mapped open-addressing hash table of fixed-size slots, so a lookup is a few
+probes into the file and new games are added in place.
+
+Usage:
+    python3 posdb.py build positions.db games.txt.gz ...
+    python3 posdb.py query positions.db f5d6c3
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+
+from reversi import Reversi, BS, BLACK, WHITE
+import record
+
+
+MAGIC = b"RVPOSDB1"
+HEADER = struct.Struct("<8sQQQ")  # Magic, capacity, used slots, games
+HEADER_SIZE = 64
+SLOT = struct.Struct("<QQBBxxIII")  # Black bits, white bits, side, move, black wins, draws, white wins
+NO_MOVE = 255  # The move of a position's own slot
+DEFAULT_CAPACITY = 1 << 16  # Slots in a new database, it doubles as it fills
+MAX_LOAD = 0.7
+
+# The 8 symmetries of the board, as index maps: transformed[i] = cells[SYMMETRIES[s][i]]
+SYMMETRIES = []
+for _s in range(8):
+    _perm = [0] * (BS * BS)
+    for _x in range(BS):
+        for _y in range(BS):
+            tx, ty = (_y, _x) if _s & 4 else (_x, _y)
+            if _s & 1:
+                tx = BS - 1 - tx
+            if _s & 2:
+                ty = BS - 1 - ty
+            _perm[tx * BS + ty] = _x * BS + _y
+    SYMMETRIES.append(_perm)
+# Where each square goes under each symmetry
+MOVED = [[perm.index(i) for i in range(BS * BS)] for perm in SYMMETRIES]
+
+
+def canonical(board):
+    """
+    Returns the canonical (black, white) bitboards of a board, and the symmetry used
+    """
+    cells = [chess for col in board for chess in col]
+    best = None
+    for s, perm in enumerate(SYMMETRIES):
+        key = bytes(cells[i] for i in perm)
+        if best is None or key < best:
+            best, bestSymmetry = key, s
+    black = white = 0
+    for i, chess in enumerate(best):
+        if chess == BLACK:
+            black |= 1 << i
+        elif chess == WHITE:
+            white |= 1 << i
+    return black, white, bestSymmetry
+
+
+def transformMove(step, s):
+    """
+    Where a square goes under symmetry s, as a cell index
+    """
+    x, y = step
+    return MOVED[s][x * BS + y]
+
+
+def slotHash(black, white, side, move):
+    h = (black * 0x9E3779B97F4A7C15) ^ (white * 0xC2B2AE3D27D4EB4F) ^ (side << 8 | move) * 0x165667B19E3779F9
+    return (h ^ (h >> 29) ^ (h >> 64)) & 0xFFFFFFFFFFFFFFFF
+
+
+class PositionDB:
+    """
+    A position database file, opened read-only unless writable
+    """
+
+    def __init__(self, path, writable=False, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        self.writable = writable
+        if writable and not os.path.exists(path):
+            self.create(path, capacity)
+        self.open()
+
+    @staticmethod
+    def create(path, capacity):
+        if capacity & (capacity - 1):
+            raise ValueError("Capacity must be a power of 2")
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, capacity, 0, 0).ljust(HEADER_SIZE, b"\0"))
+            f.truncate(HEADER_SIZE + capacity * SLOT.size)
+
+    def open(self):
+        self.file = open(self.path, "r+b" if self.writable else "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ)
+        magic, self.capacity, self.used, self.games = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("Not a position database: {}".format(self.path))
+        self.mask = self.capacity - 1
+
+    def close(self):
+        if self.writable:
+            HEADER.pack_into(self.map, 0, MAGIC, self.capacity, self.used, self.games)
+            self.map.flush()
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def find(self, black, white, side, move):
+        """
+        Returns the file offset of the key's slot, or of the empty slot where it would go
+        """
+        i = slotHash(black, white, side, move) & self.mask
+        while True:
+            offset = HEADER_SIZE + i * SLOT.size
+            b, w, sd, mv = SLOT.unpack_from(self.map, offset)[:4]
+            if sd == 0 or (b == black and w == white and sd == side and mv == move):
+                return offset
+            i = (i + 1) & self.mask
+
+    def get(self, black, white, side, move=NO_MOVE):
+        """
+        Returns (black wins, draws, white wins) of a key, None if it's not there
+        """
+        entry = SLOT.unpack_from(self.map, self.find(black, white, side, move))
+        if entry[2] == 0:
+            return None
+        return entry[4:]
+
+    def add(self, black, white, side, move, result):
+        offset = self.find(black, white, side, move)
+        entry = list(SLOT.unpack_from(self.map, offset))
+        if entry[2] == 0:
+            entry[:4] = black, white, side, move
+            self.used += 1
+        entry[4 + result] += 1
+        SLOT.pack_into(self.map, offset, *entry)
+        if self.used > self.capacity * MAX_LOAD:
+            self.grow()
+
+    def grow(self):
+        """
+        Double the capacity, rehashing the slots into a new file
+        """
+        tmp = self.path + ".tmp"
+        self.create(tmp, self.capacity * 2)
+        with PositionDB(tmp, writable=True) as db:
+            for i in range(self.capacity):
+                entry = SLOT.unpack_from(self.map, HEADER_SIZE + i * SLOT.size)
+                if entry[2] != 0:
+                    SLOT.pack_into(db.map, db.find(*entry[:4]), *entry)
+            db.used = self.used
+            db.games = self.games
+        self.close()
+        os.replace(tmp, self.path)
+        self.open()
+
+    def addGame(self, rec):
+        """
+        Count a game record, returns the number of positions in it
+        """
+        game = Reversi()
+        steps = []
+        for step in rec.moves():
+            steps.append(canonical(game.board) + (game.current, step))
+            if not game.put(step):
+                raise record.RecordError("Illegal move in {}".format(rec.transcript))
+        _, ccBlack, ccWhite = game.chessCount
+        result = 0 if ccBlack > ccWhite else 1 if ccBlack == ccWhite else 2
+        for black, white, s, side, step in steps:
+            self.add(black, white, side, NO_MOVE, result)
+            self.add(black, white, side, transformMove(step, s), result)
+        self.games += 1
+        return len(steps)
+
+    def lookup(self, game):
+        """
+        How games went from the position of a Reversi game, None if it was never reached
+        """
+        black, white, _ = canonical(game.board)
+        return self.get(black, white, game.current)
+
+    def nextMoves(self, game):
+        """
+        Results of the moves played from a position, as a dict move -> (black wins, draws, white wins)
+        """
+        black, white, s = canonical(game.board)
+        moves = {}
+        for step in game.getAvailables():
+            counts = self.get(black, white, game.current, transformMove(step, s))
+            if counts is not None:
+                moves[step] = counts
+        return moves
+
+
+def build(args):
+    start = time.monotonic()
+    games = positions = 0
+    with PositionDB(args.db, writable=True, capacity=args.capacity) as db:
+        for path in args.files:
+            with record.openRecords(path) as f:
+                for rec in record.readRecords(f, onError=lambda n, e: print("{}:{}: {}".format(path, n, e))):
+                    positions += db.addGame(rec)
+                    games += 1
+        total, used, capacity = db.games, db.used, db.capacity
+    elapsed = time.monotonic() - start
+    print("Added {} games ({} positions) in {:.2f}s ({:.0f} games/sec)".format(
+        games, positions, elapsed, games / elapsed if elapsed > 0 else 0))
+    print("Database has {} games, {} of {} slots used".format(total, used, capacity))
+    return 0
+
+
+def query(args):
+    with PositionDB(args.db) as db:
+        game = record.GameRecord(args.transcript.lower()).replay()
+        print(game)
+        counts = db.lookup(game)
+        if counts is None:
+            print("Position not found")
+            return 1
+        print("Reached {} times: black won {}, drew {}, white won {}".format(sum(counts), *counts))
+        moves = db.nextMoves(game)
+        for step, (b, d, w) in sorted(moves.items(), key=lambda kv: -sum(kv[1])):
+            print("  {}: {} games, black won {}, drew {}, white won {}".format(
+                record.squareName(step), b + d + w, b, d, w))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query a position database")
+    sub = parser.add_subparsers(dest="command")
+    p = sub.add_parser("build", help="Add game records to a database, creating it if needed")
+    p.add_argument("--capacity", type=int, default=DEFAULT_CAPACITY, help="Initial slots, a power of 2")
+    p.add_argument("db")
+    p.add_argument("files", nargs="+")
+    p = sub.add_parser("query", help="Show the statistics of the position after a transcript")
+    p.add_argument("db")
+    p.add_argument("transcript", nargs="?", default="")
+    args = parser.parse_args()
+    if args.command == "build":
+        return build(args)
+    elif args.command == "query":
+        return query(args)
+    parser.print_help()
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+"""
+Hot-path profiling
+
+Call counters and timers for the small functions searches spend their time in
+(canPut, getAvailables, the move generators, mobility, put, undo, position keys, the evaluators,
+the searches themselves).
+While profiling is off nothing is instrumented at all: enable() replaces those methods
+of Reversi and ReversiAI with counting wrappers, and disable() puts the originals back.
+
+Time is kept per call stack, so it can be written in the collapsed-stack format
+flame graph tools read ("findBestStep;search;searchSteps;heuristicSearchSteps 1234",
+in microseconds of self time).
+
+Setting REVERSI_PROFILE to a file name profiles the whole process and writes the
+collapsed stacks there at exit, with a summary on stderr.
+
+Usage:
+    python3 profiling.py --level 5 --output search.folded [TRANSCRIPT]
+"""
+
+import argparse
+import atexit
+import functools
+import inspect
+import os
+import sys
+import threading
+import time
+
+import ai
+import record
+import reversi
+
+# The methods enable() instruments, by class
+HOT_PATHS = {
+    reversi.Reversi: ("getAvailables", "iterMoves", "mobility", "put", "skipPut", "undo", "copy", "__hash__",
+                      "key"),
+    ai.ReversiAI: ("heuristicEval_0", "heuristicEval_1", "heuristicEval_2", "heuristicEval_3", "heuristicEval_4",
+                   "exactScore", "savedScore", "getHeuristicScore", "scoreStepsSteps", "orderedMoves",
+                   "stagedMoves", "heuristicSearchSteps", "probCutSteps", "exactSearchSteps", "searchSteps",
+                   "search", "findBestStep"),
+}
+# Generators the searches take moves from one at a time, doing the work of each move in between
+MOVE_GENERATORS = ("iterMoves", "orderedMoves", "stagedMoves")
+# Called so often (64 times per getAvailables, 64 per heuristicEval_3) that the wrappers
+# cost more than the calls, so only instrumented by enable(detail=True)
+DETAIL_PATHS = {
+    reversi.Reversi: ("canPut",),
+    ai.ReversiAI: ("stability",),
+}
+
+originals = {}  # (class, name) -> the method enable() replaced
+threads = []  # The ThreadProfile of every thread that ran an instrumented method
+threadsLock = threading.Lock()
+local = threading.local()
+
+# A position of move 20, past the opening moves the AI plays at random
+MIDGAME = "e6f4e3d6g5f6c7e2c4d7g7c5d2f2b5g3d3a6g4b4"
+
+
+class ThreadProfile:
+    """
+    The counts and times of one thread, so threads never contend for them
+    """
+
+    def __init__(self):
+        self.stack = []  # Names of the instrumented calls in progress
+        self.childTime = []  # Time spent in the instrumented calls of each of them
+        self.calls = {}  # name -> calls
+        self.totalTime = {}  # name -> time including callees, recursive calls counted once
+        self.stackTime = {}  # call stack -> self time
+
+    def enter(self, name):
+        self.stack.append(name)
+        self.childTime.append(0.0)
+        return time.perf_counter()
+
+    def leave(self, start, call=True):
+        elapsed = time.perf_counter() - start
+        stack = tuple(self.stack)
+        name = self.stack.pop()
+        children = self.childTime.pop()
+        if call:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if name not in self.stack:
+            self.totalTime[name] = self.totalTime.get(name, 0.0) + elapsed
+        self.stackTime[stack] = self.stackTime.get(stack, 0.0) + elapsed - children
+        if self.childTime:
+            self.childTime[-1] += elapsed
+
+
+def threadProfile():
+    try:
+        return local.profile
+    except AttributeError:
+        local.profile = ThreadProfile()
+        with threadsLock:
+            threads.append(local.profile)
+        return local.profile
+
+
+def instrument(func, name):
+    if name in MOVE_GENERATORS:
+        # Timed only while producing each move, so the search of the move isn't counted
+        # as theirs (nor stacked under them). A call is counted once, at its first move.
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = threadProfile()
+            steps = func(*args, **kwargs)
+            first = True
+            while True:
+                start = profile.enter(name)
+                try:
+                    step = next(steps)
+                except StopIteration:
+                    return
+                finally:
+                    profile.leave(start, first)
+                    first = False
+                yield step
+    elif inspect.isgeneratorfunction(func):
+        # The searches are generators, timed from the first step to the return.
+        # Slices of a SlicedSearch count the time in between too.
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = threadProfile()
+            start = profile.enter(name)
+            try:
+                return (yield from func(*args, **kwargs))
+            finally:
+                profile.leave(start)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = threadProfile()
+            start = profile.enter(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.leave(start)
+    return wrapper
+
+
+def enabled():
+    return bool(originals)
+
+
+def enable(detail=False):
+    """
+    Instrument the hot paths, and the DETAIL_PATHS too with detail. Engines created
+    before keep the evaluator they picked in setLevel() uninstrumented until their
+    level is set again.
+    """
+    if originals:
+        return
+    paths = [(cls, name) for cls, names in HOT_PATHS.items() for name in names]
+    if detail:
+        paths += [(cls, name) for cls, names in DETAIL_PATHS.items() for name in names]
+    for cls, name in paths:
+        func = cls.__dict__[name]
+        originals[cls, name] = func
+        setattr(cls, name, instrument(func, name))
+
+
+def disable():
+    """
+    Put the original methods back, keeping what's been counted
+    """
+    for (cls, name), func in originals.items():
+        setattr(cls, name, func)
+    originals.clear()
+
+
+def reset():
+    """
+    Forget what's been counted, of calls in progress too
+    """
+    with threadsLock:
+        for profile in threads:
+            profile.calls.clear()
+            profile.totalTime.clear()
+            profile.stackTime.clear()
+
+
+def collect():
+    """
+    Returns (calls, totalTime, stackTime) merged over all threads
+    """
+    calls, totalTime, stackTime = {}, {}, {}
+    with threadsLock:
+        for profile in threads:
+            for merged, own in ((calls, profile.calls), (totalTime, profile.totalTime),
+                                (stackTime, profile.stackTime)):
+                for key, value in list(own.items()):
+                    merged[key] = merged.get(key, 0) + value
+    return calls, totalTime, stackTime
+
+
+def summary():
+    """
+    Returns [(name, calls, total seconds, self seconds)], most self time first
+    """
+    calls, totalTime, stackTime = collect()
+    selfTime = {}
+    for stack, seconds in stackTime.items():
+        selfTime[stack[-1]] = selfTime.get(stack[-1], 0.0) + seconds
+    rows = [(name, calls[name], totalTime.get(name, 0.0), selfTime.get(name, 0.0)) for name in calls]
+    return sorted(rows, key=lambda row: -row[3])
+
+
+def printSummary(file=sys.stdout):
+    print("{:<22}{:>12}{:>12}{:>12}{:>10}".format("function", "calls", "total ms", "self ms", "self us"), file=file)
+    for name, calls, total, own in summary():
+        print("{:<22}{:>12}{:>12.1f}{:>12.1f}{:>10.2f}".format(name, calls, total * 1e3, own * 1e3,
+                                                                 own * 1e6 / calls), file=file)
+
+
+def writeCollapsed(f):
+    """
+    Write the call stacks in the collapsed format, with their self time in microseconds
+    """
+    _, _, stackTime = collect()
+    for stack, seconds in sorted(stackTime.items()):
+        micros = int(round(seconds * 1e6))
+        if micros > 0:
+            f.write("{} {}\n".format(";".join(stack), micros))
+
+
+def profileCall(func, *args, output=None, detail=False, **kwargs):
+    """
+    Profile one call, like engine.findBestStep(game), writing its collapsed stacks to
+    output (a file name) if given. Returns what the call returns.
+    """
+    wasEnabled = enabled()
+    enable(detail)
+    reset()
+    if inspect.ismethod(func):
+        func = getattr(func.__self__, func.__name__)  # Bound before enable(), get the instrumented one
+    try:
+        return func(*args, **kwargs)
+    finally:
+        if not wasEnabled:
+            disable()
+        if output is not None:
+            with open(output, "w") as f:
+                writeCollapsed(f)
+
+
+def profileAtExit(path):
+    enable()
+
+    def dump():
+        with open(path, "w") as f:
+            writeCollapsed(f)
+        printSummary(sys.stderr)
+    atexit.register(dump)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile one findBestStep call")
+    parser.add_argument("--level", type=int, default=5)
+    parser.add_argument("--output", help="Write the collapsed call stacks here")
+    parser.add_argument("--detail", action="store_true", help="Instrument canPut and stability too (slow)")
+    parser.add_argument("transcript", nargs="?", default=MIDGAME, help="Moves from the start")
+    args = parser.parse_args()
+
+    game = record.GameRecord(args.transcript.lower()).replay()
+    print(game)
+    enable(args.detail)  # Before creating the engine, so its evaluator is instrumented
+    engine = ai.ReversiAI(args.level)
+    step = profileCall(engine.findBestStep, game, output=args.output)
+    print("Best move {}, {} nodes".format(record.squareName(step) if step else "pass", engine.nodeCount))
+    printSummary()
+    return 0
+
+
+if os.environ.get("REVERSI_PROFILE") and __name__ != "__main__":
+    profileAtExit(os.environ["REVERSI_PROFILE"])
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,13 @@
+import threading
+import time
+
 from PyQt5.QtWidgets import *
 from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 
 import reversi
-import ai_adapter
+import backend
+from ai import inf
 
 
 # Constants that will affect how it looks
@@ -13,6 +17,9 @@ PIECE_SIZE = 45  # Diameter of circle that represents a piece
 DOT_SIZE = 10  # Dot indicator of possible moves
 IND_SIZE = 128  # The score indicator on the left, diameter of circle
 IND_BOARD_SIZE = 150  # Same as above, side length of canvas
+ANALYSIS_INTERVAL = 0.3  # Seconds between updates of the analysis overlay
+FLIP_TIME = 0.25  # Seconds a piece takes to turn over, 0 for no animation
+FLIP_INTERVAL = 16  # Milliseconds between frames of the flip animation
 
 margin = (BOARD_SIZE - 8 * GRID_SIZE) // 2  # Should be some 20
 padding = (GRID_SIZE - PIECE_SIZE) // 2  # Should be some 10
@@ -21,11 +28,17 @@ ind_margin = (IND_BOARD_SIZE - IND_SIZE) // 2
 
 
 class ReversiUI(QWidget):
-    def __init__(self):
+    def __init__(self, engine=None):
+        """
+        engine is an engine backend (see backend.py), by default a server is used if one is running,
+        otherwise the AI runs locally
+        """
         self.game = reversi.Reversi()
-        self.ai = ai_adapter
+        self.ai = engine if engine is not None else backend.makeBackend()
         self.ai.setLevel(0)
         self.humanSide = reversi.BLACK
+        self.worker = None  # The AIWorker of the search in progress
+        self.analysisWorker = None  # The AnalysisWorker of the analysis in progress
 
         # Create layout
         super(ReversiUI, self).__init__()
@@ -35,6 +48,7 @@ class ReversiUI(QWidget):
         self.score_str = "{}"
         self.scoreLabelA = ScoreIndicator(reversi.BLACK)
         self.scoreLabelB = ScoreIndicator(reversi.WHITE)
+        self.statusLabel = QLabel()
         self.painter = PaintArea()
         self.painter.setFocusPolicy(Qt.StrongFocus)
         self.init_ui()
@@ -57,12 +71,20 @@ class ReversiUI(QWidget):
         ])
         self.modeBox = QComboBox()
         self.modeBox.addItems(["I go first", "AI goes first"])
+        self.ponderBox = QCheckBox("Think on my time")
+        self.analysisBox = QCheckBox("Analysis")
+        if not self.ai.canAnalyze:
+            self.analysisBox.setEnabled(False)
+            self.analysisBox.setToolTip("The move server doesn't do analysis")
         self.controlBar.addWidget(self.modeBox)
+        self.controlBar.addWidget(self.ponderBox)
+        self.controlBar.addWidget(self.analysisBox)
         self.controlBar.addWidget(QSplitter())
         self.controlBar.addWidget(QLabel("Difficulty"))
         self.controlBar.addWidget(self.diffBox)
         self.controlBar.addWidget(self.undo_button)
         self.controlBar.addWidget(self.reset_button)
+        self.controlBar.addWidget(self.statusLabel)
 
         # Add events
         def boardClick(event):
@@ -80,6 +102,7 @@ class ReversiUI(QWidget):
             """
             Event handler on "Difficulty" cascade menu changes
             """
+            self.stopThinking()
             self.ai.setLevel(index)
             self.resetGame()
 
@@ -95,6 +118,7 @@ class ReversiUI(QWidget):
         self.painter.mouseReleaseEvent = boardClick
         self.diffBox.currentIndexChanged.connect(diffChange)
         self.modeBox.currentIndexChanged.connect(modeChange)
+        self.analysisBox.toggled.connect(self.onAnalysisToggled)
 
         self.setLayout(self.master)
         self.setWindowTitle("iBug Reversi: PyQt5")
@@ -106,17 +130,116 @@ class ReversiUI(QWidget):
 
     def aiMove(self):
         """
-        To perform an AI move
+        Start an AI search in the background, the move is made in onAIMove
         """
         if self.humanTurn:
             return
-        # print("ai moving:")
-        aiMove = self.ai.findBestStep(self.game)
+        self.stopThinking()
+        worker = AIWorker(self.ai, self.game, self)
+        worker.found.connect(self.onAIMove)
+        worker.progress.connect(self.onAIProgress)
+        worker.failed.connect(self.onAIFailed)
+        worker.finished.connect(worker.deleteLater)
+        self.worker = worker
+        self.statusLabel.setText("Thinking...")
+        worker.start()
+
+    def onAIMove(self, worker, aiMove):
+        """
+        Receives the result of a search, if it's still the one wanted
+        """
+        if worker is not self.worker:
+            return
+        self.worker = None
+        self.statusLabel.setText("")
         # print("aiMove: {}".format(aiMove))
         if aiMove == ():
             return
         self.game.put(aiMove)
-        self.update_ui(True)
+        self.update_ui()
+        self.continueGame()
+        self.humanThinking()
+
+    def onAIFailed(self, worker, message):
+        if worker is not self.worker:
+            return
+        self.worker = None
+        self.statusLabel.setText("AI error: {}".format(message))
+
+    def onAIProgress(self, worker, nodes):
+        if worker is self.worker:
+            self.statusLabel.setText("Thinking... {} nodes".format(nodes))
+
+    def humanThinking(self):
+        """
+        Put the engine to work while the human thinks about their move,
+        analysing the position if asked to, or else pondering its replies
+        """
+        if not self.humanTurn:
+            return
+        if self.analysisBox.isChecked():
+            self.startAnalysis()
+        elif self.ponderBox.isChecked():
+            self.ai.ponder(self.game)
+
+    def startAnalysis(self):
+        self.stopAnalysis()
+        worker = AnalysisWorker(self.ai, self.game, self)
+        worker.analysis.connect(self.onAnalysis)
+        worker.failed.connect(self.onAnalysisFailed)
+        worker.finished.connect(worker.deleteLater)
+        self.analysisWorker = worker
+        worker.start()
+
+    def onAnalysis(self, worker, depth, scores, pv):
+        if worker is not self.analysisWorker:
+            return
+        # Scores are good for BLACK when positive, show them from the human's side
+        sign = 1 if self.humanSide == reversi.BLACK else -1
+        self.painter.assignAnalysis({step: sign * score for step, score in scores.items()}, pv)
+        self.statusLabel.setText("Analysis depth {}".format(depth))
+
+    def onAnalysisFailed(self, worker, message):
+        if worker is not self.analysisWorker:
+            return
+        self.analysisWorker = None
+        self.painter.assignAnalysis(None, None)
+        self.statusLabel.setText("Analysis error: {}".format(message))
+
+    def onAnalysisToggled(self, checked):
+        if checked:
+            self.humanThinking()
+        else:
+            self.stopAnalysis()
+
+    def stopAnalysis(self):
+        if self.analysisWorker is not None:
+            self.analysisWorker.requestInterruption()
+            self.analysisWorker = None
+            self.statusLabel.setText("")
+            self.painter.assignAnalysis(None, None)
+
+    def stopThinking(self):
+        """
+        Cancel the search or analysis in progress, its result will be ignored
+        """
+        self.stopAnalysis()
+        if self.worker is not None:
+            self.worker.requestInterruption()
+            self.worker = None
+            self.statusLabel.setText("")
+
+    def continueGame(self):
+        """
+        Let the AI move if it's its turn, or announce the result if the game is over
+        """
+        if self.game.over:
+            self.gameOver()
+        elif not self.humanTurn:
+            if self.game.skipPut():
+                self.update_ui()
+            else:
+                self.aiMove()
 
     def onClickBoard(self, pos):
         """
@@ -127,23 +250,21 @@ class ReversiUI(QWidget):
         x, y = pos
         if not self.game.canPut(x, y):
             return  # Bad move, ignore it
+        self.stopAnalysis()
         self.game.put(x, y)
-        self.update_ui(True)
-        while not self.humanTurn and not self.game.over:
-            if self.game.skipPut():
-                break
-            self.aiMove()
-        # Check if game is over
-        if self.game.over:
-            sa, sb, sc = self.game.chessCount
-            if self.humanSide == reversi.WHITE:
-                sb, sc = sc, sb
-            if sb > sc:
-                QMessageBox.information(self, "iBug Reversi", "You Win!")
-            elif sb < sc:
-                QMessageBox.information(self, "iBug Reversi", "You Lose!")
-            elif sb == sc:
-                QMessageBox.information(self, "iBug Reversi", "Tie!")
+        self.update_ui()
+        self.continueGame()
+
+    def gameOver(self):
+        sa, sb, sc = self.game.chessCount
+        if self.humanSide == reversi.WHITE:
+            sb, sc = sc, sb
+        if sb > sc:
+            QMessageBox.information(self, "iBug Reversi", "You Win!")
+        elif sb < sc:
+            QMessageBox.information(self, "iBug Reversi", "You Lose!")
+        elif sb == sc:
+            QMessageBox.information(self, "iBug Reversi", "Tie!")
 
     @property
     def humanTurn(self):
@@ -171,33 +292,24 @@ class ReversiUI(QWidget):
         else:
             self.painter.assignDots(None)
             self.painter.assignSpecialDots(None)
-        self.painter.update()
-
-    def update_ui(self, force=False):
-        """
-        Workaround of UI getting stuck at waiting AI calculation
 
-        See: https://stackoverflow.com/q/49982509/5958455
-        """
+    def update_ui(self):
         self.update_board()
-        if force:
-            QApplication.instance().processEvents()
 
     def resetGame(self):
         """
         Start over the game
         """
+        self.stopThinking()
         self.game.reset()
         self.update_ui()
-        while not self.humanTurn and not self.game.over:
-            if self.game.skipPut():
-                break
-            self.aiMove()
+        self.continueGame()
 
     def undoGame(self):
         """
         Undo the last move
         """
+        self.stopThinking()
         while True:
             r, c = self.game.undo()
             if c == 0 and r:
@@ -205,19 +317,128 @@ class ReversiUI(QWidget):
                 continue
             if self.humanTurn or not r:
                 break
-        self.update_ui(True)
+        self.update_ui()
+        self.continueGame()
+        self.humanThinking()
+
+    def closeEvent(self, event):
+        self.stopThinking()
+        # Searches that were stopped may still be winding down
+        for worker in self.findChildren(QThread):
+            worker.wait()
+        self.ai.close()
+        super(ReversiUI, self).closeEvent(event)
+
+
+class AIWorker(QThread):
+    """
+    Runs one engine search off the GUI thread, reporting back through signals
+
+    Signals carry the worker itself, so results of cancelled searches can be told apart
+    """
+    found = pyqtSignal(object, object)
+    progress = pyqtSignal(object, int)
+    failed = pyqtSignal(object, str)  # The search raised, with the error message
+
+    def __init__(self, engine, game, parent=None):
+        super(AIWorker, self).__init__(parent)
+        self.engine = engine
+        self.game = game.copy()  # The UI keeps changing its own game
+
+    def run(self):
+        try:
+            move = self.engine.findBestStep(self.game, cancelled=self.isInterruptionRequested,
+                                            progress=lambda nodes: self.progress.emit(self, nodes))
+        except Exception as e:
+            # A remote engine may be unreachable, don't leave the GUI waiting
+            if not self.isInterruptionRequested():
+                self.failed.emit(self, "{}: {}".format(type(e).__name__, e))
+            return
+        if not self.isInterruptionRequested():
+            self.found.emit(self, move)
+
+
+class AnalysisWorker(QThread):
+    """
+    Runs an engine analysis off the GUI thread
+
+    Updates are sent at most every ANALYSIS_INTERVAL seconds, so that repainting the board
+    doesn't take time from the analysis. One that comes too soon is held back and sent
+    when the interval is up, unless a newer one replaces it first.
+    """
+    analysis = pyqtSignal(object, int, object, object)
+    delayed = pyqtSignal(int)  # Milliseconds until a held back update is due
+    failed = pyqtSignal(object, str)  # The analysis raised, with the error message
+
+    def __init__(self, engine, game, parent=None):
+        super(AnalysisWorker, self).__init__(parent)
+        self.engine = engine
+        self.game = game.copy()
+        self.lock = threading.Lock()
+        self.latest = None
+        self.lastSent = 0
+        self.flushPending = False
+        # Lives in the GUI thread like the worker object itself, so it's started through a signal
+        self.flushTimer = QTimer(self)
+        self.flushTimer.setSingleShot(True)
+        self.flushTimer.timeout.connect(self.onFlushTimer)
+        self.delayed.connect(self.flushTimer.start)
+
+    def report(self, *analysis):
+        with self.lock:
+            self.latest = analysis
+            wait = self.lastSent + ANALYSIS_INTERVAL - time.monotonic()
+            if wait > 0:
+                if not self.flushPending:
+                    self.flushPending = True
+                    self.delayed.emit(int(wait * 1000) + 1)
+                return
+        self.flush()
+
+    def onFlushTimer(self):
+        with self.lock:
+            self.flushPending = False
+        if not self.isInterruptionRequested():
+            self.flush()
+
+    def flush(self):
+        """
+        Send the update held back, if any
+        """
+        with self.lock:
+            analysis, self.latest = self.latest, None
+            if analysis is None:
+                return
+            self.lastSent = time.monotonic()
+        self.analysis.emit(self, *analysis)
+
+    def run(self):
+        try:
+            self.engine.analyze(self.game, self.report, cancelled=self.isInterruptionRequested)
+        except Exception as e:
+            if not self.isInterruptionRequested():
+                self.failed.emit(self, "{}: {}".format(type(e).__name__, e))
+            return
+        if not self.isInterruptionRequested():
+            self.flush()
 
 
 class PaintArea(QWidget):
     """
     The class that handles the drawing of the game board
+
+    The grid is drawn once into a background pixmap and pieces are pre-rendered sprites.
+    The assign* methods work out which squares changed and only those get repainted.
     """
 
     def __init__(self, board=None):
         super(PaintArea, self).__init__()
-        self.board = board
-        self.dots = None
-        self.spdots = None
+        self.board = None
+        self.dots = set()
+        self.spdots = set()
+        self.scores = {}
+        self.pv = {}  # Square -> position in the principal variation
+        self.flips = {}  # Square -> (previous color, time the flip started)
 
         self.setPalette(QPalette(Qt.white))
         self.setAutoFillBackground(True)
@@ -227,74 +448,167 @@ class PaintArea(QWidget):
             [Qt.black, 2, Qt.PenStyle(Qt.SolidLine), Qt.PenCapStyle(Qt.RoundCap), Qt.PenJoinStyle(Qt.MiterJoin)]
         self.noPen = \
             QPen(Qt.black, 2, Qt.PenStyle(Qt.NoPen), Qt.PenCapStyle(Qt.RoundCap), Qt.PenJoinStyle(Qt.MiterJoin))
-        brushColorFrame = QFrame()
-        brushColorFrame.setAutoFillBackground(True)
-        brushColorFrame.setPalette(QPalette(Qt.white))
         self.brushConfig = Qt.white, Qt.SolidPattern
-        self.update()
+        self.dotBrush = QBrush(Qt.blue, Qt.SolidPattern)
+        self.spdotBrush = QBrush(Qt.red, Qt.SolidPattern)
+        self.scoreFont = QFont("Arial", 10, QFont.Bold)
+        self.pvFont = QFont("Arial", 9)
+
+        self.background = self.renderBackground()
+        self.sprites = {reversi.BLACK: self.renderPiece(Qt.black), reversi.WHITE: self.renderPiece(Qt.white)}
+        self.flipTimer = QTimer(self)
+        self.flipTimer.setInterval(FLIP_INTERVAL)
+        self.flipTimer.timeout.connect(self.animateFlips)
+        if board is not None:
+            self.assignBoard(board)
+
+    def renderBackground(self):
+        pixmap = QPixmap(BOARD_SIZE, BOARD_SIZE)
+        pixmap.fill(Qt.white)
+        p = QPainter(pixmap)
+        self.penConfig[0] = Qt.blue
+        p.setPen(QPen(*self.penConfig))
+        p.setBrush(QBrush(*self.brushConfig))
+        # Draw the grids
+        for i in range(9):
+            A = QPoint(margin, margin + i * GRID_SIZE)
+            B = QPoint(BOARD_SIZE - margin, margin + i * GRID_SIZE)
+            p.drawLine(A, B)
+            A = QPoint(margin + i * GRID_SIZE, margin)
+            B = QPoint(margin + i * GRID_SIZE, BOARD_SIZE - margin)
+            p.drawLine(A, B)
+        p.end()
+        return pixmap
+
+    def renderPiece(self, color):
+        # One pixel larger all around, for the outline
+        pixmap = QPixmap(PIECE_SIZE + 2, PIECE_SIZE + 2)
+        pixmap.fill(Qt.transparent)
+        p = QPainter(pixmap)
+        p.setRenderHint(QPainter.Antialiasing)
+        self.penConfig[0] = Qt.black
+        p.setPen(QPen(*self.penConfig))
+        p.setBrush(QBrush(color, Qt.SolidPattern))
+        p.drawEllipse(QRect(1, 1, PIECE_SIZE, PIECE_SIZE))
+        p.end()
+        return pixmap
+
+    @staticmethod
+    def squareRect(x, y):
+        return QRect(margin + x * GRID_SIZE, margin + y * GRID_SIZE, GRID_SIZE, GRID_SIZE)
+
+    def updateSquares(self, squares):
+        for x, y in squares:
+            self.update(self.squareRect(x, y))
 
     def assignBoard(self, board):
-        # Copy the board to avoid accidental change to original board
-        self.board = [list(i) for i in board]
+        """
+        Take the pieces that changed since the last call, and schedule them for repainting
+        """
+        if self.board is None:
+            # Copy the board to avoid accidental change to original board
+            self.board = [list(i) for i in board]
+            self.update()
+            return
+        now = time.monotonic()
+        for x, col in enumerate(board):
+            mine = self.board[x]
+            for y, chess in enumerate(col):
+                if mine[y] != chess:
+                    if FLIP_TIME > 0 and mine[y] != reversi.EMPTY and chess != reversi.EMPTY:
+                        self.flips[x, y] = mine[y], now
+                    mine[y] = chess
+                    self.update(self.squareRect(x, y))
+        if self.flips and not self.flipTimer.isActive():
+            self.flipTimer.start()
 
     def assignDots(self, dots):
-        # This one won't change, no need to copy
+        dots = set(dots or ())
+        self.updateSquares(dots ^ self.dots)
         self.dots = dots
 
     def assignSpecialDots(self, dots):
-        # This one won't change, no need to copy
+        dots = set(dots or ())
+        self.updateSquares(dots ^ self.spdots)
         self.spdots = dots
 
-    def paintEvent(self, QPaintEvent):
+    def assignAnalysis(self, scores, pv):
+        """
+        Scores of moves (positive is good for the human) and the principal variation to overlay
+        """
+        scores = scores or {}
+        pv = {step: i for i, step in enumerate(pv or ())}
+        self.updateSquares(set(self.scores) | set(scores) | set(self.pv) | set(pv))
+        self.scores = scores
+        self.pv = pv
+
+    def animateFlips(self):
+        now = time.monotonic()
+        for square, (_, start) in list(self.flips.items()):
+            if now - start >= FLIP_TIME:
+                del self.flips[square]
+            self.update(self.squareRect(*square))
+        if not self.flips:
+            self.flipTimer.stop()
+
+    def paintEvent(self, event):
         """
-        Called by QWidget (superclass) when an update event arrives
+        Called by QWidget (superclass) when an update event arrives, repaints the squares in its region
         """
         if self.board is None:
             raise ValueError("Cannot paint an empty board!")
+        rect = event.rect()
         p = QPainter(self)
-
-        self.penConfig[0] = Qt.blue
-        p.setPen(QPen(*self.penConfig))
-        p.setBrush(QBrush(*self.brushConfig))
-        # Draw the grids
-        for i in range(9):
-            A = QPoint(margin, margin + i * GRID_SIZE)
-            B = QPoint(BOARD_SIZE - margin, margin + i * GRID_SIZE)
-            p.drawLine(A, B)
-            A = QPoint(margin + i * GRID_SIZE, margin)
-            B = QPoint(margin + i * GRID_SIZE, BOARD_SIZE - margin)
-            p.drawLine(A, B)
-
-        self.penConfig[0] = Qt.black
-        p.setPen(QPen(*self.penConfig))
-        # Draw game pieces
-        for i in range(8):
-            for j in range(8):
-                if self.board[i][j] == 0:
-                    continue
-                fillColor = [None, Qt.black, Qt.white]
-                p.setBrush(QBrush(fillColor[self.board[i][j]], Qt.SolidPattern))
-                p.drawEllipse(QRect(
-                    margin + padding + i * GRID_SIZE, margin + padding + j * GRID_SIZE,
-                    PIECE_SIZE, PIECE_SIZE))
+        p.drawPixmap(rect, self.background, rect)
+
+        x0 = max(0, (rect.left() - margin) // GRID_SIZE)
+        x1 = min(reversi.BS - 1, (rect.right() - margin) // GRID_SIZE)
+        y0 = max(0, (rect.top() - margin) // GRID_SIZE)
+        y1 = min(reversi.BS - 1, (rect.bottom() - margin) // GRID_SIZE)
+        now = time.monotonic()
+        best = max(self.scores.values()) if self.scores else None
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                self.paintSquare(p, x, y, now, best)
+
+    def paintSquare(self, p, x, y, now, best):
+        left, top = margin + x * GRID_SIZE, margin + y * GRID_SIZE
+        chess = self.board[x][y]
+
+        # Draw the game piece, turning it over if it's being flipped
+        if chess != reversi.EMPTY:
+            sprite = self.sprites[chess]
+            width = PIECE_SIZE
+            if (x, y) in self.flips:
+                previous, start = self.flips[x, y]
+                t = min(1.0, (now - start) / FLIP_TIME)
+                if t < 0.5:
+                    sprite = self.sprites[previous]
+                width = max(1, int(PIECE_SIZE * abs(1 - 2 * t)))
+            p.drawPixmap(QRect(left + padding + (PIECE_SIZE - width) // 2 - 1, top + padding - 1,
+                               width + 2, PIECE_SIZE + 2), sprite)
 
         # Draw dot indicators if available
-        if self.dots is not None:
-            p.setPen(self.noPen)
-            p.setBrush(QBrush(Qt.blue, Qt.SolidPattern))
-            for x, y in self.dots:
-                p.drawEllipse(QRect(
-                    margin + d_padding + x * GRID_SIZE, margin + d_padding + y * GRID_SIZE,
-                    DOT_SIZE, DOT_SIZE))
-
-        # Draw special dots if available
-        if self.spdots is not None:
+        if (x, y) in self.dots or (x, y) in self.spdots:
             p.setPen(self.noPen)
-            p.setBrush(QBrush(Qt.red, Qt.SolidPattern))
-            for x, y in self.spdots:
-                p.drawEllipse(QRect(
-                    margin + d_padding + x * GRID_SIZE, margin + d_padding + y * GRID_SIZE,
-                    DOT_SIZE, DOT_SIZE))
+            p.setBrush(self.spdotBrush if (x, y) in self.spdots else self.dotBrush)
+            p.drawEllipse(QRect(left + d_padding, top + d_padding, DOT_SIZE, DOT_SIZE))
+
+        # Draw analysis overlay if available
+        score = self.scores.get((x, y))
+        if score is not None:
+            p.setFont(self.scoreFont)
+            p.setPen(QPen(Qt.darkGreen if score == best else Qt.darkGray))
+            if abs(score) >= inf:
+                text = "Win" if score > 0 else "Loss"
+            else:
+                text = str(score)
+            p.drawText(QRect(left, top, GRID_SIZE, GRID_SIZE // 2), Qt.AlignCenter, text)
+        i = self.pv.get((x, y))
+        if i is not None:
+            p.setPen(QPen(Qt.red))
+            p.setFont(self.pvFont)
+            p.drawText(QRect(left + 3, top + GRID_SIZE - 16, 16, 14), Qt.AlignLeft, str(i + 1))
 
 
 class ScoreIndicator(QWidget):
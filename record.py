@@ -0,0 +1,241 @@
+"""
+Game records
+
+A game is stored as one line: the transcript of its moves in the standard notation
+("f5d6c3d3c4..."), passes left out, optionally followed by tab-separated key=value
+metadata. Blank lines and lines starting with "#" are ignored:
+
+    f5d6c3d3c4f4f6f3e6e7	black=iBug	white=AI	result=34-30
+
+Columns a-h are x and rows 1-8 count up from the bottom of the board as
+__str__ prints it, so standard transcripts replay as they should.
+
+Usage:
+    python3 record.py validate [--replay] FILE...
+    python3 record.py generate --count 1000 [--level 3] FILE
+"""
+
+import argparse
+import gzip
+import random
+import re
+import sys
+import time
+
+from reversi import Reversi, BS
+
+
+COLUMNS = "abcdefgh"
+TRANSCRIPT = re.compile("^(?:[a-hA-H][1-8])*$")
+
+
+class RecordError(ValueError):
+    pass
+
+
+def squareName(step):
+    x, y = step
+    return COLUMNS[x] + str(BS - y)
+
+
+def parseSquare(name):
+    return COLUMNS.index(name[0].lower()), BS - int(name[1])
+
+
+class GameRecord:
+    """
+    A game as a transcript plus a dict of metadata
+    """
+    __slots__ = ("transcript", "meta")
+
+    def __init__(self, transcript, meta=None):
+        self.transcript = transcript
+        self.meta = {} if meta is None else meta
+
+    def __len__(self):
+        return len(self.transcript) // 2
+
+    def __eq__(self, other):
+        return isinstance(other, GameRecord) and (self.transcript, self.meta) == (other.transcript, other.meta)
+
+    def __repr__(self):
+        return "GameRecord({!r}, {!r})".format(self.transcript, self.meta)
+
+    def moves(self):
+        t = self.transcript
+        for i in range(0, len(t), 2):
+            yield parseSquare(t[i:i + 2])
+
+    def replay(self, game=None):
+        """
+        Play the moves on a new (or the given) game, raises RecordError on an illegal move
+        """
+        if game is None:
+            game = Reversi()
+        for i, step in enumerate(self.moves()):
+            if not game.put(step):
+                raise RecordError("Illegal move {} at move {}".format(self.transcript[2 * i:2 * i + 2], i + 1))
+        return game
+
+    @classmethod
+    def fromGame(cls, game, **meta):
+        """
+        Make a record from the history of a game, with its result if it's over
+        """
+        transcript = "".join(squareName(changes[-1]) for changes in game.history if changes)
+        if game.over and 'result' not in meta:
+            _, black, white = game.chessCount
+            meta['result'] = "{}-{}".format(black, white)
+        return cls(transcript, {k: str(v) for k, v in meta.items()})
+
+    @classmethod
+    def parse(cls, line):
+        fields = line.rstrip("\r\n").split("\t")
+        transcript = fields[0].strip()
+        if not TRANSCRIPT.match(transcript):
+            raise RecordError("Bad transcript {!r}".format(transcript))
+        meta = {}
+        for field in fields[1:]:
+            key, sep, value = field.partition("=")
+            if not sep:
+                raise RecordError("Bad metadata field {!r}".format(field))
+            meta[key] = value
+        return cls(transcript.lower(), meta)
+
+    def format(self):
+        return "\t".join([self.transcript] + ["{}={}".format(k, v) for k, v in self.meta.items()])
+
+
+def openRecords(path, mode="r"):
+    """
+    Open a record file for streaming, "-" is stdin/stdout and .gz files are (de)compressed
+    """
+    if path == "-":
+        return sys.stdin if "r" in mode else sys.stdout
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="ascii")
+    return open(path, mode, encoding="ascii")
+
+
+def readRecords(lines, validate=False, onError=None):
+    """
+    Parse records from an iterable of lines (such as an open file), one at a time
+
+    With validate, every game is replayed to check that its moves are legal.
+    Bad records raise RecordError, unless onError is given: then it's called
+    with the line number and the error, and the record is left out.
+    """
+    for n, line in enumerate(lines, 1):
+        if not line.strip() or line.startswith("#"):
+            continue
+        try:
+            record = GameRecord.parse(line)
+            if validate:
+                record.replay()
+        except RecordError as e:
+            if onError is None:
+                raise RecordError("Line {}: {}".format(n, e))
+            onError(n, e)
+            continue
+        yield record
+
+
+def replayRecords(records):
+    """
+    Replay records one after another, yields (record, game) pairs
+    """
+    for record in records:
+        yield record, record.replay()
+
+
+class RecordWriter:
+    """
+    Writes records to an open file, one line each
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def write(self, record):
+        self.f.write(record.format())
+        self.f.write("\n")
+        self.count += 1
+
+    def writeAll(self, records):
+        for record in records:
+            self.write(record)
+        return self.count
+
+
+def playGame(ai=None, rng=random):
+    """
+    Play a game to the end, with random moves or by an AI against itself
+    """
+    game = Reversi()
+    while not game.over:
+        step = ai.findBestStep(game) if ai is not None else rng.choice(game.getAvailables())
+        game.put(step)
+    return game
+
+
+def validate(args):
+    games = moves = 0
+    errors = []
+    start = time.monotonic()
+    for path in args.files:
+        def onError(n, e):
+            errors.append(e)
+            print("{}:{}: {}".format(path, n, e), file=sys.stderr)
+
+        with openRecords(path) as f:
+            for record in readRecords(f, args.replay, onError):
+                games += 1
+                moves += len(record)
+    elapsed = time.monotonic() - start
+    print("{} games, {} moves, {} errors in {:.2f}s ({:.0f} games/sec)".format(
+        games, moves, len(errors), elapsed, games / elapsed if elapsed > 0 else 0))
+    return 1 if errors else 0
+
+
+def generate(args):
+    ai = None
+    if args.level is not None:
+        from ai import ReversiAI
+        ai = ReversiAI(args.level)
+    rng = random.Random(args.seed)
+    random.seed(args.seed)  # ReversiAI opens with random moves
+    start = time.monotonic()
+    with openRecords(args.file, "w") as f:
+        writer = RecordWriter(f)
+        for _ in range(args.count):
+            meta = {} if ai is None else {'black': "AI-{}".format(args.level), 'white': "AI-{}".format(args.level)}
+            writer.write(GameRecord.fromGame(playGame(ai, rng), **meta))
+    elapsed = time.monotonic() - start
+    print("{} games in {:.2f}s ({:.0f} games/sec)".format(
+        writer.count, elapsed, writer.count / elapsed if elapsed > 0 else 0))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate or generate game records")
+    sub = parser.add_subparsers(dest="command")
+    p = sub.add_parser("validate", help="Check record files and report throughput")
+    p.add_argument("--replay", action="store_true", help="Replay every game to check its moves")
+    p.add_argument("files", nargs="+")
+    p = sub.add_parser("generate", help="Write records of self-play games")
+    p.add_argument("--count", type=int, default=1000)
+    p.add_argument("--level", type=int, help="AI level playing both sides, default is random moves")
+    p.add_argument("--seed", type=int)
+    p.add_argument("file")
+    args = parser.parse_args()
+    if args.command == "validate":
+        return validate(args)
+    elif args.command == "generate":
+        return generate(args)
+    parser.print_help()
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,42 @@
 # While these are written as constants,
 # there's no guarantee that the program will continue to work if any of them is changed
 
-BS = 8  # Board size
+import tables
+
+BS = 8  # Default board size, Reversi(size) plays on other (even) sizes
 
 EMPTY = 0
 BLACK = 1
 WHITE = 2
 HASH_KEY = 18446744073709551557
 
+TABLES = tables.load(BS, HASH_KEY)
+SIZE_TABLES = {BS: TABLES}
+
+
+def tablesFor(size):
+    """
+    The geometry tables of a board size
+    """
+    try:
+        return SIZE_TABLES[size]
+    except KeyError:
+        SIZE_TABLES[size] = tables.load(size, HASH_KEY)
+        return SIZE_TABLES[size]
+
 
 class Reversi:
     """
     The Reversi game board and core mechanism
     """
 
-    def __init__(self):
+    def __init__(self, size=BS):
+        if size < 4 or size % 2:
+            raise ValueError("Board size must be even and at least 4")
+        self.size = size
+        self.tables = tablesFor(size)
+        self.squares = self.tables['SQUARES']
+        self.moveRays = self.tables['MOVE_RAYS']
         self.board = None
         self.current = None
         self.history = None
@@ -26,9 +48,11 @@ class Reversi:
         """
 
         # Use double list comprehensions to avoid referring to same sub-list
-        self.board = [[EMPTY for _ in range(BS)] for _ in range(BS)]
-        self.board[3][3] = self.board[4][4] = BLACK  # The starting pieces
-        self.board[3][4] = self.board[4][3] = WHITE
+        size = self.size
+        self.board = [[EMPTY for _ in range(size)] for _ in range(size)]
+        c = size // 2
+        self.board[c - 1][c - 1] = self.board[c][c] = BLACK  # The starting pieces
+        self.board[c - 1][c] = self.board[c][c - 1] = WHITE
         self.current = BLACK
         self.history = []  # Save history for undo operations
 
@@ -39,49 +63,6 @@ class Reversi:
         # A trick used commonly in code golfs
         self.current = [BLACK, WHITE][self.current == BLACK]
 
-    def check(self, x, y, dx, dy, player=None, operate=False, func=lambda *a: None):
-        """
-        Checks if a move can turn any other pieces in a given direction
-
-        Parameters:
-            x, y:    The position of the move
-            dx, dy:  Specify a direction
-            player:  Who
-            operate: Perform the actual move after checking
-            func:    Anything additive to perform
-
-        Return: A boolean value indicating changes
-        """
-        if player is None:  # Process default value
-            player = self.current
-
-        found = False
-        c = 0
-        while True:
-            x += dx
-            y += dy
-            if not (0 <= x < BS and 0 <= y < BS):
-                break
-            chess = self.board[x][y]
-            if chess == EMPTY:
-                break
-            elif chess == player:
-                found = True
-                break
-            else:
-                c += 1
-
-        if c > 0 and found:
-            if operate:
-                while c > 0:
-                    x -= dx
-                    y -= dy
-                    self.board[x][y] = player
-                    func(x, y)
-                    c -= 1
-            return True
-        return False
-
     def canPut(self, x, y, player=None):
         """
         Determine if a player can put a move at a given position by checking
@@ -91,13 +72,22 @@ class Reversi:
         if player is None:
             player = self.current
 
-        if self.board[x][y] != EMPTY:
+        board = self.board
+        if board[x][y] != EMPTY:
             return False
-        # any() and list comprehension is slower
-        return self.check(x, y, -1, -1, player) or self.check(x, y, 1, 1, player) or \
-            self.check(x, y, -1, 0, player) or self.check(x, y, 1, 0, player) or \
-            self.check(x, y, -1, 1, player) or self.check(x, y, 1, -1, player) or \
-            self.check(x, y, 0, -1, player) or self.check(x, y, 0, 1, player)
+        opponent = BLACK + WHITE - player
+        # Walk each ray while it's the opponent's, it's a move if one of ours ends it
+        for ray in self.moveRays[x][y]:
+            tx, ty = ray[0]
+            if board[tx][ty] != opponent:
+                continue
+            for tx, ty in ray:
+                chess = board[tx][ty]
+                if chess != opponent:
+                    if chess == player:
+                        return True
+                    break
+        return False
 
     def getAvailables(self, player=None):
         """
@@ -106,7 +96,72 @@ class Reversi:
         if player is None:
             player = self.current
 
-        return [(x, y) for x in range(BS) for y in range(BS) if self.canPut(x, y, player)]
+        return [(x, y) for x, y in self.squares if self.canPut(x, y, player)]
+
+    def iterMoves(self, player=None, squares=None):
+        """
+        Yield the available moves of a player one at a time, checking each square only
+        when the next move is asked for. squares gives the order, by default that of getAvailables().
+
+        The board may change between moves as long as it's back as it was by the next one.
+        """
+        if player is None:
+            player = self.current
+        if squares is None:
+            squares = self.squares
+
+        for x, y in squares:
+            if self.canPut(x, y, player):
+                yield x, y
+
+    def mobility(self):
+        """
+        Mobility counts of both sides in one pass over the board
+
+        Returns a tuple (moves, potential, frontier) for BLACK followed by the same for WHITE:
+            moves:     How many moves the player has, as len(getAvailables(player))
+            potential: Empty squares next to an opponent's disc
+            frontier:  The player's discs next to an empty square
+        """
+        board = self.board
+        neighbourRays, bits = self.tables['NEIGHBOUR_RAYS'], self.tables['BITS']
+        movesB = movesW = potentialB = potentialW = 0
+        frontierB = frontierW = 0  # As sets of bits, a disc can be next to several empty squares
+        for x, col in enumerate(board):
+            raysCol = neighbourRays[x]
+            for y, chess in enumerate(col):
+                if chess != EMPTY:
+                    continue
+                # Each ray starts at a neighbour, and a run of its colour is a move for the other
+                nearB = nearW = canB = canW = False
+                for ray in raysCol[y]:
+                    tx, ty = ray[0]
+                    first = board[tx][ty]
+                    if first == EMPTY:
+                        continue
+                    if first == BLACK:
+                        nearB = True
+                        frontierB |= bits[tx][ty]
+                        if canW:
+                            continue
+                    else:
+                        nearW = True
+                        frontierW |= bits[tx][ty]
+                        if canB:
+                            continue
+                    for tx, ty in ray:
+                        chess = board[tx][ty]
+                        if chess != first:
+                            if chess == BLACK:
+                                canB = True
+                            elif chess == WHITE:
+                                canW = True
+                            break
+                movesB += canB
+                movesW += canW
+                potentialB += nearW
+                potentialW += nearB
+        return movesB, potentialB, bin(frontierB).count("1"), movesW, potentialW, bin(frontierW).count("1")
 
     def any(self, player=None):
         """
@@ -116,7 +171,7 @@ class Reversi:
             player = self.current
 
         # Usually True, use a generator expression hoping to save some calculation
-        return any(self.canPut(x, y, player) for x in range(BS) for y in range(BS))
+        return any(self.canPut(x, y, player) for x, y in self.squares)
 
     @property
     def over(self):
@@ -148,9 +203,9 @@ class Reversi:
         # Relies on EMPTY, BLACK, WHITE == 0, 1, 2
         cc = [0, 0, 0]
 
-        for x in range(BS):
-            for y in range(BS):
-                cc[self.board[x][y]] += 1
+        for col in self.board:
+            for chess in col:
+                cc[chess] += 1
         return cc
 
     def put(self, x, y=None, player=None):
@@ -167,19 +222,21 @@ class Reversi:
         if player is None:
             player = self.current
 
+        board = self.board
+        opponent = BLACK + WHITE - player
         changes = []  # Save changes for undo
-
-        def saveChange(x, y):
-            changes.append((x, y))
-
-        self.check(x, y, -1, -1, player, True, saveChange)
-        self.check(x, y, 1, 1, player, True, saveChange)
-        self.check(x, y, -1, 0, player, True, saveChange)
-        self.check(x, y, 1, 0, player, True, saveChange)
-        self.check(x, y, -1, 1, player, True, saveChange)
-        self.check(x, y, 1, -1, player, True, saveChange)
-        self.check(x, y, 0, -1, player, True, saveChange)
-        self.check(x, y, 0, 1, player, True, saveChange)
+        for ray in self.moveRays[x][y]:
+            tx, ty = ray[0]
+            if board[tx][ty] != opponent:
+                continue
+            for i, (tx, ty) in enumerate(ray):
+                chess = board[tx][ty]
+                if chess != opponent:
+                    if chess == player:
+                        for tx, ty in ray[:i]:
+                            board[tx][ty] = player
+                        changes.extend(ray[:i])
+                    break
 
         if len(changes) == 0:  # Not movable
             return False
@@ -227,7 +284,7 @@ class Reversi:
         """
         Create a copy of this Reversi game
         """
-        game = Reversi()
+        game = Reversi(self.size)
         game.board = [list(col) for col in self.board]
         game.history = [list(h) for h in self.history]
         game.current = self.current
@@ -235,11 +292,26 @@ class Reversi:
 
     def __str__(self):
         # Enable human-friendly output for print(game)
-        return "\n".join(" ".join([".", "O", "X"][self.board[x][y]] for x in range(BS)) for y in range(BS))
+        size = self.size
+        return "\n".join(" ".join([".", "O", "X"][self.board[x][y]] for x in range(size)) for y in range(size))
 
     def __hash__(self):
         res = 0
-        for x in range(8):
-            for y in range(8):
-                res = (3 * res + self.board[x][y]) % HASH_KEY
-        return res ^ (1 + self.current)
+        for powers, col in zip(self.tables['HASH_POWERS'], self.board):
+            for power, chess in zip(powers, col):
+                if chess:
+                    res += power * chess
+        return (res % HASH_KEY) ^ (1 + self.current)
+
+    def key(self):
+        """
+        The position and the side to move as an exact integer (the board read as a base-3 number),
+        for tables that must never mix up two positions. Hashes can collide: __hash__ is reduced
+        modulo HASH_KEY, and hash() further to 61 bits.
+        """
+        res = 0
+        for powers, col in zip(self.tables['KEY_POWERS'], self.board):
+            for power, chess in zip(powers, col):
+                if chess:
+                    res += power * chess
+        return res * 2 + self.current - BLACK
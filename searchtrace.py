@@ -0,0 +1,329 @@
+"""
+Search traces
+
+Records the tree a search explores, node by node, to a compact binary file as the
+search runs, for finding out afterwards why the AI played a bad or slow move.
+
+A TraceRecorder attached to an engine shadows its heuristicSearchSteps, exactSearchSteps
+and probCutSteps with recording wrappers on the instance, which the searches call for
+every node. Engines without a recorder run the class methods untouched, so there's no
+cost at all while tracing is off. Records are buffered up to a fixed size and written out,
+so memory stays bounded however large the tree, and maxRecords bounds the file.
+
+Each node is a fixed-size record, written when the search leaves the node, so children
+come before their parent: the position's hash, the search it's from, its ply from the root
+of the search, the depth left, the move that led to it and the best move found, the
+alpha-beta window, the score and why the node ended (see REASONS).
+
+Usage:
+    python3 searchtrace.py record --level 5 search.trace [TRANSCRIPT]
+    python3 searchtrace.py summary search.trace
+    python3 searchtrace.py filter --max-ply 1 --reason probcut search.trace
+"""
+
+import argparse
+import collections
+import struct
+import sys
+
+import ai
+import profiling
+import record
+
+
+MAGIC = b"RVTRACE1"
+RECORD = struct.Struct("<QBBBBBBxxiii")  # Key, kind, ply, depth, move, best, reason, alpha, beta, score
+BUFFER_BYTES = 1 << 16  # Records kept in memory before they're written
+NO_MOVE = 255  # The move of a root or a pass
+
+HEURISTIC, EXACT_SEARCH = 0, 1
+KINDS = {HEURISTIC: "heuristic", EXACT_SEARCH: "exact"}
+
+# Why a node ended
+EXACT, FAIL_HIGH, FAIL_LOW, LEAF, PROBCUT, STORED, TERMINAL = range(7)
+REASONS = {
+    EXACT: "exact",  # The score is inside the window
+    FAIL_HIGH: "fail-high",  # At or above beta, a cutoff
+    FAIL_LOW: "fail-low",  # At or below alpha
+    LEAF: "leaf",  # At the horizon, scored by the heuristic
+    PROBCUT: "probcut",  # Pruned by ProbCut
+    STORED: "stored",  # Answered by the endgame store
+    TERMINAL: "terminal",  # The game is over
+}
+
+TraceNode = collections.namedtuple("TraceNode", "key kind ply depth move best reason alpha beta score")
+
+
+def encodeMove(step, size):
+    if not step:
+        return NO_MOVE
+    x, y = step
+    return x * size + y
+
+
+def decodeMove(move, size):
+    if move == NO_MOVE:
+        return None
+    return move // size, move % size
+
+
+class Frame:
+    """
+    A node the search is in
+    """
+    __slots__ = ("children", "probCut")
+
+    def __init__(self):
+        self.children = 0
+        self.probCut = False
+
+
+class TraceRecorder:
+    """
+    Records the searches of the engines attached to it to a trace file
+
+        with TraceRecorder("search.trace") as recorder:
+            recorder.attach(engine)
+            engine.findBestStep(game)
+
+    An engine is searched by one thread at a time, and so is a recorder.
+    """
+
+    def __init__(self, path, maxRecords=None, bufferBytes=BUFFER_BYTES):
+        self.path = path
+        self.maxRecords = maxRecords
+        self.bufferBytes = bufferBytes
+        self.buffer = bytearray()
+        self.stack = []  # A Frame per node in progress
+        self.engines = []
+        self.records = 0
+        self.dropped = 0  # Nodes past maxRecords
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def attach(self, engine):
+        """
+        Record the searches of an engine until detach() or close()
+        """
+        if engine in self.engines:
+            return
+        self.engines.append(engine)
+        engine.heuristicSearchSteps = self.wrapSearch(engine.heuristicSearchSteps, HEURISTIC)
+        engine.exactSearchSteps = self.wrapSearch(engine.exactSearchSteps, EXACT_SEARCH)
+        engine.probCutSteps = self.wrapProbCut(engine.probCutSteps)
+
+    def detach(self, engine):
+        """
+        Put the engine's own search methods back
+        """
+        if engine not in self.engines:
+            return
+        self.engines.remove(engine)
+        for name in ("heuristicSearchSteps", "exactSearchSteps", "probCutSteps"):
+            del engine.__dict__[name]
+
+    def wrapSearch(self, search, kind):
+        stack = self.stack
+
+        def wrapper(game, player, depth, alpha, beta):
+            if stack:
+                stack[-1].children += 1
+            frame = Frame()
+            stack.append(frame)
+            try:
+                result = yield from search(game, player, depth, alpha, beta)
+            finally:
+                stack.pop()  # Left out of the trace if the search is stopped
+            if isinstance(result, tuple):
+                score, step = result
+            else:
+                score, step = result, ()  # heuristicSearchSteps returns a bare score at depth 0
+
+            if frame.probCut:
+                reason = PROBCUT
+            elif frame.children == 0 and game.over:
+                reason = TERMINAL
+            elif frame.children == 0:
+                reason = LEAF if kind == HEURISTIC else STORED
+            elif score >= beta:
+                reason = FAIL_HIGH
+            elif score <= alpha:
+                reason = FAIL_LOW
+            else:
+                reason = EXACT
+            self.write(game.__hash__(), kind, len(stack), depth, encodeMove(game.lastChess, game.size),
+                       encodeMove(step, game.size), reason, alpha, beta, score)
+            return result
+        return wrapper
+
+    def wrapProbCut(self, probCut):
+        stack = self.stack
+
+        def wrapper(game, player, depth, alpha, beta):
+            cut = yield from probCut(game, player, depth, alpha, beta)
+            if cut is not None:
+                stack[-1].probCut = True
+            return cut
+        return wrapper
+
+    def write(self, key, kind, ply, depth, move, best, reason, alpha, beta, score):
+        if self.maxRecords is not None and self.records >= self.maxRecords:
+            self.dropped += 1
+            return
+        self.records += 1
+        self.buffer += RECORD.pack(key, kind, min(ply, 255), max(depth, 0), move, best, reason, alpha, beta, score)
+        if len(self.buffer) >= self.bufferBytes:
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer)
+        self.buffer.clear()
+
+    def close(self):
+        for engine in list(self.engines):
+            self.detach(engine)
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+def readTrace(f):
+    """
+    Yields the TraceNodes of a trace file object opened for binary reading
+    """
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a search trace")
+    while True:
+        data = f.read(RECORD.size * 4096)
+        for fields in RECORD.iter_unpack(data[:len(data) // RECORD.size * RECORD.size]):
+            yield TraceNode(*fields)
+        if len(data) < RECORD.size * 4096:
+            return
+
+
+def summarise(nodes):
+    """
+    Node counts of a trace, as a dict of
+        nodes:    All nodes
+        roots:    Searches (nodes at ply 0)
+        maxPly:   The deepest ply reached
+        byKind:   {kind name: nodes}
+        byReason: {reason name: nodes}
+        byPly:    {ply: nodes}
+        fanout:   {ply: average children of the nodes at that ply that have any}
+    """
+    count = 0
+    byKind, byReason, byPly = collections.Counter(), collections.Counter(), collections.Counter()
+    parents = collections.Counter()  # ply -> nodes with children
+    last = None
+    for node in nodes:
+        count += 1
+        byKind[KINDS[node.kind]] += 1
+        byReason[REASONS[node.reason]] += 1
+        byPly[node.ply] += 1
+        # Children are written right before their parent
+        if last is not None and last.ply == node.ply + 1:
+            parents[node.ply] += 1
+        last = node
+    return {
+        'nodes': count,
+        'roots': byPly[0],
+        'maxPly': max(byPly) if byPly else 0,
+        'byKind': dict(byKind),
+        'byReason': dict(byReason),
+        'byPly': dict(sorted(byPly.items())),
+        'fanout': {ply: byPly[ply + 1] / parents[ply] for ply in sorted(parents)},
+    }
+
+
+def formatNode(node, size=ai.BS):
+    def name(move):
+        step = decodeMove(move, size)
+        return record.squareName(step) if step else "--"
+    return "{:016x} {:>9} ply {:2d} depth {:2d} {} best {} [{}, {}] {} {}".format(
+        node.key, KINDS[node.kind], node.ply, node.depth, name(node.move), name(node.best),
+        node.alpha, node.beta, node.score, REASONS[node.reason])
+
+
+def recordSearch(args):
+    game = record.GameRecord(args.transcript.lower()).replay()
+    engine = ai.ReversiAI(args.level)
+    with TraceRecorder(args.trace, args.max_records) as recorder:
+        recorder.attach(engine)
+        step = engine.findBestStep(game)
+    print("Best move {}, {} nodes, {} recorded, {} dropped".format(
+        record.squareName(step) if step else "pass", engine.nodeCount, recorder.records, recorder.dropped))
+    return 0
+
+
+def summary(args):
+    with open(args.trace, "rb") as f:
+        s = summarise(readTrace(f))
+    print("{} nodes in {} searches, deepest ply {}".format(s['nodes'], s['roots'], s['maxPly']))
+    for title, counts in (("kind", s['byKind']), ("reason", s['byReason'])):
+        for key, n in sorted(counts.items(), key=lambda item: -item[1]):
+            print("{:>10} {:<10}{:>10}{:>8.1f}%".format(title, key, n, n * 100 / s['nodes']))
+    print("  ply     nodes  fanout")
+    for ply, n in s['byPly'].items():
+        fanout = s['fanout'].get(ply)
+        print("{:5d}{:10d}  {}".format(ply, n, "{:6.2f}".format(fanout) if fanout else "     -"))
+    return 0
+
+
+def filterNodes(args):
+    reasons = {name: reason for reason, name in REASONS.items()}
+    key = None if args.key is None else int(args.key, 16)
+    shown = 0
+    with open(args.trace, "rb") as f:
+        for node in readTrace(f):
+            if args.max_ply is not None and node.ply > args.max_ply:
+                continue
+            if args.reason is not None and node.reason != reasons[args.reason]:
+                continue
+            if key is not None and node.key != key:
+                continue
+            if args.min_depth is not None and node.depth < args.min_depth:
+                continue
+            print(formatNode(node))
+            shown += 1
+            if args.limit is not None and shown >= args.limit:
+                break
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and read search traces")
+    sub = parser.add_subparsers(dest="command")
+    p = sub.add_parser("record", help="Trace one findBestStep call")
+    p.add_argument("--level", type=int, default=5)
+    p.add_argument("--max-records", type=int)
+    p.add_argument("trace")
+    p.add_argument("transcript", nargs="?", default=profiling.MIDGAME, help="Moves from the start")
+    p = sub.add_parser("summary", help="Count the nodes of a trace by kind, reason and ply")
+    p.add_argument("trace")
+    p = sub.add_parser("filter", help="Print the nodes of a trace that match")
+    p.add_argument("--max-ply", type=int)
+    p.add_argument("--min-depth", type=int)
+    p.add_argument("--reason", choices=sorted(REASONS.values()))
+    p.add_argument("--key", help="Position hash, in hex")
+    p.add_argument("--limit", type=int)
+    p.add_argument("trace")
+    args = parser.parse_args()
+    if args.command == "record":
+        return recordSearch(args)
+    elif args.command == "summary":
+        return summary(args)
+    elif args.command == "filter":
+        return filterNodes(args)
+    parser.print_help()
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
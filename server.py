@@ -1,55 +1,265 @@
+import concurrent.futures
+import os
+import select
+import socket
+import threading
+import time
+
 from flask import *
 from reversi import Reversi
-from ai import ReversiAI
+from ai import AICONFIG
+from pool import EnginePool
+import cache
+import endgame
+import metrics
 
 
 app = Flask(__name__)
 
 
-game = Reversi()
-ai = ReversiAI()
+# Solved endgames are kept in this file if it's set, shared with other server processes
+endgameStore = endgame.EndgameStore(os.environ["REVERSI_ENDGAME"]) if os.environ.get("REVERSI_ENDGAME") else None
+
+# With REVERSI_BATCH set to a batch size, the leaves of all the searches in progress are scored
+# together in batches of up to that many positions, waiting up to REVERSI_BATCH_WAIT seconds
+# for more (needs NumPy, see batch.py). Searches then take no CPU time of their own while they
+# wait, so many more of them run at a time.
+if int(os.environ.get("REVERSI_BATCH", 0)) > 0:
+    import batch
+    scheduler = batch.LeafScheduler(int(os.environ["REVERSI_BATCH"]),
+                                    float(os.environ.get("REVERSI_BATCH_WAIT", batch.MAX_WAIT)))
+    engines = EnginePool(batch.MAX_SEARCHES, endgame=endgameStore)
+else:
+    scheduler = None
+    engines = EnginePool(endgame=endgameStore)
+defaultLevel = 0  # For clients that don't send a level with get_move, see set_difficulty
+
+# Upper limit of the time (seconds) a get_move request may take, including waiting for the
+# engine, so a slow search can't hold up the server for long. Requests without a budget of
+# their own search to the level's fixed depth, as they always have, but are stopped after this
+# long too (answering with the first legal move).
+MAX_BUDGET = 10.0
+PONDER_BUDGET = 10.0  # Time limit of pondering for one position
+
+# Share results between worker processes if a cache process is running (python3 cache.py),
+# otherwise fall back to a cache local to this process
+if os.environ.get("REVERSI_CACHE"):
+    results = cache.connectCache(cache.parseAddress(os.environ["REVERSI_CACHE"]))
+else:
+    results = cache.ResultCache()
+
+registry = metrics.Registry()
+requestLatency = registry.histogram(
+    "reversi_request_seconds", "Time taken to answer a request", ("action", "level"))
+requestErrors = registry.counter(
+    "reversi_request_errors_total", "Requests answered with an error", ("action", "exception"))
+searchNodes = registry.counter(
+    "reversi_search_nodes_total", "Nodes visited by engine searches", ("level",))
+searchSeconds = registry.counter(
+    "reversi_search_seconds_total", "Time spent in engine searches", ("level",))
+searchSpeed = registry.gauge(
+    "reversi_search_nodes_per_second", "Speed of the last engine search", ("level",))
+queueDepth = registry.gauge(
+    "reversi_queue_depth", "Requests waiting for an engine")
+enginesBusy = registry.gauge(
+    "reversi_engines_busy", "Engines running a search")
+engineCount = registry.gauge(
+    "reversi_engines", "Searches this process runs at a time", func=lambda: engines.size)
+cacheHits = registry.counter(
+    "reversi_cache_hits_total", "Result cache hits", func=lambda: results.stats()['hits'])
+cacheMisses = registry.counter(
+    "reversi_cache_misses_total", "Result cache misses", func=lambda: results.stats()['misses'])
+cacheSize = registry.gauge(
+    "reversi_cache_entries", "Positions in the result cache", func=lambda: results.stats()['size'])
+if scheduler is not None:
+    leafPositions = registry.counter(
+        "reversi_leaf_positions_total", "Leaf positions scored in batches",
+        func=lambda: scheduler.stats()['positions'])
+    leafBatches = registry.counter(
+        "reversi_leaf_batches_total", "Batches of leaf positions scored", func=lambda: scheduler.stats()['batches'])
+    leafSeconds = registry.counter(
+        "reversi_leaf_seconds_total", "Time spent scoring batches of leaf positions",
+        func=lambda: scheduler.stats()['eval_seconds'])
+    leafSpeed = registry.gauge(
+        "reversi_leaf_positions_per_second", "Leaf positions scored per second of batch evaluation",
+        func=lambda: scheduler.stats()['positions_per_second'])
+
+
+def error(action, exception, message, status=400):
+    requestErrors.inc(action, exception)
+    return jsonify({'error': {'exception': exception, 'message': message}}), status
 
 
 @app.route("/", methods=["POST"])
 def index():
+    start = time.monotonic()
+    action = level = None
     try:
         data = request.get_json()
         action = data['action']
         data = data['data']
+        level = data.get('level', defaultLevel)
+        # Keep the labels of the latency histogram to the known levels
+        if isinstance(level, bool) or not isinstance(level, int) or not 0 <= level < len(AICONFIG):
+            level = "invalid"
         if action == "set_difficulty":
             return set_difficulty(data)
         elif action == "get_move":
             return get_next_move(data)
+        elif action == "ponder":
+            return ponder(data)
+        elif action == "get_stats":
+            return get_stats(data)
     except Exception as e:
         from traceback import format_tb
         import sys
         print("".join(format_tb(sys.exc_info()[2])))
-        return jsonify({'error': {'exception': type(e).__name__, 'message': str(e)}}), 400
+        return error(action, type(e).__name__, str(e))
+    finally:
+        requestLatency.observe(time.monotonic() - start, action, level)
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+def clientGone(environ):
+    """
+    Check if the client of a request has closed its connection
+    """
+    sock = environ.get("werkzeug.socket") or environ.get("gunicorn.socket")
+    if sock is None:
+        return False  # Can't tell with this server
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        # A readable socket with nothing to read has been closed by the peer
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b""
+    except (OSError, ValueError):
+        return True
 
 
 def set_difficulty(data):
-    global ai
-    if 0 <= data['level'] < 8:
+    """
+    Set the level used for get_move requests that don't carry one
+
+    Kept for older clients, the engines themselves are never switched
+    """
+    global defaultLevel
+    if 0 <= data['level'] < len(AICONFIG):
         print("Set AI level {}".format(data['level']))
-        ai.setLevel(data['level'])
+        defaultLevel = data['level']
         return jsonify({'message': "success"})
     return jsonify({'message': "invalid difficulty level"}), 400
 
 
 def get_next_move(data):
-    global ai, game
     try:
+        start = time.monotonic()
+        # The client may send a latency budget in milliseconds
+        budget = data.get('budget')
+        if budget is not None:
+            budget = min(budget / 1000, MAX_BUDGET)
+        level = data.get('level', defaultLevel)
+        if not 0 <= level < len(AICONFIG):
+            return error("get_move", "ValueError", "invalid difficulty level")
+
         # Reconstruct game board from incoming data
+        game = Reversi()
         game.current = data['current']
         game.board = data['board']
         game.history = []
 
-        # Calculate best move
-        x, y = ai.findBestStep(game)
-        return jsonify({'move': {'x': x, 'y': y}})
+        key = cache.makeKey(game.board, game.current, level)
+        move = results.get(key)
+        complete = True
+        if move is None:
+            queueDepth.inc()
+            try:
+                ai = engines.acquire(level, timeout=MAX_BUDGET if budget is None else budget)
+            finally:
+                queueDepth.dec()
+            if ai is None:
+                return error("get_move", "Busy", "no engine available in time", 503)
+            enginesBusy.inc()
+            searchStart = time.monotonic()
+            abandoned = False  # The scheduler didn't give the engine back in time
+            try:
+                environ = request.environ
+                # Calculate best move. Searches stop when the client hangs up. With a budget they
+                # deepen iteratively and stop in time, otherwise they search to fixed depth with
+                # MAX_BUDGET as a ceiling.
+                remaining = None if budget is None else budget - (searchStart - start)
+                ceiling = start + MAX_BUDGET
+
+                def cancelled():
+                    return clientGone(environ) or time.monotonic() >= ceiling
+
+                if scheduler is not None:
+                    try:
+                        move = scheduler.search(ai, game, remaining, cancelled,
+                                                timeout=ceiling - time.monotonic() + batch.RESULT_GRACE)
+                    except concurrent.futures.TimeoutError:
+                        abandoned = True
+                        return error("get_move", "Timeout", "no move within the budget", 503)
+                else:
+                    move = ai.findBestStep(game, remaining, cancelled)
+                complete = not ai.interrupted
+            finally:
+                elapsed = time.monotonic() - searchStart
+                searchNodes.inc(level, amount=ai.nodeCount)
+                searchSeconds.inc(level, amount=elapsed)
+                if elapsed > 0:
+                    searchSpeed.set(ai.nodeCount / elapsed, level)
+                enginesBusy.dec()
+                if abandoned:
+                    engines.discard(ai)
+                else:
+                    engines.release(ai)
+            if move and complete:
+                results.put(key, move)
+        x, y = move
+        return jsonify({'move': {'x': x, 'y': y}, 'complete': complete})
     except Exception as e:
-        return jsonify({'error': {'exception': type(e).__name__, 'message': str(e)}}), 400
+        return error("get_move", type(e).__name__, str(e))
+
+
+def ponder(data):
+    """
+    Search the replies to the likely moves of the current player in the background,
+    and cache them for the get_move requests that follow
+
+    Only runs on an idle engine, and stops as soon as a request waits for one
+    """
+    level = data.get('level', defaultLevel)
+    if not 0 <= level < len(AICONFIG):
+        return error("ponder", "ValueError", "invalid difficulty level")
+    game = Reversi()
+    game.current = data['current']
+    game.board = data['board']
+    ai = engines.acquire(level, timeout=0)
+    if ai is None:
+        return jsonify({'message': "busy"})
+
+    def run():
+        enginesBusy.inc()
+        try:
+            for position, reply in ai.ponder(game, PONDER_BUDGET, lambda: engines.waiting > 0):
+                results.put(cache.makeKey(position.board, position.current, level), reply)
+        finally:
+            enginesBusy.dec()
+            engines.release(ai)
+
+    threading.Thread(target=run, daemon=True).start()
+    return jsonify({'message': "pondering"})
+
+
+def get_stats(data):
+    stats = {'cache': results.stats(), 'engines': engines.stats()}
+    if endgameStore is not None:
+        stats['endgame'] = endgameStore.stats()
+    return jsonify(stats)
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    app.run(host="0.0.0.0", port=5000, debug=True, threaded=True)
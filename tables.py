@@ -0,0 +1,130 @@
+"""
+Static tables of the board geometry
+
+Everything reversi.py and ai.py look up per square instead of working out on every call:
+rays in the 8 directions, neighbours, the lines through a square, square classes and hash
+weights. They're built once per board size and cached in a marshal file next to the .pyc
+files, which later imports read back without building anything. Like the .pyc files, the
+cache isn't written if the directory is read-only or PYTHONDONTWRITEBYTECODE is set.
+"""
+
+import marshal
+import os
+import struct
+import sys
+
+
+TABLES_VERSION = 4  # Bump when build() changes, so old cache files are rebuilt
+MAGIC = b"RVTABLES"
+HEADER = struct.Struct("<8sIIQ")  # Magic, version, board size, hash key
+CACHE_DIR = os.environ.get("REVERSI_TABLES", os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__"))
+
+# The order reversi.py has always checked directions in
+DIRECTIONS = ((-1, -1), (1, 1), (-1, 0), (1, 0), (-1, 1), (1, -1), (0, -1), (0, 1))
+# Pairs of opposite directions, as indices into DIRECTIONS
+AXES = ((6, 7), (2, 3), (0, 1), (5, 4))
+
+CLASS_INNER, CLASS_EDGE, CLASS_CORNER = 0, 1, 2
+
+
+def build(size, hashKey):
+    """
+    Build the tables of a board size, as a dict of nested tuples indexed [x][y]
+    """
+    def onBoard(x, y):
+        return 0 <= x < size and 0 <= y < size
+
+    def ray(x, y, dx, dy):
+        squares = []
+        x, y = x + dx, y + dy
+        while onBoard(x, y):
+            squares.append((x, y))
+            x, y = x + dx, y + dy
+        return tuple(squares)
+
+    def squareClass(x, y):
+        edges = (x in (0, size - 1)) + (y in (0, size - 1))
+        return (CLASS_INNER, CLASS_EDGE, CLASS_CORNER)[edges]
+
+    def movePriority(x, y):
+        # Edges first, then the inner squares, then the squares next to corners (C and X squares)
+        nearCorner = min(x, size - 1 - x) <= 1 and min(y, size - 1 - y) <= 1
+        return (nearCorner, squareClass(x, y) != CLASS_EDGE, (x, y))
+
+    squares = tuple((x, y) for x in range(size) for y in range(size))
+    rays = tuple(tuple(tuple(ray(x, y, dx, dy) for dx, dy in DIRECTIONS) for y in range(size)) for x in range(size))
+    return {
+        'SQUARES': squares,
+        # All 8 rays of each square, empty ones included, in DIRECTIONS order
+        'RAYS': rays,
+        # The rays a move can flip along: 2 squares or longer
+        'MOVE_RAYS': tuple(tuple(tuple(r for r in rays[x][y] if len(r) >= 2) for y in range(size)) for x in range(size)),
+        # The rays that aren't empty, each starting at a neighbour
+        'NEIGHBOUR_RAYS': tuple(tuple(tuple(r for r in rays[x][y] if r) for y in range(size)) for x in range(size)),
+        'NEIGHBOURS': tuple(tuple(tuple(r[0] for r in rays[x][y] if r) for y in range(size)) for x in range(size)),
+        # The 4 lines through a square, as pairs of opposite rays
+        'LINES': tuple(tuple(tuple((rays[x][y][i], rays[x][y][j]) for i, j in AXES) for y in range(size))
+                       for x in range(size)),
+        # A bit per square, for sets of squares as ints
+        'BITS': tuple(tuple(1 << (x * size + y) for y in range(size)) for x in range(size)),
+        # The squares moves are tried in by the searches: corners, then the rest best first
+        'CORNERS': tuple((x, y) for x, y in squares if squareClass(x, y) == CLASS_CORNER),
+        'MOVE_ORDER': tuple(sorted((s for s in squares if squareClass(*s) != CLASS_CORNER),
+                                   key=lambda s: movePriority(*s))),
+        'SQUARE_CLASS': tuple(tuple(squareClass(x, y) for y in range(size)) for x in range(size)),
+        # Reversi.__hash__ is the board read as a base-3 number, these are the digit weights
+        'HASH_POWERS': tuple(tuple(pow(3, size * size - 1 - (x * size + y), hashKey) for y in range(size))
+                             for x in range(size)),
+        # The same, not reduced, for Reversi.key
+        'KEY_POWERS': tuple(tuple(3 ** (size * size - 1 - (x * size + y)) for y in range(size)) for x in range(size)),
+    }
+
+
+def cachePath(size):
+    return os.path.join(CACHE_DIR, "tables-{}.{}.bin".format(size, sys.implementation.cache_tag))
+
+
+def readCache(path, size, hashKey):
+    """
+    Load tables from a cache file, None if it's missing or stale
+    """
+    try:
+        with open(path, "rb") as f:
+            if HEADER.unpack(f.read(HEADER.size)) != (MAGIC, TABLES_VERSION, size, hashKey):
+                return None
+            return marshal.loads(f.read())
+    except (OSError, ValueError, EOFError, TypeError, struct.error):
+        return None
+
+
+def writeCache(path, size, hashKey, tables):
+    """
+    Write a cache file, if the directory is writable. Failing to is never an error, the tables
+    are built again next time.
+    """
+    if sys.dont_write_bytecode:
+        return
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, TABLES_VERSION, size, hashKey))
+            f.write(marshal.dumps(tables))
+        os.replace(tmp, path)  # Readers never see a half-written file
+    except (OSError, ValueError):
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+def load(size, hashKey):
+    """
+    The tables of a board size, from the cache file if it's there and building it if not
+    """
+    path = cachePath(size)
+    tables = readCache(path, size, hashKey)
+    if tables is None:
+        tables = build(size, hashKey)
+        writeCache(path, size, hashKey, tables)
+    return tables
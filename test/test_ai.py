@@ -0,0 +1,131 @@
+import asyncio
+import random
+import time
+
+import ai
+from reversi import Reversi
+
+
+def midgame(seed, moves=20):
+    game = Reversi()
+    rng = random.Random(seed)
+    for _ in range(moves):
+        game.put(rng.choice(game.getAvailables()))
+    return game
+
+
+def test_findBestStep_budget():
+    engine = ai.ReversiAI(8)
+    game = midgame(1)
+    start = time.monotonic()
+    step = engine.findBestStep(game, budget=0.2)
+    assert time.monotonic() - start < 2
+    assert engine.interrupted
+    assert step in game.getAvailables()
+
+
+def test_findBestStep_cancel():
+    engine = ai.ReversiAI(8)
+    game = midgame(1)
+    nodes = []
+    step = engine.findBestStep(game, cancelled=lambda: len(nodes) > 2, progress=nodes.append)
+    assert engine.interrupted
+    assert step in game.getAvailables()
+    assert game.board == midgame(1).board  # Left as it was
+
+
+def test_findBestStep_cancel_fixed_depth():
+    # A cancel callback alone doesn't change a search to fixed depth, it only makes it stoppable
+    game = midgame(4)
+    engine = ai.ReversiAI(5)
+    expected = engine.findBestStep(game)
+    nodes = engine.nodeCount
+    engine = ai.ReversiAI(5)
+    assert engine.findBestStep(game, cancelled=lambda: False) == expected
+    assert engine.nodeCount == nodes and not engine.interrupted
+
+
+def test_ponder():
+    engine = ai.ReversiAI(3)
+    game = midgame(2)
+    pondered = engine.ponder(game)
+    assert 0 < len(pondered) <= ai.PONDER_WIDTH
+    for position, reply in pondered:
+        assert reply in position.getAvailables()
+        assert engine.findBestStep(position) == reply
+        assert engine.nodeCount == 0  # Answered without searching
+
+
+def test_sliced_search():
+    game = midgame(3)
+    expected = ai.ReversiAI(5).findBestStep(game)
+    search = ai.SlicedSearch(ai.ReversiAI(5), game)
+    slices = 1
+    while not search.run(nodes=50):
+        slices += 1
+    assert slices > 1
+    assert search.result == expected
+
+    search = ai.SlicedSearch(ai.ReversiAI(8), game)
+    search.run(nodes=200)
+    search.cancel()
+    assert search.done and search.result in game.getAvailables()
+
+    # On a used engine the first slice is no longer than the others
+    engine = ai.ReversiAI(5)
+    engine.findBestStep(game)
+    assert engine.nodeCount > 100
+    search = ai.SlicedSearch(engine, game)
+    search.run(nodes=50)
+    assert engine.nodeCount <= 100
+    search.cancel()
+
+
+def test_findBestStepAsync():
+    games = [midgame(seed) for seed in range(3)]
+
+    async def searchAll():
+        return await asyncio.gather(*[ai.findBestStepAsync(ai.ReversiAI(5), game) for game in games])
+
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(searchAll())
+    finally:
+        loop.close()
+    assert results == [ai.ReversiAI(5).findBestStep(game) for game in games]
+
+
+def test_probcut():
+    # A calibration that trusts the shallow searches completely
+    cuts = {(4, stage, depth): [(depth - 2, 1.0, 0.0, 0.0)] for stage in range(ai.PROBCUT_STAGES) for depth in (3, 4)}
+    plain = ai.ReversiAI(7, probCut=ai.NO_PROBCUT)
+    selective = ai.ReversiAI(7, probCut=dict(ai.NO_PROBCUT, cuts=cuts, extraDepth=2))
+    assert selective.depth == plain.depth + 2
+    assert not ai.ReversiAI(5, probCut=dict(ai.NO_PROBCUT, cuts=cuts)).cuts  # Only for heuristicEval_4
+
+    game = midgame(1)
+    score, step = plain.heuristicSearch(game.copy(), game.current, 4, -ai.inf, ai.inf)
+    pscore, pstep = selective.heuristicSearch(game.copy(), game.current, 4, -ai.inf, ai.inf)
+    assert pstep in game.getAvailables()
+    assert selective.nodeCount < plain.nodeCount
+
+
+def test_staged_moves():
+    engine = ai.ReversiAI(5)
+    game = midgame(4, 30)
+    steps = game.getAvailables()
+    hashMove = steps[-1]
+    for moves in (list(engine.orderedMoves(game, game.current, hashMove)), list(engine.stagedMoves(game, hashMove))):
+        assert sorted(moves) == sorted(steps)
+        assert moves[0] == hashMove
+        corners = [step for step in moves[1:] if step in game.tables['CORNERS']]
+        assert moves[1:1 + len(corners)] == corners
+
+    # A cutoff on the hash move generates nothing else
+    moves = engine.orderedMoves(game, game.current, hashMove)
+    nodes = engine.nodeCount
+    assert next(moves) == hashMove
+    assert engine.nodeCount == nodes
+
+    # Iterative deepening finds the same move as a search of the last depth alone
+    assert engine.findBestStep(game, cancelled=lambda: False) == ai.ReversiAI(5).findBestStep(game)
@@ -0,0 +1,76 @@
+import random
+import threading
+import time
+
+import pytest
+
+import backend
+from reversi import Reversi
+
+
+def midgame():
+    game = Reversi()
+    rng = random.Random(2)
+    for _ in range(20):
+        game.put(rng.choice(game.getAvailables()))
+    return game
+
+
+@pytest.mark.parametrize("useProcess", [False, True])
+def test_local_backend(useProcess):
+    engine = backend.LocalBackend(useProcess)
+    try:
+        game = midgame()
+        assert engine.setLevel(2)
+        nodes = []
+        step = engine.findBestStep(game, progress=nodes.append)
+        assert step in game.getAvailables()
+        # A stopped search still answers, with the move of its deepest finished iteration
+        assert engine.findBestStep(midgame(), cancelled=lambda: True) in game.getAvailables()
+    finally:
+        engine.close()
+
+
+@pytest.mark.parametrize("useProcess", [False, True])
+def test_local_backend_level_during_search(useProcess):
+    engine = backend.LocalBackend(useProcess)
+    try:
+        engine.setLevel(8)
+        stop = threading.Event()
+        result = []
+        thread = threading.Thread(target=lambda: result.append(engine.findBestStep(midgame(), cancelled=stop.is_set)))
+        thread.start()
+        time.sleep(0.2)
+        start = time.monotonic()
+        assert engine.setLevel(2)  # Doesn't wait for the search
+        assert time.monotonic() - start < 0.1
+        stop.set()
+        thread.join()
+        assert result[0] in midgame().getAvailables()
+        assert engine.findBestStep(midgame()) in midgame().getAvailables()
+    finally:
+        engine.close()
+
+
+@pytest.mark.parametrize("useProcess", [False, True])
+def test_local_backend_analyze(useProcess):
+    engine = backend.LocalBackend(useProcess)
+    try:
+        game = midgame()
+        reports = []
+
+        def report(*analysis):
+            reports.append(analysis)
+            engine.setLevel(3)  # Doesn't wait for the analysis to end
+        engine.analyze(game, report, lambda: len(reports) >= 2)
+        assert [depth for depth, _, _ in reports[:2]] == [1, 2]
+        depth, scores, pv = reports[-1]
+        assert sorted(scores) == sorted(game.getAvailables())
+        assert pv[0] in scores
+    finally:
+        engine.close()
+
+
+def test_can_analyze():
+    assert backend.LocalBackend.canAnalyze and backend.AutoBackend.canAnalyze
+    assert not backend.RemoteBackend.canAnalyze
@@ -0,0 +1,99 @@
+import concurrent.futures
+import random
+import threading
+
+import pytest
+
+import ai
+from reversi import Reversi
+
+np = pytest.importorskip("numpy")
+import batch  # noqa: E402
+
+
+def randomPositions(seed, count, minMoves=5, maxMoves=58):
+    rng = random.Random(seed)
+    games = []
+    while len(games) < count:
+        game = Reversi()
+        for _ in range(rng.randrange(minMoves, maxMoves)):
+            if game.over:
+                break
+            game.put(rng.choice(game.getAvailables()))
+        games.append(game)
+    return games
+
+
+def test_evaluators_match():
+    games = randomPositions(1, 100)
+    # Won and lost positions for heuristicEval_4
+    wiped = Reversi()
+    wiped.board = [[ai.BLACK if (x, y) == (3, 3) else ai.EMPTY for y in range(8)] for x in range(8)]
+    full = Reversi()
+    full.board = [[ai.WHITE if x < 3 else ai.BLACK for y in range(8)] for x in range(8)]
+    games += [wiped, full]
+    boards = np.array([game.board for game in games], dtype=np.int8)
+    for evalLevel in range(5):
+        engine = ai.ReversiAI(0)
+        engine.heuristicScore = getattr(engine, "heuristicEval_" + str(evalLevel))
+        engine.evalLevel = evalLevel
+        scores = batch.VectorEvaluator(engine)(boards)
+        assert scores == [engine.heuristicScore(game, game.current) for game in games]
+
+
+def test_scheduler_finds_same_moves():
+    games = randomPositions(2, 6, 20, 40)
+    expected = [ai.ReversiAI(3).findBestStep(game) for game in games]
+    scheduler = batch.LeafScheduler(maxBatch=64, maxWait=0.001)
+    engines = [ai.ReversiAI(3) for _ in games]
+    futures = [scheduler.submit(engine, game) for engine, game in zip(engines, games)]
+    assert [future.result() for future in futures] == expected
+    assert scheduler.search(engines[0], games[0]) == expected[0]
+    scheduler.stop()
+    stats = scheduler.stats()
+    assert stats['searches'] == 7 and stats['batches'] > 0
+    assert stats['mean_batch'] > 1
+    assert not any(engine.batched for engine in engines)
+
+
+def test_scheduler_survives_evaluator_errors():
+    games = randomPositions(3, 3, 20, 40)
+    scheduler = batch.LeafScheduler(maxBatch=64, maxWait=0.001)
+    engines = [ai.ReversiAI(3) for _ in games]
+    evaluator = batch.VectorEvaluator(engines[0])
+    scheduler.evaluators[batch.VectorEvaluator.key(engines[0])] = evaluator
+    calls = []
+
+    def failing(boards):
+        calls.append(len(boards))
+        raise MemoryError("out of memory")
+    evaluate, evaluator.evaluate = evaluator.evaluate, failing
+    futures = [scheduler.submit(engine, game) for engine, game in zip(engines, games)]
+    for future in futures:
+        with pytest.raises(MemoryError):
+            future.result(5)
+    assert calls and not any(engine.batched for engine in engines)
+
+    # Later searches still run
+    evaluator.evaluate = evaluate
+    assert scheduler.search(engines[0], games[0], timeout=30) == ai.ReversiAI(3).findBestStep(games[0])
+    scheduler.stop()
+
+
+def test_scheduler_timeout():
+    game = randomPositions(4, 1, 20, 30)[0]
+    scheduler = batch.LeafScheduler(maxBatch=64, maxWait=0.001)
+    engine = ai.ReversiAI(3)
+    evaluator = batch.VectorEvaluator(engine)
+    scheduler.evaluators[batch.VectorEvaluator.key(engine)] = evaluator
+    release = threading.Event()
+
+    def stuck(boards):
+        release.wait(5)
+        return np.zeros(len(boards), dtype=np.int64)
+    evaluator.evaluate = stuck
+    with pytest.raises(concurrent.futures.TimeoutError):
+        scheduler.search(engine, game, timeout=0.1)
+    release.set()
+    scheduler.stop()
+    assert not engine.batched
@@ -0,0 +1,24 @@
+import cache
+from reversi import Reversi
+
+
+def test_cache_lru():
+    c = cache.ResultCache(2)
+    c.put("a", (1, 1))
+    c.put("b", (2, 2))
+    assert c.get("a") == (1, 1)
+    c.put("c", (3, 3))  # Evicts "b", the least recently used
+    assert c.get("b") is None
+    assert c.get("c") == (3, 3)
+    stats = c.stats()
+    assert stats['size'] == 2
+    assert stats['evictions'] == 1
+    assert (stats['hits'], stats['misses']) == (2, 1)
+
+
+def test_cache_key():
+    game = Reversi()
+    key = cache.makeKey(game.board, game.current, 3)
+    assert key == cache.makeKey([list(col) for col in game.board], game.current, 3)
+    assert key != cache.makeKey(game.board, game.current, 4)
+    hash(key)
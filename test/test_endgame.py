@@ -0,0 +1,57 @@
+import os
+import random
+
+import ai
+import endgame
+from reversi import Reversi, BS
+
+
+def endgamePosition(seed, empties):
+    rng = random.Random(seed)
+    while True:
+        game = Reversi()
+        while BS * BS - sum(game.chessCount[1:]) > empties and not game.over:
+            game.put(rng.choice(game.getAvailables()))
+        if not game.over:
+            return game
+
+
+def solve(game, store=None):
+    engine = ai.ReversiAI(8)
+    engine.endgame = store
+    score, step = engine.exactSearch(game.copy(), game.current, BS * BS - sum(game.chessCount[1:]), -ai.inf, ai.inf)
+    if store is not None:
+        store.flush()
+    return score, step, engine.nodeCount
+
+
+def test_store(tmp_path):
+    path = str(tmp_path / "endgame.bin")
+    for seed in range(5):
+        game = endgamePosition(seed, 9)
+        score, _, nodes = solve(game)
+        store = endgame.EndgameStore(path, minEmpties=4)
+        assert solve(game, store)[0] == score
+        store.close()
+
+        # Another process finds it in the file
+        store = endgame.EndgameStore(path, minEmpties=4)
+        again, step, cachedNodes = solve(game, store)
+        assert again == score
+        assert step in game.getAvailables()
+        assert cachedNodes == 1
+        store.close()
+
+
+def test_compact(tmp_path):
+    path = str(tmp_path / "endgame.bin")
+    store = endgame.EndgameStore(path, maxBytes=endgame.ENTRY.size * 40, minEmpties=3)
+    for seed in range(5):
+        solve(endgamePosition(seed, 8), store)
+    assert os.path.getsize(path) <= endgame.ENTRY.size * 40
+    # A torn write at the end is left out
+    with open(path, "ab") as f:
+        f.write(b"\0" * (endgame.ENTRY.size + 5))
+    reader = endgame.EndgameStore(path, minEmpties=3)
+    assert reader.stats()['entries'] == len(store.entries)
+    assert min(entry[0] for entry in reader.entries.values()) >= min(entry[0] for entry in store.entries.values())
@@ -0,0 +1,31 @@
+import metrics
+
+
+def test_histogram_render():
+    registry = metrics.Registry()
+    h = registry.histogram("latency", "Request latency", ("action",), buckets=(0.1, 1.0))
+    h.observe(0.05, "get_move")
+    h.observe(0.5, "get_move")
+    h.observe(5, "get_move")
+    text = registry.render()
+    assert '# TYPE latency histogram' in text
+    assert 'latency_bucket{action="get_move",le="0.1"} 1' in text
+    assert 'latency_bucket{action="get_move",le="1.0"} 2' in text
+    assert 'latency_bucket{action="get_move",le="+Inf"} 3' in text
+    assert 'latency_count{action="get_move"} 3' in text
+
+
+def test_counter_gauge_render():
+    registry = metrics.Registry()
+    c = registry.counter("errors_total", "Errors", ("exception",))
+    c.inc("KeyError")
+    c.inc("KeyError", amount=2)
+    g = registry.gauge("queue", "Queue depth")
+    g.inc()
+    g.inc()
+    g.dec()
+    registry.gauge("size", "Size", func=lambda: 42)
+    text = registry.render()
+    assert 'errors_total{exception="KeyError"} 3' in text
+    assert 'queue 1' in text
+    assert 'size 42' in text
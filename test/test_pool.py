@@ -0,0 +1,64 @@
+import random
+import threading
+import time
+
+from pool import EnginePool
+from reversi import Reversi
+
+
+def test_pool_levels():
+    pool = EnginePool(2)
+    a = pool.acquire(3)
+    b = pool.acquire(5)
+    assert (a.aiLevel, b.aiLevel) == (3, 5)
+    assert pool.acquire(3, timeout=0) is None  # Both slots taken
+    pool.release(b)
+    c = pool.acquire(5)
+    assert c is b  # Engines are reused
+    pool.release(a)
+    pool.release(c)
+
+
+def test_pool_shared_states():
+    pool = EnginePool(2)
+    a = pool.acquire(3)
+    b = pool.acquire(3)
+    assert a is not b
+    assert a.saveState is b.saveState
+    game = Reversi()
+    rng = random.Random(1)
+    for _ in range(16):
+        game.put(rng.choice(game.getAvailables()))  # Past the random opening mode
+    a.findBestStep(game)
+    assert len(b.saveState) > 0
+    pool.release(a)
+    # Another level doesn't flush level 3's table
+    d = pool.acquire(5)
+    d.findBestStep(game)
+    assert len(b.saveState) > 0
+    pool.release(b)
+    pool.release(d)
+
+
+def test_pool_waiting():
+    pool = EnginePool(1)
+    a = pool.acquire(0)
+    t = threading.Thread(target=lambda: pool.release(pool.acquire(0)))
+    t.start()
+    deadline = time.monotonic() + 5
+    while pool.waiting == 0 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert pool.stats()['waiting'] == 1
+    pool.release(a)
+    t.join()
+    assert pool.waiting == 0
+
+
+def test_pool_discard():
+    pool = EnginePool(1)
+    a = pool.acquire(3)
+    pool.discard(a)
+    b = pool.acquire(3, timeout=0)
+    assert b is not None and b is not a
+    assert pool.stats()['busy'] == 1
+    pool.release(b)
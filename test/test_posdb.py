@@ -0,0 +1,42 @@
+import os
+import random
+import tempfile
+
+from reversi import Reversi
+import posdb
+import record
+
+
+def test_canonical():
+    game = record.GameRecord("f5").replay()
+    # The 4 first moves are the same position turned around
+    for first in ("f5", "e6", "d3", "c4"):
+        other = record.GameRecord(first).replay()
+        assert posdb.canonical(other.board)[:2] == posdb.canonical(game.board)[:2]
+    assert posdb.canonical(record.GameRecord("f5d6").replay().board)[:2] != posdb.canonical(game.board)[:2]
+
+
+def test_build_and_grow():
+    rng = random.Random(1)
+    records = [record.GameRecord.fromGame(record.playGame(rng=rng)) for _ in range(20)]
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "positions.db")
+        with posdb.PositionDB(path, writable=True, capacity=64) as db:
+            for rec in records[:10]:
+                db.addGame(rec)
+        # Append to the existing file, it grows as it fills
+        with posdb.PositionDB(path, writable=True) as db:
+            for rec in records[10:]:
+                db.addGame(rec)
+            assert db.capacity > 64
+
+        with posdb.PositionDB(path) as db:
+            assert db.games == 20
+            start = Reversi()
+            assert sum(db.lookup(start)) == 20
+            moves = db.nextMoves(start)
+            assert sum(sum(counts) for counts in moves.values()) == 20
+            # Every game reached its own second position
+            for rec in records:
+                game = record.GameRecord(rec.transcript[:4]).replay()
+                assert sum(db.lookup(game)) >= 1
@@ -0,0 +1,60 @@
+import io
+import random
+
+import ai
+import profiling
+import record
+from reversi import Reversi
+
+
+def test_off_by_default():
+    assert not profiling.enabled()
+    assert not hasattr(Reversi.put, "__wrapped__")
+
+
+def test_profileCall():
+    original = Reversi.__dict__["getAvailables"]
+    game = record.GameRecord(profiling.MIDGAME).replay()
+    # The engine is created while profiling is on, so the evaluator it picks is instrumented too
+    step = profiling.profileCall(lambda: ai.ReversiAI(3).findBestStep(game), detail=True)
+    assert step in game.getAvailables()
+    assert Reversi.__dict__["getAvailables"] is original  # Put back
+
+    rows = {name: (calls, total, own) for name, calls, total, own in profiling.summary()}
+    assert rows["findBestStep"][0] == 1
+    assert rows["getAvailables"][0] > 0 and rows["canPut"][0] >= 64 * rows["getAvailables"][0]
+    assert rows["heuristicSearchSteps"][1] <= rows["findBestStep"][1]
+    assert rows["heuristicEval_{}".format(ai.AICONFIG[3][2])][0] > 0
+    assert all(own <= total + 1e-6 for calls, total, own in rows.values())
+
+    out = io.StringIO()
+    profiling.writeCollapsed(out)
+    lines = out.getvalue().splitlines()
+    assert lines
+    for line in lines:
+        stack, micros = line.rsplit(" ", 1)
+        assert stack.startswith("findBestStep") and int(micros) > 0
+    assert any(line.startswith("findBestStep;search;searchSteps;heuristicSearchSteps;") for line in lines)
+
+
+def test_move_generators():
+    game = record.GameRecord(profiling.MIDGAME).replay()
+    endgame = game.copy()
+    rng = random.Random(1)
+    while sum(row.count(ai.EMPTY) for row in endgame.board) > ai.AICONFIG[3][1] and not endgame.over:
+        endgame.put(rng.choice(endgame.getAvailables()))
+
+    def run():
+        engine = ai.ReversiAI(3)
+        return engine.findBestStep(game), engine.findBestStep(endgame)
+    steps = run()
+    assert profiling.profileCall(run) == steps  # Instrumented generators still give the same moves
+
+    rows = {name: (calls, total, own) for name, calls, total, own in profiling.summary()}
+    for name in ("key", "iterMoves", "orderedMoves", "stagedMoves"):
+        assert rows[name][0] > 0
+    # Timed only while they make moves, not while the moves are searched
+    assert rows["orderedMoves"][1] < rows["heuristicSearchSteps"][1]
+    out = io.StringIO()
+    profiling.writeCollapsed(out)
+    assert not any(";orderedMoves;heuristicSearchSteps" in line for line in out.getvalue().splitlines())
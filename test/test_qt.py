@@ -0,0 +1,72 @@
+import os
+import time
+
+import pytest
+
+from reversi import Reversi
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+QtWidgets = pytest.importorskip("PyQt5.QtWidgets")
+import qt  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+def waitFor(app, condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        app.processEvents()
+        time.sleep(0.01)
+    return condition()
+
+
+def test_analysis_throttled_update_arrives(app):
+    class Engine:
+        def analyze(self, game, report, cancelled=None, maxDepth=None):
+            report(1, {}, [])
+            report(2, {}, [])  # Too soon, held back
+            while not cancelled():
+                time.sleep(0.01)
+
+    depths = []
+    worker = qt.AnalysisWorker(Engine(), Reversi())
+    worker.analysis.connect(lambda worker, depth, scores, pv: depths.append(depth))
+    worker.start()
+    try:
+        # Arrives once the interval is up, though the analysis reports nothing more
+        assert waitFor(app, lambda: len(depths) == 2)
+        assert depths == [1, 2]
+    finally:
+        worker.requestInterruption()
+        worker.wait()
+
+
+def test_ai_worker_failed(app):
+    class Engine:
+        def findBestStep(self, game, cancelled=None, progress=None):
+            raise ConnectionError("server unreachable")
+
+    failures = []
+    worker = qt.AIWorker(Engine(), Reversi())
+    worker.failed.connect(lambda worker, message: failures.append(message))
+    worker.start()
+    assert waitFor(app, lambda: failures)
+    worker.wait()
+    assert "server unreachable" in failures[0]
+
+
+def test_analysis_worker_failed(app):
+    class Engine:
+        def analyze(self, game, report, cancelled=None, maxDepth=None):
+            raise MemoryError("out of memory")
+
+    failures = []
+    worker = qt.AnalysisWorker(Engine(), Reversi())
+    worker.failed.connect(lambda worker, message: failures.append(message))
+    worker.start()
+    assert waitFor(app, lambda: failures)
+    worker.wait()
+    assert "out of memory" in failures[0]
@@ -0,0 +1,49 @@
+import io
+import random
+
+import pytest
+
+import record
+from record import GameRecord, RecordError
+
+
+def test_square_names():
+    assert record.squareName((0, 0)) == "a8"
+    assert record.parseSquare("h1") == (7, 7)
+    for x in range(8):
+        for y in range(8):
+            assert record.parseSquare(record.squareName((x, y))) == (x, y)
+
+
+def test_standard_opening():
+    # The four standard first moves for black
+    game = GameRecord("").replay()
+    assert sorted(record.squareName(s) for s in game.getAvailables()) == ["c4", "d3", "e6", "f5"]
+    game = GameRecord("f5d6c3d3c4f4f6f3e6e7").replay()
+    assert len(game.history) == 10
+
+
+def test_record_roundtrip():
+    game = record.playGame(rng=random.Random(1))
+    rec = GameRecord.fromGame(game, black="a", white="b")
+    assert 'result' in rec.meta
+    line = rec.format()
+    assert GameRecord.parse(line) == rec
+    assert rec.replay().board == game.board
+
+
+def test_read_write_records():
+    records = [GameRecord.fromGame(record.playGame(rng=random.Random(i))) for i in range(5)]
+    f = io.StringIO()
+    assert record.RecordWriter(f).writeAll(records) == 5
+    lines = ["# comment", ""] + f.getvalue().splitlines()
+    assert list(record.readRecords(lines, validate=True)) == records
+
+
+@pytest.mark.parametrize("line", ["f5f5", "f5z9", "f5\tnometa"])
+def test_bad_records(line):
+    with pytest.raises(RecordError):
+        list(record.readRecords([line], validate=True))
+    errors = []
+    assert list(record.readRecords([line, "f5"], True, lambda n, e: errors.append(n))) == [GameRecord("f5")]
+    assert errors == [1]
@@ -26,19 +26,6 @@ def test_reversi_toggle():
     assert game.current == reversi.WHITE
 
 
-@pytest.mark.parametrize("x, y, dx, dy, player, expected", [
-    (2, 4, 1, 0, reversi.BLACK, True),
-    (2, 4, 1, 0, reversi.WHITE, False),
-    (3, 2, 0, 1, reversi.BLACK, False),
-    (3, 2, 0, 1, reversi.WHITE, True),
-    (2, 4, 1, 0, None, True),
-])
-def test_reversi_check(x, y, dx, dy, player, expected):
-    game = Reversi()
-    game.reset()
-    assert game.check(x, y, dx, dy, player) == expected
-
-
 @pytest.mark.parametrize("x, y, player, expected", [
     (2, 4, reversi.BLACK, True),
     (2, 4, reversi.WHITE, False),
@@ -166,8 +153,74 @@ def test_reversi_hash():
         s.add(game)
 
 
+def test_reversi_key():
+    # Boards read as base-3 numbers HASH_KEY apart have the same hash, but not the same key
+    a, b = Reversi(), Reversi()
+    value = reversi.HASH_KEY
+    for i in reversed(range(64)):
+        value, digit = divmod(value, 3)
+        a.board[i // 8][i % 8] = 0
+        b.board[i // 8][i % 8] = digit
+    assert a.__hash__() == b.__hash__()
+    assert a.key() != b.key()
+
+
 def test_reversi_repr():
     game = Reversi()
     game.reset()
     assert str(game)
     assert repr(game)
+
+
+@pytest.mark.parametrize("size", [4, 6, 10])
+def test_board_sizes(size):
+    game = Reversi(size)
+    assert len(game.board) == size and game.chessCount == [size * size - 4, 2, 2]
+    assert len(game.getAvailables()) == 4
+    while not game.over:
+        assert game.put(game.getAvailables()[0])
+    assert sum(game.chessCount) == size * size
+    with pytest.raises(ValueError):
+        Reversi(size + 1)
+
+
+@pytest.mark.parametrize("size", [4, 8])
+def test_reversi_mobility(size):
+    import random
+    rng = random.Random(size)
+    game = Reversi(size)
+    assert game.mobility() == (4, 10, 2, 4, 10, 2)
+    neighbours = game.tables['NEIGHBOURS']
+
+    def nextTo(x, y, chess):
+        return any(game.board[tx][ty] == chess for tx, ty in neighbours[x][y])
+
+    while not game.over:
+        game.put(rng.choice(game.getAvailables()))
+        expected = []
+        for player in (reversi.BLACK, reversi.WHITE):
+            other = reversi.BLACK + reversi.WHITE - player
+            expected += [len(game.getAvailables(player)),
+                         sum(game.at(x, y) == reversi.EMPTY and nextTo(x, y, other) for x, y in game.squares),
+                         sum(game.at(x, y) == player and nextTo(x, y, reversi.EMPTY) for x, y in game.squares)]
+        assert game.mobility() == tuple(expected)
+
+
+def test_reversi_iterMoves():
+    import random
+    rng = random.Random(2)
+    game = Reversi()
+    for _ in range(20):
+        game.put(rng.choice(game.getAvailables()))
+    assert list(game.iterMoves()) == game.getAvailables()
+    assert list(game.iterMoves(reversi.WHITE)) == game.getAvailables(reversi.WHITE)
+    order = game.tables['CORNERS'] + game.tables['MOVE_ORDER']
+    assert sorted(order) == sorted(game.squares)
+    assert sorted(game.iterMoves(squares=order)) == sorted(game.getAvailables())
+
+    # Nothing is checked until a move is asked for
+    moves = game.iterMoves()
+    first = next(moves)
+    game.put(first)
+    game.undo()
+    assert [first] + list(moves) == game.getAvailables()
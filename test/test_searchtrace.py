@@ -0,0 +1,40 @@
+import ai
+import profiling
+import record
+import searchtrace
+
+
+def test_record_and_read(tmp_path):
+    path = str(tmp_path / "search.trace")
+    game = record.GameRecord(profiling.MIDGAME).replay()
+    expected = ai.ReversiAI(5).findBestStep(game)
+
+    engine = ai.ReversiAI(5)
+    with searchtrace.TraceRecorder(path, bufferBytes=searchtrace.RECORD.size * 10) as recorder:
+        recorder.attach(engine)
+        assert engine.findBestStep(game) == expected
+    assert "heuristicSearchSteps" not in engine.__dict__  # Detached
+
+    with open(path, "rb") as f:
+        nodes = list(searchtrace.readTrace(f))
+    assert len(nodes) == recorder.records > 0
+    roots = [node for node in nodes if node.ply == 0]
+    assert nodes[-1] in roots
+    assert searchtrace.decodeMove(nodes[-1].best, 8) == expected
+    assert all(node.reason != searchtrace.FAIL_HIGH or node.score >= node.beta for node in nodes)
+
+    s = searchtrace.summarise(iter(nodes))
+    assert s['nodes'] == len(nodes) and s['roots'] == len(roots)
+    assert s['byReason']['leaf'] > 0 and s['fanout'][0] > 1
+
+
+def test_bounded(tmp_path):
+    path = str(tmp_path / "search.trace")
+    game = record.GameRecord(profiling.MIDGAME).replay()
+    engine = ai.ReversiAI(3)
+    with searchtrace.TraceRecorder(path, maxRecords=20) as recorder:
+        recorder.attach(engine)
+        engine.findBestStep(game)
+    assert recorder.records == 20 and recorder.dropped > 0
+    with open(path, "rb") as f:
+        assert len(list(searchtrace.readTrace(f))) == 20
@@ -0,0 +1,46 @@
+import random
+import time
+
+import pytest
+
+from reversi import Reversi
+
+pytest.importorskip("flask")
+import server  # noqa: E402
+
+
+def midgame():
+    game = Reversi()
+    rng = random.Random(2)
+    for _ in range(20):
+        game.put(rng.choice(game.getAvailables()))
+    return game
+
+
+def test_get_move_client_gone(monkeypatch):
+    # A search without a budget still stops when the client hangs up
+    monkeypatch.setattr(server, "clientGone", lambda environ: True)
+    game = midgame()
+    client = server.app.test_client()
+    start = time.monotonic()
+    response = client.post("/", json={'action': "get_move", 'data': {
+        'board': game.board, 'current': game.current, 'level': len(server.AICONFIG) - 1}})
+    assert time.monotonic() - start < server.MAX_BUDGET
+    assert response.status_code == 200
+    data = response.get_json()
+    assert not data['complete']
+    assert (data['move']['x'], data['move']['y']) in game.getAvailables()
+
+
+def test_metrics_level_labels():
+    client = server.app.test_client()
+    for level in ["x" * 100, -1, 99, 2.5, True]:
+        client.post("/", json={'action': "get_stats", 'data': {'level': level}})
+    client.post("/", json={'action': "get_stats", 'data': {'level': 1}})
+    text = client.get("/metrics").get_data(as_text=True)
+    labels = set()
+    for line in text.splitlines():
+        if line.startswith("reversi_request_seconds_count{"):
+            labels.add(line.split('level="')[1].split('"')[0])
+    assert labels <= {str(level) for level in range(len(server.AICONFIG))} | {"invalid"}
+    assert {"1", "invalid"} <= labels
@@ -0,0 +1,44 @@
+import random
+
+import ai
+import solver
+from reversi import Reversi
+
+
+def test_4x4():
+    score, step = solver.Solver(4).solveGame(Reversi(4))
+    assert score == -8  # White wins 11-3
+    assert step in Reversi(4).getAvailables()
+
+
+def test_moves():
+    rng = random.Random(1)
+    for size in (4, 6, 8):
+        s = solver.Solver(size)
+        for _ in range(20):
+            game = Reversi(size)
+            while not game.over:
+                player, opponent = s.bitboards(game)
+                moves = s.moves(player, opponent)
+                steps = game.getAvailables()
+                assert sorted(s.square(1 << i) for i in range(size * size) if moves >> i & 1) == steps
+                step = rng.choice(steps)
+                flipped = s.flips(player, opponent, 1 << step[0] * size + step[1])
+                game.put(step)
+                changes = game.history[-1] or game.history[-2]
+                assert sorted(s.square(1 << i) for i in range(size * size) if flipped >> i & 1) == sorted(changes[:-1])
+
+
+def test_exactSearch_agrees():
+    rng = random.Random(2)
+    engine = ai.ReversiAI(8)
+    for _ in range(10):
+        game = Reversi()
+        while sum(game.chessCount[1:]) < 56 and not game.over:
+            game.put(rng.choice(game.getAvailables()))
+        if game.over:
+            continue
+        score, _ = solver.Solver(8).solveGame(game)
+        wld, _ = solver.Solver(8).solveGame(game, wld=True)
+        exact, _ = engine.exactSearch(game.copy(), game.current, 8, -ai.inf, ai.inf)
+        assert (score > 0) - (score < 0) == (wld > 0) - (wld < 0) == (exact > 0) - (exact < 0)
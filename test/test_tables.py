@@ -0,0 +1,52 @@
+import os
+
+import tables
+from reversi import Reversi, BS, HASH_KEY
+
+
+def test_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(tables, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(tables.sys, "dont_write_bytecode", False)
+    built = tables.load(BS, HASH_KEY)
+    path = tables.cachePath(BS)
+    assert os.path.exists(path)
+    assert tables.readCache(path, BS, HASH_KEY) == built
+    # A cache of another hash key is stale
+    assert tables.readCache(path, BS, HASH_KEY - 2) is None
+    with open(path, "wb") as f:
+        f.write(b"garbage")
+    assert tables.load(BS, HASH_KEY) == built
+
+
+def test_cache_not_written(tmp_path, monkeypatch):
+    built = tables.build(BS, HASH_KEY)
+    monkeypatch.setattr(tables.sys, "dont_write_bytecode", False)
+    # A read-only install: the directory can't be created
+    blocker = tmp_path / "file"
+    blocker.write_bytes(b"")
+    monkeypatch.setattr(tables, "CACHE_DIR", str(blocker / "cache"))
+    assert tables.load(BS, HASH_KEY) == built
+    # Nor is it written with PYTHONDONTWRITEBYTECODE
+    monkeypatch.setattr(tables, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(tables.sys, "dont_write_bytecode", True)
+    assert tables.load(BS, HASH_KEY) == built
+    assert not os.path.exists(tables.cachePath(BS))
+
+
+def test_tables():
+    t = tables.build(BS, HASH_KEY)
+    assert len(t['SQUARES']) == BS * BS
+    assert t['RAYS'][0][0][1] == tuple((i, i) for i in range(1, BS))
+    assert len(t['NEIGHBOURS'][0][0]) == 3 and len(t['NEIGHBOURS'][3][3]) == 8
+    assert t['SQUARE_CLASS'][0][0] == tables.CLASS_CORNER
+    assert t['SQUARE_CLASS'][0][3] == tables.CLASS_EDGE
+
+
+def test_hash():
+    game = Reversi()
+    game.put(2, 3)
+    res = 0
+    for x in range(BS):
+        for y in range(BS):
+            res = (3 * res + game.board[x][y]) % HASH_KEY
+    assert game.__hash__() == res ^ (1 + game.current)
@@ -0,0 +1,94 @@
+import json
+import os
+import random
+import tempfile
+
+import pytest
+
+import ai
+import record
+from reversi import Reversi
+
+np = pytest.importorskip("numpy")
+import tune  # noqa: E402
+
+
+def randomPositions(seed, count):
+    rng = random.Random(seed)
+    games = []
+    while len(games) < count:
+        game = Reversi()
+        for _ in range(rng.randrange(5, 58)):
+            if game.over:
+                break
+            game.put(rng.choice(game.getAvailables()))
+        if not game.over:
+            games.append(game)
+    return games
+
+
+def test_features_match_evaluators():
+    rng = random.Random(1)
+    w4 = np.array([rng.randrange(-300, 300) for _ in tune.CLASSES] + [7, 25])
+    w3 = np.array([rng.randrange(-20, 20) for _ in ai.STABILITY] + [3, 2, 5])
+    score = [[int(w4[np.argmax(tune.CLASS_MASKS[:, x, y])]) for y in range(8)] for x in range(8)]
+    weights = {'SCORE': score, 'LIBERTY': 7, 'BONUS': 25, 'STABILITY': w3[:-3].tolist(), 'MOBILITY': 3,
+               'POTENTIAL': 2, 'FRONTIER': 5}
+    engine = ai.ReversiAI(0, weights=weights)
+
+    games = randomPositions(2, 100)
+    boards = np.array([game.board for game in games], dtype=np.int8)
+    eval4 = tune.eval4Features(boards) @ w4
+    eval3 = tune.eval3Features(boards) @ w3
+    for i, game in enumerate(games):
+        score = engine.heuristicEval_4(game, game.current)
+        if abs(score) < ai.inf:
+            assert score == eval4[i]
+        assert engine.heuristicEval_3(game, game.current) == eval3[i]
+
+
+def test_fit_and_load():
+    rng = random.Random(3)
+    records = [record.GameRecord.fromGame(record.playGame(rng=rng)) for _ in range(50)]
+    weights = tune.fitWeights(records, 14, 44)
+    assert weights['positions'] > 0
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "weights.json")
+        with open(path, "w") as f:
+            json.dump(weights, f)
+        loaded = ai.loadWeights(path)
+    assert loaded['SCORE'] == weights['SCORE']
+    assert loaded['MOBILITY'] == weights['MOBILITY']
+    assert ai.loadWeights(path + ".missing") == ai.DEFAULT_WEIGHTS
+
+
+def test_probcut():
+    rng = random.Random(4)
+    samples = []
+    for _ in range(50):
+        x = rng.uniform(-100, 100)
+        samples.append((2, [x * depth + 5 for depth in range(1, 7)]))
+    cuts = tune.fitProbCut(samples, 4, 6)
+    assert {(c['depth'], c['shallow']) for c in cuts} == {(3, 1), (4, 2), (5, 1), (5, 3), (6, 2), (6, 4)}
+    for c in cuts:
+        assert c['stage'] == 2 and c['samples'] == 50
+        assert abs(c['a'] - c['depth'] / c['shallow']) < 1e-3 and c['sigma'] < 1e-3
+
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "probcut.json")
+        with open(path, "w") as f:
+            json.dump({'cuts': cuts, 'threshold': 2.0, 'extraDepth': 1}, f)
+        loaded = ai.loadProbCut(path)
+        assert ai.loadProbCut(path + ".missing") == ai.NO_PROBCUT
+    assert loaded['threshold'] == 2.0 and loaded['extraDepth'] == 1
+    assert [shallow for shallow, *_ in loaded['cuts'][4, 2, 6]] == [2, 4]
+
+    records = [record.GameRecord.fromGame(record.playGame(rng=rng)) for _ in range(5)]
+    found = list(tune.probCutSamples(records, 7, 3, 20, 50, 3))
+    assert 0 < len(found) <= 3
+    assert all(len(scores) == 3 for stage, scores in found)
+
+
+def test_playMatch_pairs():
+    # Each opening is played with both colours, so equal weights score exactly even
+    assert tune.playMatch(ai.DEFAULT_WEIGHTS, 2, 200, 3) == 0.5
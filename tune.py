@@ -0,0 +1,450 @@
+"""
+Evaluation weight tuning
+
+Fits the weights of heuristicEval_3 and heuristicEval_4 (SCORE, BONUS, LIBERTY, STABILITY,
+MOBILITY, POTENTIAL and FRONTIER in ai.py) to the outcomes of self-play games, and writes
+them to the file ReversiAI loads at startup (ai.WEIGHTS_FILE).
+
+Both evaluators are linear in their weights, so the features are the sums they
+multiply the weights by. They are extracted from batches of positions with NumPy,
+and the weights are fitted by least squares to the final disc difference.
+
+It also calibrates ProbCut (see ReversiAI.probCutSteps), fitting how well shallow
+searches predict deeper ones, and writes that to ai.PROBCUT_FILE.
+
+Usage:
+    python3 record.py generate --count 20000 --level 2 games.txt.gz
+    python3 tune.py fit games.txt.gz
+    python3 tune.py compare --level 7 --nodes 2000 10000 50000 weights.json
+    python3 tune.py probcut --level 7 --max-depth 6 games.txt.gz
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+
+import numpy as np
+
+import ai
+import record
+from reversi import Reversi, BS, EMPTY, BLACK, WHITE
+
+
+BATCH = 1 << 14  # Positions per feature extraction batch
+SCALE = 100  # Weights are written as integers, in hundredths of a disc
+OFF = 3  # Board value of the squares past the edge
+MIN_SAMPLES = 20  # Positions a ProbCut regression needs
+# (deep, shallow) depth pairs ProbCut is calibrated for, cheapest shallow search first
+PROBCUT_PAIRS = [(depth, shallow) for depth in range(3, 13) for shallow in (depth - 4, depth - 2) if shallow >= 1]
+
+# Squares grouped by symmetry, each class gets one weight of the SCORE table
+CLASSES = sorted({tuple(sorted((min(x, BS - 1 - x), min(y, BS - 1 - y)))) for x in range(BS) for y in range(BS)})
+CLASS_MASKS = np.zeros((len(CLASSES), BS, BS))
+for _x in range(BS):
+    for _y in range(BS):
+        _key = tuple(sorted((min(_x, BS - 1 - _x), min(_y, BS - 1 - _y))))
+        CLASS_MASKS[CLASSES.index(_key), _x, _y] = 1
+
+# Corners, the squares next to them and the directions of their edges, as in heuristicEval_4
+CORNERS = [
+    ((0, 0), [(0, 1), (1, 0), (1, 1)], (1, 1)),
+    ((BS - 1, 0), [(BS - 2, 0), (BS - 2, 1), (BS - 1, 1)], (-1, 1)),
+    ((0, BS - 1), [(0, BS - 2), (1, BS - 2), (1, BS - 1)], (1, -1)),
+    ((BS - 1, BS - 1), [(BS - 2, BS - 2), (BS - 2, BS - 1), (BS - 1, BS - 2)], (-1, -1)),
+]
+# The 4 lines through a square, as pairs of opposite directions, as in ReversiAI.stability
+AXES = [((0, -1), (0, 1)), ((-1, 0), (1, 0)), ((-1, -1), (1, 1)), ((1, -1), (-1, 1))]
+
+EVAL4_FEATURES = ["SCORE{}{}".format(*c) for c in CLASSES] + ["LIBERTY", "BONUS"]
+EVAL3_FEATURES = ["STABILITY{}".format(i) for i in range(len(ai.STABILITY))] + ["MOBILITY", "POTENTIAL", "FRONTIER"]
+
+
+def neighbour(a, dx, dy, fill):
+    """
+    out[:, x, y] = a[:, x + dx, y + dy], or fill where that's off the board
+    """
+    out = np.full_like(a, fill)
+    out[:, max(-dx, 0):BS - max(dx, 0), max(-dy, 0):BS - max(dy, 0)] = \
+        a[:, max(dx, 0):BS - max(-dx, 0), max(dy, 0):BS - max(-dy, 0)]
+    return out
+
+
+def runEnds(boards, dx, dy):
+    """
+    For every square, the first square in direction (dx, dy) of another value than it
+    (EMPTY, BLACK, WHITE or OFF), and the value of its neighbour that way
+    """
+    nb = neighbour(boards, dx, dy, OFF)
+    same = nb == boards
+    end = nb
+    for _ in range(BS - 2):
+        end = np.where(same, neighbour(end, dx, dy, OFF), nb)
+    return end, nb
+
+
+def eval4Terms(boards):
+    """
+    The terms of heuristicEval_4 per board: disc difference per square (0 for the squares
+    next to taken corners), minus the liberties of the discs and the edge runs from corners
+    """
+    disc = (boards == BLACK).astype(np.int64) - (boards == WHITE)
+    empty = (boards == EMPTY).astype(np.int64)
+    liberties = sum(neighbour(empty, dx, dy, 0) for dx, dy in ai.DIRECTIONS if dx or dy)
+
+    counted = disc.copy()
+    runs = np.zeros(len(boards), dtype=np.int64)
+    for (x, y), adjacents, (dx, dy) in CORNERS:
+        corner = disc[:, x, y]
+        taken = corner != 0
+        for cx, cy in adjacents:
+            counted[taken, cx, cy] = 0
+        for line in (disc[:, x + dx:x + dx * (BS - 1):dx, y], disc[:, x, y + dy:y + dy * (BS - 1):dy]):
+            runs += corner * np.cumprod(line == corner[:, None], axis=1).sum(axis=1)
+    return counted, -(disc * liberties).sum(axis=(1, 2)), runs
+
+
+def eval4Features(boards):
+    """
+    Features of heuristicEval_4: disc difference per square class (not counting
+    the squares next to taken corners), liberties and edge runs from corners
+    """
+    counted, liberties, runs = eval4Terms(boards)
+    return np.column_stack([np.einsum("nxy,kxy->nk", counted, CLASS_MASKS), liberties, runs])
+
+
+def allRunEnds(boards):
+    """
+    runEnds in all 8 directions, as {(dx, dy): (end, neighbour)}
+    """
+    ends = {}
+    for axis in AXES:
+        for dx, dy in axis:
+            ends[dx, dy] = runEnds(boards, dx, dy)
+    return ends
+
+
+def legalMoves(boards, ends=None):
+    """
+    Where BLACK and WHITE can move, as {player: boolean array}. ends are allRunEnds(boards),
+    if they're already worked out.
+    """
+    if ends is None:
+        ends = allRunEnds(boards)
+    # A move is legal where a neighbour is the opponent's and its run ends in one of ours
+    empty = boards == EMPTY
+    legal = {BLACK: np.zeros(boards.shape, dtype=bool), WHITE: np.zeros(boards.shape, dtype=bool)}
+    for (dx, dy), (end, nb) in ends.items():
+        endNext = neighbour(end, dx, dy, OFF)
+        legal[BLACK] |= empty & (nb == WHITE) & (endNext == BLACK)
+        legal[WHITE] |= empty & (nb == BLACK) & (endNext == WHITE)
+    return legal
+
+
+def eval3Features(boards):
+    """
+    Features of heuristicEval_3: disc difference per stability degree, and the differences
+    in mobility, potential mobility and frontier discs (as Reversi.mobility counts them)
+    """
+    ends = allRunEnds(boards)
+
+    opponent = np.where(boards == BLACK, WHITE, BLACK)
+    degree = np.zeros(boards.shape, dtype=np.int64)
+    for d1, d2 in AXES:
+        e1, e2 = ends[d1][0], ends[d2][0]
+        degree += ((e1 == OFF) | (e2 == OFF) | ((e1 == opponent) & (e2 == opponent)))
+
+    legal = legalMoves(boards, ends)
+    empty = boards == EMPTY
+    black, white = boards == BLACK, boards == WHITE
+    # Potential mobility: empty squares next to the opponent, frontier: discs next to an empty square
+    nextTo = {c: np.zeros(boards.shape, dtype=bool) for c in (EMPTY, BLACK, WHITE)}
+    for dx, dy in ai.DIRECTIONS:
+        nb = neighbour(boards, dx, dy, OFF)
+        for c in nextTo:
+            nextTo[c] |= nb == c
+    return np.column_stack(
+        [(black & (degree == k)).sum(axis=(1, 2)) - (white & (degree == k)).sum(axis=(1, 2))
+         for k in range(len(ai.STABILITY))] +
+        [legal[BLACK].sum(axis=(1, 2)) - legal[WHITE].sum(axis=(1, 2)),
+         (empty & nextTo[WHITE]).sum(axis=(1, 2)) - (empty & nextTo[BLACK]).sum(axis=(1, 2)),
+         (white & nextTo[EMPTY]).sum(axis=(1, 2)) - (black & nextTo[EMPTY]).sum(axis=(1, 2))]
+    )
+
+
+def positions(records, minEmpties, maxEmpties):
+    """
+    Replay records, yields batches of (boards, final disc difference) for the positions
+    with minEmpties to maxEmpties empty squares
+    """
+    boards, outcomes = [], []
+    for rec in records:
+        game = Reversi()
+        taken = []
+        for step in rec.moves():
+            if minEmpties <= BS * BS - sum(game.chessCount[1:]) <= maxEmpties:
+                taken.append([col[:] for col in game.board])
+            if not game.put(step):
+                raise record.RecordError("Illegal move in {}".format(rec.transcript))
+        _, ccBlack, ccWhite = game.chessCount
+        boards.extend(taken)
+        outcomes.extend([ccBlack - ccWhite] * len(taken))
+        if len(boards) >= BATCH:
+            yield np.array(boards, dtype=np.int8), np.array(outcomes)
+            boards, outcomes = [], []
+    if boards:
+        yield np.array(boards, dtype=np.int8), np.array(outcomes)
+
+
+class Fit:
+    """
+    Least squares fit over batches, keeping only the normal equations in memory
+    """
+
+    def __init__(self, names):
+        self.names = names
+        k = len(names)
+        self.xtx = np.zeros((k, k))
+        self.xty = np.zeros(k)
+        self.yy = self.ysum = 0.0
+        self.n = 0
+
+    def add(self, features, outcomes):
+        features = features.astype(np.float64)
+        outcomes = outcomes.astype(np.float64)
+        self.xtx += features.T @ features
+        self.xty += features.T @ outcomes
+        self.yy += outcomes @ outcomes
+        self.ysum += outcomes.sum()
+        self.n += len(outcomes)
+
+    def solve(self):
+        """
+        Returns the weights and the R^2 of the fit
+        """
+        w = np.linalg.lstsq(self.xtx, self.xty, rcond=None)[0]
+        sse = self.yy - 2 * w @ self.xty + w @ self.xtx @ w
+        sst = self.yy - self.ysum ** 2 / self.n
+        return w, 1 - sse / sst if sst > 0 else 0.0
+
+
+def fitWeights(records, minEmpties, maxEmpties):
+    """
+    Fit the weights to records, returns them in the format of ai.loadWeights, with some statistics
+    """
+    fit4, fit3 = Fit(EVAL4_FEATURES), Fit(EVAL3_FEATURES)
+    for boards, outcomes in positions(records, minEmpties, maxEmpties):
+        fit4.add(eval4Features(boards), outcomes)
+        fit3.add(eval3Features(boards), outcomes)
+    if fit4.n == 0:
+        raise ValueError("No positions to fit")
+
+    w4, r4 = fit4.solve()
+    w3, r3 = fit3.solve()
+    w4 = np.rint(w4 * SCALE).astype(int).tolist()
+    w3 = np.rint(w3 * SCALE).astype(int).tolist()
+    score = [[0] * BS for _ in range(BS)]
+    for x in range(BS):
+        for y in range(BS):
+            score[x][y] = int(w4[int(np.argmax(CLASS_MASKS[:, x, y]))])
+    return {
+        'SCORE': score,
+        'LIBERTY': w4[-2],
+        'BONUS': w4[-1],
+        'STABILITY': w3[:-3],
+        'MOBILITY': w3[-3],
+        'POTENTIAL': w3[-2],
+        'FRONTIER': w3[-1],
+        'positions': fit4.n,
+        'r2': {'heuristicEval_4': round(float(r4), 4), 'heuristicEval_3': round(float(r3), 4)},
+    }
+
+
+def playMatch(weights, level, nodes, games, seed=0):
+    """
+    Play engines with the given weights against ones with the built-in weights,
+    searching at most about `nodes` nodes per move. Returns the score of the first,
+    from 0 to 1. Each opening is played twice, with the colours swapped, so games
+    is rounded up to an even number.
+    """
+    total = 0.0
+    pairs = (games + 1) // 2
+    for pair in range(pairs):
+        for tuned in (BLACK, WHITE):
+            # ReversiAI opens with random moves, the same ones in both games of a pair
+            random.seed(seed * 1000003 + pair)
+            engines = {tuned: ai.ReversiAI(level, weights=weights),
+                       BLACK + WHITE - tuned: ai.ReversiAI(level, weights=ai.DEFAULT_WEIGHTS)}
+            game = Reversi()
+            while not game.over:
+                engine = engines[game.current]
+                game.put(engine.findBestStep(game, cancelled=lambda: engine.nodeCount >= nodes))
+            _, ccBlack, ccWhite = game.chessCount
+            diff = ccBlack - ccWhite if tuned == BLACK else ccWhite - ccBlack
+            total += 1 if diff > 0 else 0.5 if diff == 0 else 0
+    return total / (pairs * 2)
+
+
+def probCutSamples(records, level, maxDepth, minEmpties, maxEmpties, count, seed=0):
+    """
+    Search a random position of each record, up to count of them, with a full window at
+    every depth up to maxDepth. Yields (stage, [score at depth 1, 2, ...]), leaving out
+    the positions with a won or lost ending in sight, which say nothing about the evaluator.
+    """
+    rng = random.Random(seed)
+    engine = ai.ReversiAI(level, probCut=ai.NO_PROBCUT)
+    found = 0
+    for rec in records:
+        moves = list(rec.moves())
+        plies = [i for i in range(len(moves) + 1) if minEmpties <= BS * BS - 4 - i <= maxEmpties]
+        if not plies:
+            continue
+        game = Reversi()
+        for step in moves[:rng.choice(plies)]:
+            game.put(step)
+        if game.over:
+            continue
+        scores = []
+        for depth in range(1, maxDepth + 1):
+            score, _ = engine.heuristicSearch(game.copy(), game.current, depth, -ai.inf, ai.inf)
+            scores.append(score)
+        if max(abs(score) for score in scores) >= ai.inf:
+            continue
+        yield ai.gameStage(game), scores
+        found += 1
+        if found >= count:
+            return
+
+
+def fitProbCut(samples, evaluator, maxDepth, minSamples=MIN_SAMPLES):
+    """
+    Fit deep = a * shallow + b by least squares, for each stage and pair of depths
+    in PROBCUT_PAIRS. Returns the cuts in the format of the file ai.loadProbCut reads.
+    """
+    byStage = {}
+    for stage, scores in samples:
+        byStage.setdefault(stage, []).append(scores)
+    cuts = []
+    for stage, rows in sorted(byStage.items()):
+        if len(rows) < minSamples:
+            continue
+        rows = np.array(rows, dtype=np.float64)
+        for depth, shallow in PROBCUT_PAIRS:
+            if depth > maxDepth:
+                continue
+            x, y = rows[:, shallow - 1], rows[:, depth - 1]
+            a, b = np.polyfit(x, y, 1)
+            sigma = float(np.std(y - (a * x + b), ddof=2))
+            if a <= 0:
+                continue  # The shallow search predicts nothing
+            cuts.append({
+                'evaluator': evaluator, 'stage': stage, 'depth': depth, 'shallow': shallow,
+                'a': round(float(a), 4), 'b': round(float(b), 2), 'sigma': round(sigma, 2),
+                'r': round(float(np.corrcoef(x, y)[0, 1]), 4), 'samples': len(rows),
+            })
+    return cuts
+
+
+def fit(args):
+    start = time.monotonic()
+
+    def records():
+        for path in args.files:
+            with record.openRecords(path) as f:
+                yield from record.readRecords(f)
+
+    weights = fitWeights(records(), args.min_empties, args.max_empties)
+    elapsed = time.monotonic() - start
+    print("Fitted {} positions in {:.2f}s ({:.0f} positions/sec), R^2: {}".format(
+        weights['positions'], elapsed, weights['positions'] / elapsed, weights['r2']))
+    for row in weights['SCORE']:
+        print(" ".join("{:6d}".format(w) for w in row))
+    print("LIBERTY {LIBERTY}, BONUS {BONUS}, STABILITY {STABILITY}, MOBILITY {MOBILITY}, "
+          "POTENTIAL {POTENTIAL}, FRONTIER {FRONTIER}".format(**weights))
+    with open(args.output, "w") as f:
+        json.dump(weights, f, indent=2)
+    print("Written to {}".format(args.output))
+    return 0
+
+
+def compare(args):
+    weights = ai.loadWeights(args.weights)
+    print("Level {}, {} games per budget, {} against the built-in weights".format(args.level, args.games, args.weights))
+    for nodes in args.nodes:
+        start = time.monotonic()
+        score = playMatch(weights, args.level, nodes, args.games, args.seed)
+        print("{:8d} nodes/move: scored {:5.1f}% in {:.1f}s".format(nodes, score * 100, time.monotonic() - start))
+    return 0
+
+
+def probcut(args):
+    start = time.monotonic()
+
+    def records():
+        for path in args.files:
+            with record.openRecords(path) as f:
+                yield from record.readRecords(f)
+
+    evaluator = ai.AICONFIG[args.level][2]
+    samples = list(probCutSamples(records(), args.level, args.max_depth, args.min_empties, args.max_empties,
+                                  args.positions, args.seed))
+    print("Searched {} positions in {:.1f}s".format(len(samples), time.monotonic() - start))
+    cuts = fitProbCut(samples, evaluator, args.max_depth)
+    print("stage depth shallow        a        b    sigma      r  samples")
+    for c in cuts:
+        print("{stage:5d} {depth:5d} {shallow:7d} {a:8.3f} {b:8.1f} {sigma:8.1f} {r:6.3f} {samples:8d}".format(**c))
+
+    # Keep the calibration of the other evaluators
+    try:
+        with open(args.output) as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        saved = {'cuts': []}
+    saved['cuts'] = [c for c in saved['cuts'] if c['evaluator'] != evaluator] + cuts
+    saved['threshold'] = args.threshold
+    saved['extraDepth'] = args.extra_depth
+    with open(args.output, "w") as f:
+        json.dump(saved, f, indent=2)
+    print("Written to {}".format(args.output))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit evaluation weights to self-play games")
+    sub = parser.add_subparsers(dest="command")
+    p = sub.add_parser("fit", help="Fit weights to record files")
+    p.add_argument("--min-empties", type=int, default=14)
+    p.add_argument("--max-empties", type=int, default=44)
+    p.add_argument("--output", default=ai.WEIGHTS_FILE)
+    p.add_argument("files", nargs="+")
+    p = sub.add_parser("compare", help="Play fitted weights against the built-in ones")
+    p.add_argument("--level", type=int, default=7, help="A level that evaluates with heuristicEval_3 or 4")
+    p.add_argument("--nodes", type=int, nargs="+", default=[2000, 10000, 50000], help="Node budgets per move")
+    p.add_argument("--games", type=int, default=20)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("weights")
+    p = sub.add_parser("probcut", help="Calibrate ProbCut for the evaluator of a level")
+    p.add_argument("--level", type=int, default=7)
+    p.add_argument("--max-depth", type=int, default=6, help="Deepest search to predict")
+    p.add_argument("--positions", type=int, default=300)
+    p.add_argument("--min-empties", type=int, default=20)
+    p.add_argument("--max-empties", type=int, default=50)
+    p.add_argument("--threshold", type=float, default=ai.PROBCUT_THRESHOLD)
+    p.add_argument("--extra-depth", type=int, default=1, help="Plies the levels using it search deeper")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--output", default=ai.PROBCUT_FILE)
+    p.add_argument("files", nargs="+")
+    args = parser.parse_args()
+    if args.command == "fit":
+        return fit(args)
+    elif args.command == "compare":
+        return compare(args)
+    elif args.command == "probcut":
+        return probcut(args)
+    parser.print_help()
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())